@@ -0,0 +1,258 @@
+import django_filters
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.crypto import get_random_string
+from django.utils.translation import gettext as _
+from django_filters.rest_framework import DjangoFilterBackend, FilterSet
+from pretix.api.serializers.i18n import I18nAwareModelSerializer
+from pretix.base.models import LogEntry
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .availability import forget_missing_rooms
+from .imports import ImportRow, import_rooms
+from .models import OrderRoom, Room, normalize_room_name
+from .pagination import KeysetPagination
+from .stats import invalidate_metrics
+
+
+class RoomMemberSerializer(serializers.ModelSerializer):
+    order = serializers.SlugRelatedField(slug_field="code", read_only=True)
+
+    class Meta:
+        model = OrderRoom
+        fields = ("order", "is_admin")
+
+
+class RoomSerializer(I18nAwareModelSerializer):
+    members = serializers.IntegerField(read_only=True)
+    orders = RoomMemberSerializer(source="orderrooms", many=True, read_only=True)
+
+    class Meta:
+        model = Room
+        fields = (
+            "id",
+            "name",
+            "subevent",
+            "capacity",
+            "created",
+            "modified",
+            "members",
+            "orders",
+        )
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class RoomCreateSerializer(I18nAwareModelSerializer):
+    class Meta:
+        model = Room
+        fields = ("name", "subevent", "capacity", "password")
+        extra_kwargs = {"password": {"write_only": True}}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["subevent"].queryset = self.context["event"].subevents.all()
+
+    def validate_name(self, value):
+        return " ".join(value.split())
+
+
+class RoomAssignmentSerializer(serializers.Serializer):
+    order = serializers.CharField()
+    room = serializers.IntegerField(required=False)
+    room_name = serializers.CharField(
+        required=False, max_length=Room._meta.get_field("name").max_length
+    )
+    is_admin = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if ("room" in data) == ("room_name" in data):
+            raise ValidationError(_("Please specify either room or room_name."))
+        return data
+
+
+class RoomFilter(FilterSet):
+    modified_since = django_filters.IsoDateTimeFilter(
+        field_name="modified", lookup_expr="gte"
+    )
+    subevent = django_filters.NumberFilter(field_name="subevent_id")
+
+    class Meta:
+        model = Room
+        fields = ("modified_since", "subevent")
+
+
+class RoomViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Rooms of an event with their number of members and member orders.
+
+    Pages are fetched with a constant number of queries: member counts are
+    annotated from the occupancy counters and the member orders of all rooms of a
+    page are loaded with one further query. With ``?fields=``, only the listed
+    fields are returned and the queries for the others are skipped, e.g.
+    ``?fields=id`` lists the IDs of all rooms to find deleted ones.
+
+    The bulk endpoints accept arrays and write all of them in a single
+    transaction, or nothing if any entry is invalid.
+    """
+
+    serializer_class = RoomSerializer
+    queryset = Room.objects.none()
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = RoomFilter
+    lookup_field = "id"
+    permission = "event.orders:read"
+    write_permission = "event.orders:write"
+
+    def get_fields(self):
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(fields) - set(RoomSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError(
+                {"fields": [_("Unknown fields: {}").format(", ".join(sorted(unknown)))]}
+            )
+        return fields
+
+    def get_serializer_context(self):
+        ctx = super().get_serializer_context()
+        ctx["event"] = self.request.event
+        return ctx
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault("fields", self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        fields = self.get_fields()
+        qs = self.request.event.rooms.all()
+        if fields is None or "members" in fields:
+            qs = qs.with_members()
+        if fields is None or "orders" in fields:
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "orderrooms",
+                    queryset=OrderRoom.objects.select_related("order")
+                    .only("room", "is_admin", "order__code")
+                    .order_by("order__code"),
+                )
+            )
+        return qs
+
+    @action(detail=False, methods=["POST"])
+    def bulk_create(self, request, *args, **kwargs):
+        event = request.event
+        serializer = RoomCreateSerializer(
+            data=request.data, many=True, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+
+        keys = [normalize_room_name(d["name"]) for d in serializer.validated_data]
+        taken = set(
+            event.rooms.filter(name_key__in=keys).values_list("name_key", flat=True)
+        )
+        errors = []
+        for key in keys:
+            if key in taken:
+                errors.append({"name": [_("A room with this name already exists.")]})
+            else:
+                errors.append({})
+            taken.add(key)
+        if any(errors):
+            raise ValidationError(errors)
+
+        with transaction.atomic():
+            rooms = Room.objects.bulk_create(
+                [
+                    Room(
+                        event=event,
+                        name=d["name"],
+                        name_key=key,
+                        subevent=d.get("subevent"),
+                        capacity=d.get("capacity"),
+                        password=d.get("password") or get_random_string(16),
+                    )
+                    for d, key in zip(serializer.validated_data, keys)
+                ]
+            )
+            LogEntry.bulk_create_and_postprocess(
+                [
+                    room.log_action(
+                        "pretix_roomsharing.room.created",
+                        data={
+                            "name": room.name,
+                            "subevent": room.subevent_id,
+                            "capacity": room.capacity,
+                        },
+                        user=request.user,
+                        auth=request.auth,
+                        save=False,
+                    )
+                    for room in rooms
+                ]
+            )
+            transaction.on_commit(lambda: invalidate_metrics(event.pk))
+            transaction.on_commit(lambda: forget_missing_rooms(rooms))
+
+        for room in rooms:
+            room.members = 0
+        return Response(
+            RoomSerializer(
+                rooms,
+                many=True,
+                fields=[f for f in RoomSerializer.Meta.fields if f != "orders"],
+                context=self.get_serializer_context(),
+            ).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(detail=False, methods=["POST"])
+    def bulk_assign(self, request, *args, **kwargs):
+        """
+        Moves orders into rooms, given by ID or by name. Rooms given by a name
+        that does not exist yet are created, like in the room import.
+        """
+        event = request.event
+        serializer = RoomAssignmentSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        names = dict(
+            event.rooms.filter(
+                pk__in={a["room"] for a in serializer.validated_data if "room" in a}
+            ).values_list("pk", "name")
+        )
+        rows = []
+        errors = []
+        for index, a in enumerate(serializer.validated_data):
+            if "room" in a and a["room"] not in names:
+                errors.append((index, _("Unknown room: {id}").format(id=a["room"])))
+            rows.append(
+                ImportRow(
+                    index,
+                    a["order"].upper(),
+                    names.get(a.get("room"))
+                    or " ".join(a.get("room_name", "").split()),
+                    "yes" if a["is_admin"] else "no",
+                )
+            )
+        if not errors:
+            errors, result = import_rooms(
+                event, rows, user=request.user, auth=request.auth
+            )
+        if errors:
+            # Same shape as the errors of a list serializer
+            details = [{} for row in rows]
+            for index, message in errors:
+                details[index].setdefault("non_field_errors", []).append(message)
+            raise ValidationError(details)
+        return Response(result)
@@ -0,0 +1,117 @@
+import hashlib
+import hmac
+from django.core.cache import cache
+from pretix.helpers.http import get_client_ip
+
+from .checkoutflow import RoomCreateForm, RoomJoinForm
+from .models import Room, normalize_room_name
+from .reservations import room_name_reserved
+
+# The checkout validates room names and join passwords while they are typed.
+# Every check is one lookup on the name index. Names without a room are
+# remembered for a few seconds, so repeated checks of a mistyped name do not
+# reach the database. The forms still validate everything when submitted.
+MISSING_TIMEOUT = 10
+RATE_LIMIT = 30
+RATE_LIMIT_WINDOW = 60
+# Passwords of a single room may only be tried this often per window, no matter
+# how many clients try them.
+ROOM_RATE_LIMIT = 30
+
+
+def _digest(value):
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+def _missing_key(event_id, name):
+    return "pretix_roomsharing:room_missing:%d:%s" % (
+        event_id,
+        _digest(normalize_room_name(name)),
+    )
+
+
+def forget_missing_room(room):
+    """
+    Forgets that no room with the name of the given room exists. Call it once
+    the room is committed, or a check in between remembers it as missing again.
+    """
+    cache.delete(_missing_key(room.event_id, room.name))
+
+
+def forget_missing_rooms(rooms):
+    """
+    Like :py:func:`forget_missing_room` for rooms created in bulk, which does
+    not send ``post_save``. Call it once the rooms are committed.
+    """
+    cache.delete_many([_missing_key(r.event_id, r.name) for r in rooms])
+
+
+def find_room(event, name):
+    """
+    Returns the room of the event with the given name, preferring an exact
+    match like :py:class:`RoomJoinForm`, or ``None``.
+    """
+    key = _missing_key(event.pk, name)
+    if cache.get(key):
+        return None
+    candidates = list(
+        Room.objects.filter(event=event)
+        .by_name(name)
+        .only("pk", "name", "password", "capacity")
+    )
+    if not candidates:
+        cache.set(key, True, MISSING_TIMEOUT)
+        return None
+    return next((r for r in candidates if r.name == name), candidates[0])
+
+
+def check_room(event, mode, name, password="", cart_id=None):
+    """
+    Returns ``(field, message)`` for the first problem with the given room name
+    and, for joins, password, or ``(None, None)`` if there is none.
+    """
+    if mode == "create":
+        messages = RoomCreateForm.error_messages
+        taken = Room.objects.filter(event=event).by_name(name).exists()
+        if taken or room_name_reserved(event, name, cart_id):
+            return "name", messages["duplicate_name"]
+    elif mode == "join":
+        messages = RoomJoinForm.error_messages
+        room = find_room(event, name)
+        if room is None:
+            return "name", messages["room_not_found"]
+        if password and not hmac.compare_digest(
+            room.password.encode(), password.encode()
+        ):
+            return "password", messages["pw_mismatch"]
+    return None, None
+
+
+def _count(key):
+    cache.add(key, 0, RATE_LIMIT_WINDOW)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The window ended in between
+        cache.add(key, 1, RATE_LIMIT_WINDOW)
+        return 1
+
+
+def rate_limited(request, name=None):
+    """
+    Counts a check by the client of the request and returns whether it made
+    more than ``RATE_LIMIT`` checks within the current window. If the name of a
+    room is given, e.g. to check a password, checks of that room by all clients
+    together are limited to ``ROOM_RATE_LIMIT`` as well.
+    """
+    client = get_client_ip(request) or request.session.session_key or ""
+    key = "pretix_roomsharing:room_check:%d:%s" % (request.event.pk, _digest(client))
+    if _count(key) > RATE_LIMIT:
+        return True
+    if name:
+        key = "pretix_roomsharing:room_check_room:%d:%s" % (
+            request.event.pk,
+            _digest(normalize_room_name(name)),
+        )
+        return _count(key) > ROOM_RATE_LIMIT
+    return False
@@ -0,0 +1,183 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+from pretix.base.models import LogEntry, Order, OrderPosition
+
+from .eligibility import product_capacity
+from .fragments import bump_order_versions, bump_room_versions
+from .models import OrderRoom, Room, RoomOccupancy
+from .occupancy import RoomFull, WrongDate, refresh_occupancy
+from .stats import invalidate_metrics
+
+# These operations work on any number of rooms with a constant number of queries.
+# They bypass the model signals of OrderRoom and Room, which would load every row,
+# so they take care of occupancy, cached fragments and metrics themselves.
+
+
+def _order_log(event, order_id, action, data, user):
+    return Order(pk=order_id, event=event).log_action(
+        action, data=data, user=user, save=False
+    )
+
+
+def _room_log(room, action, data, user):
+    return room.log_action(action, data=data, user=user, save=False)
+
+
+def _finish(event, order_ids=(), room_ids=()):
+    order_ids = list(order_ids)
+    room_ids = list(room_ids)
+    transaction.on_commit(lambda: bump_order_versions(order_ids))
+    transaction.on_commit(lambda: bump_room_versions(room_ids))
+    transaction.on_commit(lambda: invalidate_metrics(event.pk))
+
+
+@transaction.atomic
+def delete_rooms(event, room_ids, user=None):
+    """
+    Deletes the given rooms of the event. Their members are removed from them
+    first and will be treated as orders without a room.
+    """
+    rooms = list(event.rooms.filter(pk__in=room_ids))
+    members = list(
+        OrderRoom.objects.filter(room__in=rooms).values_list("order_id", "room_id")
+    )
+    LogEntry.bulk_create_and_postprocess(
+        [
+            _room_log(
+                room, "pretix_roomsharing.room.deleted", {"name": room.name}, user
+            )
+            for room in rooms
+        ]
+        + [
+            _order_log(
+                event,
+                order_id,
+                "pretix_roomsharing.order.deleted",
+                {"room": room_id},
+                user,
+            )
+            for order_id, room_id in members
+        ]
+    )
+    OrderRoom.objects.filter(room__in=rooms)._raw_delete(OrderRoom.objects.db)
+    event.rooms.filter(pk__in=[r.pk for r in rooms]).delete()
+    _finish(event, order_ids=[order_id for order_id, room_id in members])
+    return len(rooms)
+
+
+def _check_move(event, rooms, target, members):
+    """
+    Raises ``WrongDate`` if the members of ``rooms`` are for dates ``target``
+    does not cover, and ``RoomFull`` if they do not fit into its remaining
+    capacity. Like :py:func:`join_room`, a single order always fits into an empty
+    room.
+    """
+    room_ids = [r.pk for r in rooms] + [target.pk]
+    # Serializes the check with concurrent joins of the target
+    capacity = (
+        Room.objects.select_for_update()
+        .values_list("capacity", flat=True)
+        .get(pk=target.pk)
+    )
+    occupancies = (
+        RoomOccupancy.objects.filter(room__in=room_ids)
+        .order_by()
+        .values_list("room_id", "subevent_id")
+        .annotate(s=Sum("size"))
+    )
+    occupied = moving = 0
+    target_dates = {target.subevent_id} - {None}
+    moving_dates = set()
+    for room_id, subevent_id, size in occupancies:
+        if room_id == target.pk:
+            occupied += size
+            target_dates.add(subevent_id)
+        else:
+            moving += size
+            moving_dates.add(subevent_id)
+
+    if target_dates and moving_dates - target_dates:
+        raise WrongDate()
+    if not capacity:
+        capacity = product_capacity(
+            event,
+            set(
+                OrderPosition.objects.filter(
+                    order__orderroom__room__in=room_ids,
+                    order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+                ).values_list("item_id", flat=True)
+            ),
+        )
+    if capacity is not None and occupied + moving > capacity:
+        if occupied or len(members) > 1:
+            raise RoomFull()
+
+
+@transaction.atomic
+def move_members(event, room_ids, target, user=None, delete_sources=False):
+    """
+    Moves all members of the given rooms into ``target``. They keep their orders,
+    but lose their administrator status. With ``delete_sources``, the emptied
+    rooms are deleted, which merges them into ``target``.
+
+    Raises ``WrongDate`` or ``RoomFull`` without moving anybody if the members
+    are for dates the target does not cover or do not fit into it.
+    """
+    rooms = list(event.rooms.filter(pk__in=room_ids).exclude(pk=target.pk))
+    members = list(
+        OrderRoom.objects.filter(room__in=rooms).values_list("order_id", "room_id")
+    )
+    _check_move(event, rooms, target, members)
+    OrderRoom.objects.filter(room__in=rooms).update(room=target, is_admin=False)
+
+    logentries = [
+        _order_log(
+            event,
+            order_id,
+            "pretix_roomsharing.order.moved",
+            {"room": target.pk, "previous_room": room_id},
+            user,
+        )
+        for order_id, room_id in members
+    ]
+    if delete_sources:
+        logentries += [
+            _room_log(
+                room,
+                "pretix_roomsharing.room.deleted",
+                {"name": room.name, "merged_into": target.pk},
+                user,
+            )
+            for room in rooms
+        ]
+        event.rooms.filter(pk__in=[r.pk for r in rooms]).delete()
+    LogEntry.bulk_create_and_postprocess(logentries)
+
+    if not delete_sources:
+        refresh_occupancy([r.pk for r in rooms])
+    refresh_occupancy([target.pk])
+    target.pin_subevent(next((r.subevent_id for r in rooms if r.subevent_id), None))
+    _finish(event, order_ids=[order_id for order_id, room_id in members])
+    return len(members)
+
+
+@transaction.atomic
+def reset_passwords(event, room_ids, user=None):
+    """
+    Gives each of the given rooms a new random password.
+    """
+    rooms = list(event.rooms.filter(pk__in=room_ids))
+    for room in rooms:
+        room.password = get_random_string(12)
+        room.modified = now()
+    Room.objects.bulk_update(rooms, ["password", "modified"], batch_size=1000)
+    LogEntry.bulk_create_and_postprocess(
+        [
+            _room_log(room, "pretix_roomsharing.room.password_reset", {}, user)
+            for room in rooms
+        ]
+    )
+    _finish(event, room_ids=[r.pk for r in rooms])
+    return len(rooms)
@@ -1,15 +1,18 @@
 from django import forms
 from django.contrib import messages
-from django.db.transaction import atomic
 from django.shortcuts import redirect
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _, pgettext_lazy
 from pretix.base.models import SubEvent
 from pretix.presale.checkoutflow import TemplateFlowStep
 from pretix.presale.views import CartMixin, get_cart
-from pretix.presale.views.cart import cart_session
+from pretix.presale.views.cart import cart_session, get_or_create_cart_id
 
-from .models import Room
+from .eligibility import needs_room
+from .invites import remembered_invite, room_for_invite
+from .models import Room, normalize_room_name
+from .occupancy import has_space
+from .reservations import release_room_name, reserve_room_name, room_name_reserved
 
 
 class RoomCreateForm(forms.Form):
@@ -36,7 +39,7 @@ class RoomCreateForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         self.event = kwargs.pop("event")
-        self.room = kwargs.pop("current", None)
+        self.cart_id = kwargs.pop("cart_id", None)
         super().__init__(*args, **kwargs)
 
     def clean_name(self):
@@ -47,9 +50,8 @@ class RoomCreateForm(forms.Form):
             )
 
         if (
-            Room.objects.filter(event=self.event, name=name)
-            .exclude(pk=(self.room.pk if self.room else 0))
-            .exists()
+            Room.objects.filter(event=self.event).by_name(name).exists()
+            or room_name_reserved(self.event, name, self.cart_id)
         ):
             raise forms.ValidationError(
                 self.error_messages["duplicate_name"], code="duplicate_name"
@@ -76,6 +78,16 @@ class RoomJoinForm(forms.Form):
         "pw_mismatch": _(
             "The password does not match. Please enter the password exactly as your friends send it."
         ),
+        "room_full": _(
+            "This room is already full. Please choose a different room or create a new one."
+        ),
+        "room_busy": _(
+            "Many people are joining this room right now. Please try again in a moment."
+        ),
+        "invite_invalid": _(
+            "This invite link is no longer valid. Please ask your friends for the room "
+            "name and password."
+        ),
     }
 
     name = forms.CharField(
@@ -90,12 +102,35 @@ class RoomJoinForm(forms.Form):
         widget=forms.PasswordInput,
         required=False,
     )
+    invite = forms.CharField(required=False, widget=forms.HiddenInput)
 
     def __init__(self, *args, **kwargs):
         self.event = kwargs.pop("event")
         super().__init__(*args, **kwargs)
 
+    @cached_property
+    def invite_room(self):
+        """
+        The room of the invite token this form has been given, if it is valid.
+        """
+        if self.is_bound:
+            token = self.data.get(self.add_prefix("invite"))
+        else:
+            token = self.initial.get("invite")
+        return room_for_invite(self.event, token) if token else None
+
     def clean(self):
+        if self.cleaned_data.get("invite"):
+            if self.invite_room is None:
+                raise forms.ValidationError(
+                    {
+                        "name": self.error_messages["invite_invalid"],
+                    },
+                    code="invite_invalid",
+                )
+            self.cleaned_data["room"] = self.invite_room
+            return self.cleaned_data
+
         name = self.cleaned_data.get("name")
         password = self.cleaned_data.get("password")
 
@@ -115,9 +150,14 @@ class RoomJoinForm(forms.Form):
                 code="required",
             )
 
-        try:
-            room = Room.objects.get(event=self.event, name=name)
-        except Room.DoesNotExist:
+        # Names are unique per normalized key for new rooms, but rooms created
+        # before normalization may still collide. Prefer the exact match then.
+        candidates = list(Room.objects.filter(event=self.event).by_name(name))
+        room = next(
+            (r for r in candidates if r.name == name),
+            candidates[0] if candidates else None,
+        )
+        if room is None:
             raise forms.ValidationError(
                 {
                     "name": self.error_messages["room_not_found"],
@@ -137,6 +177,92 @@ class RoomJoinForm(forms.Form):
         return self.cleaned_data
 
 
+class RoomCheckoutState:
+    """
+    The room choice of a cart and everything derived from it, resolved at most
+    once per request. pretix evaluates ``is_completed`` of every step on every
+    checkout page, and the step itself needs the same data again while handling
+    the request.
+
+    Whether a joined room and the cart are for the same date is also kept in
+    the cart session, keyed on the room and a version of the cart, so following
+    requests do not need to look up the room again.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.event = request.event
+        self.session = cart_session(request)
+
+    @classmethod
+    def of(cls, request):
+        if not hasattr(request, "_roomsharing_checkout"):
+            request._roomsharing_checkout = cls(request)
+        return request._roomsharing_checkout
+
+    @cached_property
+    def positions(self):
+        # pretix keeps the cart of a request, so this only queries the database
+        # if no other step has needed the cart before
+        return list(get_cart(self.request))
+
+    @cached_property
+    def cart_version(self):
+        return ",".join(
+            "%d:%s" % (p.pk, p.subevent_id)
+            for p in sorted(self.positions, key=lambda p: p.pk)
+        )
+
+    @cached_property
+    def cart_subevents(self):
+        return {p.subevent_id for p in self.positions}
+
+    @cached_property
+    def needs_room(self):
+        return needs_room(self.event, self.positions)
+
+    @cached_property
+    def joined_room(self):
+        if "room_join" not in self.session:
+            return None
+        return (
+            Room.objects.filter(event=self.event, pk=self.session["room_join"])
+            .select_related("subevent")
+            .first()
+        )
+
+    @cached_property
+    def joined_room_subevents(self):
+        """
+        The dates the joined room covers, i.e. the dates of its members' tickets
+        and the date it has been pinned to.
+        """
+        room = self.joined_room
+        subevents = set(
+            room.occupancies.filter(subevent__isnull=False).values_list(
+                "subevent_id", flat=True
+            )
+        )
+        if room.subevent_id:
+            subevents.add(room.subevent_id)
+        return subevents
+
+    def joined_room_matches_cart(self):
+        """
+        Returns whether all dates of the cart are covered by the joined room.
+        """
+        key = [self.session.get("room_join"), self.cart_version]
+        if self.session.get("room_join_checked") == key:
+            return True
+        if not self.joined_room or not self.joined_room_subevents:
+            # Not cached, the room's dates are known once its first order is placed
+            return True
+        if any(c not in self.joined_room_subevents for c in self.cart_subevents):
+            return False
+        self.session["room_join_checked"] = key
+        return True
+
+
 class RoomStep(CartMixin, TemplateFlowStep):
     priority = 180
     identifier = "room"
@@ -144,7 +270,6 @@ class RoomStep(CartMixin, TemplateFlowStep):
     icon = "group"
     label = pgettext_lazy("checkoutflow", "Room")
 
-    @atomic
     def post(self, request):
         self.request = request
 
@@ -152,28 +277,38 @@ class RoomStep(CartMixin, TemplateFlowStep):
 
         if self.cart_session["room_mode"] == "join":
             if self.join_form.is_valid():
-                self.cart_session["room_join"] = self.join_form.cleaned_data["room"].pk
-                return redirect(self.get_next_url(request))
+                room = self.join_form.cleaned_data["room"]
+                positions = self.state.positions
+                if has_space(
+                    room,
+                    sum(1 for p in positions if p.item.admission),
+                    {p.item_id for p in positions},
+                ):
+                    self.cart_session["room_join"] = room.pk
+                    self.release_room_name()
+                    return redirect(self.get_next_url(request))
+                self.join_form.add_error(
+                    "name", self.join_form.error_messages["room_full"]
+                )
 
         elif self.cart_session["room_mode"] == "create":
             if self.create_form.is_valid():
-                room = Room(
-                    event=self.event,
+                # The room is only created once the order is placed, until then
+                # its name is reserved for the cart.
+                name = self.create_form.cleaned_data["name"]
+                if reserve_room_name(self.event, name, self.cart_id):
+                    self.release_room_name(keep=name)
+                    self.cart_session["room_create"] = {
+                        "name": name,
+                        "password": self.create_form.cleaned_data["password"],
+                        "cart": self.cart_id,
+                    }
+                    return redirect(self.get_next_url(request))
+                self.create_form.add_error(
+                    "name", self.create_form.error_messages["duplicate_name"]
                 )
-                if self.cart_session.get("room_create"):
-                    try:
-                        room = Room.objects.get(
-                            event=self.event, pk=self.cart_session["room_create"]
-                        )
-                    except Room.DoesNotExist:
-                        pass
-
-                room.name = self.create_form.cleaned_data["name"]
-                room.password = self.create_form.cleaned_data["password"]
-                room.save()
-                self.cart_session["room_create"] = room.pk
-                return redirect(self.get_next_url(request))
         elif self.cart_session["room_mode"] == "none":
+            self.release_room_name()
             return redirect(self.get_next_url(request))
 
         messages.error(
@@ -182,29 +317,39 @@ class RoomStep(CartMixin, TemplateFlowStep):
         )
         return self.render()
 
+    def release_room_name(self, keep=None):
+        """
+        Releases the name reserved for a room to be created by this cart, unless
+        it is the same as ``keep``.
+        """
+        created = self.cart_session.get("room_create")
+        if not isinstance(created, dict):
+            return
+        if keep is None or normalize_room_name(keep) != normalize_room_name(
+            created["name"]
+        ):
+            release_room_name(self.event, created["name"], self.cart_id)
+            del self.cart_session["room_create"]
+
+    @cached_property
+    def cart_id(self):
+        return get_or_create_cart_id(self.request)
+
     @cached_property
     def create_form(self):
         initial = {}
-        current = None
-        if (
-            self.cart_session.get("room_mode") == "create"
-            and "room_create" in self.cart_session
+        created = self.cart_session.get("room_create")
+        if self.cart_session.get("room_mode") == "create" and isinstance(
+            created, dict
         ):
-            try:
-                current = Room.objects.get(
-                    event=self.event, pk=self.cart_session["room_create"]
-                )
-            except Room.DoesNotExist:
-                pass
-            else:
-                initial["name"] = current.name
-                initial["password"] = current.password
+            initial["name"] = created["name"]
+            initial["password"] = created["password"]
 
         return RoomCreateForm(
             event=self.event,
             prefix="create",
             initial=initial,
-            current=current,
+            cart_id=self.cart_id,
             data=self.request.POST
             if self.request.method == "POST"
             and self.request.POST.get("room_mode") == "create"
@@ -213,20 +358,11 @@ class RoomStep(CartMixin, TemplateFlowStep):
 
     @cached_property
     def join_form(self):
-        initial = {}
-        if (
-            self.cart_session.get("room_mode") == "join"
-            and "room_join" in self.cart_session
-        ):
-            try:
-                room = Room.objects.get(
-                    event=self.event, pk=self.cart_session["room_join"]
-                )
-            except Room.DoesNotExist:
-                pass
-            else:
-                initial["name"] = room.name
-                initial["password"] = room.password
+        initial = {"invite": remembered_invite(self.request)}
+        room = self.state.joined_room
+        if self.cart_session.get("room_mode") == "join" and room:
+            initial["name"] = room.name
+            initial["password"] = room.password
 
         return RoomJoinForm(
             event=self.event,
@@ -238,9 +374,13 @@ class RoomStep(CartMixin, TemplateFlowStep):
             else None,
         )
 
-    @cached_property
+    @property
+    def state(self):
+        return RoomCheckoutState.of(self.request)
+
+    @property
     def cart_session(self):
-        return cart_session(self.request)
+        return self.state.session
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
@@ -248,66 +388,44 @@ class RoomStep(CartMixin, TemplateFlowStep):
         ctx["join_form"] = self.join_form
         ctx["cart"] = self.get_cart()
         ctx["selected"] = self.cart_session.get("room_mode", "")
-        order_has_room = False
-        for cartPosition in self.get_cart()["positions"]:
-            if (
-                str(cartPosition.item.id)
-                in self.request.event.settings.roomsharing__products
-            ):
-                order_has_room = True
-
-        ctx["order_has_room"] = order_has_room
+        if not ctx["selected"] and self.join_form.invite_room:
+            ctx["selected"] = "join"
+        ctx["order_has_room"] = self.state.needs_room
         return ctx
 
     def is_completed(self, request, warn=False):
+        state = RoomCheckoutState.of(request)
         if (
             request.event.has_subevents
-            and cart_session(request).get("room_mode") == "join"
-            and "room_join" in cart_session(request)
+            and state.session.get("room_mode") == "join"
+            and "room_join" in state.session
         ):
-            try:
-                room = Room.objects.get(
-                    event=self.event, pk=cart_session(request)["room_join"]
-                )
-                room_subevents = set(
-                    c["order__all_positions__subevent"]
-                    for c in room.orderrooms.filter(
-                        order__all_positions__canceled=False
+            if not state.joined_room_matches_cart():
+                if warn:
+                    room_subevents = state.joined_room_subevents
+                    messages.warning(
+                        request,
+                        _(
+                            """
+                                You requested to join a room that participates in "{subevent_room}",
+                                while you chose to participate in "{subevent_cart}".
+                                Please choose a different room.
+                            """
+                        ).format(
+                            subevent_room=", ".join(
+                                str(s.name)
+                                for s in SubEvent.objects.filter(pk__in=room_subevents)
+                            ),
+                            subevent_cart=next(
+                                p.subevent.name
+                                for p in state.positions
+                                if p.subevent_id not in room_subevents
+                            ),
+                        ),
                     )
-                    .values("order__all_positions__subevent")
-                    .distinct()
-                )
-                # TODO: Validation of same room type
-                # TODO: Validation of max room quantity?
-                if room_subevents:
-                    cart_subevents = set(
-                        c["subevent"]
-                        for c in get_cart(request).values("subevent").distinct()
-                    )
-                    if any(c not in room_subevents for c in cart_subevents):
-                        if warn:
-                            messages.warning(
-                                request,
-                                _(
-                                    """
-                                    You requested to join a room that participates in "{subevent_room}",
-                                    while you chose to participate in "{subevent_cart}".
-                                    Please choose a different room.
-                                """
-                                ).format(
-                                    subevent_room=SubEvent.objects.get(
-                                        pk=list(room_subevents)[0]
-                                    ).name,
-                                    subevent_cart=SubEvent.objects.get(
-                                        pk=list(cart_subevents)[0]
-                                    ).name,
-                                ),
-                            )
-                        return False
-            except Room.DoesNotExist:
-                pass
-
-        return "room_mode" in cart_session(request)
+                return False
+
+        return "room_mode" in state.session
 
     def is_applicable(self, request):
         return True
@@ -0,0 +1,93 @@
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.timezone import now
+from pretix.base.models import Event
+
+from .models import OrderRoom, Room, RoomOccupancy
+from .stats import invalidate_metrics
+
+logger = logging.getLogger(__name__)
+
+# Rooms created by earlier versions in the checkout existed before their order
+# and were left behind by abandoned carts. Since rooms created on purpose in the
+# backend or the API may stay empty for a long time as well, the cleanup only
+# runs for events that enable it, and a room without members is only considered
+# abandoned after a day.
+GRACE_PERIOD = timedelta(days=1)
+CHUNK_SIZE = 1000
+
+
+def cleanup_events():
+    """
+    Returns the events that have the deletion of empty rooms enabled.
+    """
+    return Event.objects.filter(
+        _settings_objects__key="roomsharing__delete_empty_rooms",
+        _settings_objects__value="True",
+    )
+
+
+def empty_rooms(created_before):
+    return Room.objects.filter(
+        created__lt=created_before, event__in=cleanup_events()
+    ).filter(
+        ~Exists(OrderRoom.objects.filter(room=OuterRef("pk"))),
+        ~Exists(RoomOccupancy.objects.filter(room=OuterRef("pk"))),
+    )
+
+
+def delete_empty_rooms(grace_period=GRACE_PERIOD, chunk_size=CHUNK_SIZE):
+    """
+    Deletes all rooms without members that have been created more than
+    ``grace_period`` ago in events that enable it and returns a dict of deleted
+    rooms per event ID.
+
+    Rooms are deleted with one ``DELETE … WHERE id IN (SELECT … LIMIT n)`` per
+    chunk, which checks emptiness in the same statement, so a room that is joined
+    while the cleanup runs is never deleted. Instead of one log entry per room,
+    one entry with the number of deleted rooms is written per event.
+    """
+    created_before = now() - grace_period
+    deleted = {}
+    for event_id in (
+        empty_rooms(created_before)
+        .order_by()
+        .values_list("event_id", flat=True)
+        .distinct()
+    ):
+        chunk = (
+            empty_rooms(created_before)
+            .filter(event_id=event_id)
+            .order_by()
+            .values("pk")[:chunk_size]
+        )
+        count = 0
+        while True:
+            with transaction.atomic():
+                rows = (
+                    empty_rooms(created_before)
+                    .filter(pk__in=chunk)
+                    .order_by()
+                    ._raw_delete(Room.objects.db)
+                )
+            count += rows
+            if rows < chunk_size:
+                break
+        if count:
+            deleted[event_id] = count
+
+    for event in Event.objects.filter(pk__in=deleted):
+        event.log_action(
+            "pretix_roomsharing.rooms.cleaned",
+            data={"count": deleted[event.pk]},
+        )
+        invalidate_metrics(event.pk)
+    if deleted:
+        logger.info(
+            "Deleted %d empty rooms in %d events",
+            sum(deleted.values()),
+            len(deleted),
+        )
+    return deleted
@@ -0,0 +1,81 @@
+from django.db.models import QuerySet
+
+# Changes of the settings and products invalidate the cache, this only limits
+# how long anything written to the database behind their back can go unnoticed.
+CACHE_TIMEOUT = 3600
+
+
+def room_product_ids(event):
+    """
+    Returns the IDs of all products that come with a room as a frozenset.
+    Deleted products are left out.
+
+    The parsed ``roomsharing__products`` setting is kept in the event cache
+    (and on the event object for the rest of the request). Changing the setting
+    calls :py:func:`invalidate_room_products`.
+    """
+    if not hasattr(event, "_roomsharing_products"):
+        ids = event.cache.get("roomsharing_products")
+        if ids is None:
+            ids = frozenset(
+                event.items.filter(
+                    pk__in=[int(i) for i in event.settings.roomsharing__products or []]
+                ).values_list("pk", flat=True)
+            )
+            event.cache.set("roomsharing_products", ids, CACHE_TIMEOUT)
+        event._roomsharing_products = ids
+    return event._roomsharing_products
+
+
+def invalidate_room_products(event):
+    event.cache.delete_many(["roomsharing_products", "roomsharing_capacities"])
+    for attr in ("_roomsharing_products", "_roomsharing_capacities"):
+        if hasattr(event, attr):
+            delattr(event, attr)
+
+
+def needs_room(event, positions):
+    """
+    Returns whether any of the given order or cart positions comes with a room.
+
+    ``positions`` can either be a queryset, which is then checked with a single
+    ``EXISTS`` query, or an already evaluated list of positions, which is
+    checked without hitting the database.
+    """
+    ids = room_product_ids(event)
+    if not ids:
+        return False
+    if isinstance(positions, QuerySet) and positions._result_cache is None:
+        return positions.filter(item_id__in=ids).exists()
+    return any(p.item_id in ids for p in positions)
+
+
+def room_capacities(event):
+    """
+    Returns a dict of the number of beds per room configured for each room
+    product. Products without a configured capacity are left out.
+
+    Cached like :py:func:`room_product_ids`.
+    """
+    if not hasattr(event, "_roomsharing_capacities"):
+        capacities = event.cache.get("roomsharing_capacities")
+        if capacities is None:
+            capacities = {}
+            for item_id in room_product_ids(event):
+                capacity = event.settings.get(
+                    "roomsharing__capacity_%d" % item_id, as_type=int
+                )
+                if capacity:
+                    capacities[item_id] = capacity
+            event.cache.set("roomsharing_capacities", capacities, CACHE_TIMEOUT)
+        event._roomsharing_capacities = capacities
+    return event._roomsharing_capacities
+
+
+def product_capacity(event, item_ids):
+    """
+    Returns the capacity of a room shared by holders of the given products, i.e.
+    the smallest capacity configured for any of them, or ``None`` if there is none.
+    """
+    capacities = room_capacities(event)
+    return min((capacities[i] for i in item_ids if i in capacities), default=None)
@@ -0,0 +1,108 @@
+from collections import OrderedDict, defaultdict
+from django import forms
+from django.utils.translation import gettext as _, gettext_lazy, pgettext, pgettext_lazy
+from pretix.base.exporter import ListExporter
+from pretix.base.models import Order, OrderPosition
+
+from .pagination import KeysetPage
+
+
+class RoomingListExporter(ListExporter):
+    identifier = "roomsharing_roominglist"
+    verbose_name = gettext_lazy("Rooming list")
+    category = pgettext_lazy("export_category", "Rooms")
+    description = gettext_lazy(
+        "Download a spreadsheet with all rooms and the attendees sharing them, e.g. "
+        "to send to your hotel."
+    )
+    repeatable_read = False
+
+    # Rooms are read in chunks of this size, each with one query for all of their
+    # members, so memory use does not grow with the size of the event.
+    chunk_size = 500
+
+    @property
+    def additional_form_fields(self):
+        return OrderedDict(
+            [
+                (
+                    "include_pending",
+                    forms.BooleanField(
+                        label=gettext_lazy("Include pending orders"),
+                        required=False,
+                        initial=True,
+                    ),
+                ),
+            ]
+        )
+
+    def iterate_list(self, form_data):
+        statuses = [Order.STATUS_PAID]
+        if form_data.get("include_pending"):
+            statuses.append(Order.STATUS_PENDING)
+
+        headers = [_("Room name")]
+        if self.event.has_subevents:
+            headers.append(pgettext("subevent", "Date"))
+        headers += [
+            _("Capacity"),
+            _("Order code"),
+            _("Order status"),
+            _("Room administrator"),
+            _("Attendee name"),
+            _("Attendee email"),
+            _("Product"),
+        ]
+        yield headers
+
+        rooms = self.event.rooms.select_related("subevent")
+        members_qs = OrderPosition.objects.filter(
+            order__status__in=statuses,
+            item__admission=True,
+        )
+        # One row per member, and one for every room without any
+        event_members = members_qs.filter(order__orderroom__room__event=self.event)
+        yield self.ProgressSetTotal(
+            total=event_members.count()
+            + rooms.exclude(
+                pk__in=event_members.values("order__orderroom__room")
+            ).count()
+        )
+
+        cursor = None
+        while True:
+            page = KeysetPage(rooms, "name", self.chunk_size, after=cursor)
+            members = defaultdict(list)
+            positions = (
+                members_qs.filter(order__orderroom__room__in=[r.pk for r in page])
+                .select_related("order", "order__orderroom", "item", "variation")
+                .order_by("order__code", "positionid")
+            )
+            for p in positions:
+                members[p.order.orderroom.room_id].append(p)
+
+            for room in page:
+                if room.subevent:
+                    room.subevent.event = self.event
+                row = [room.name]
+                if self.event.has_subevents:
+                    row.append(str(room.subevent) if room.subevent else "")
+                row.append(room.capacity or "")
+                if not members[room.pk]:
+                    yield row + [""] * 6
+                for p in members[room.pk]:
+                    yield row + [
+                        p.order.code,
+                        p.order.get_status_display(),
+                        _("Yes") if p.order.orderroom.is_admin else _("No"),
+                        p.attendee_name or "",
+                        p.attendee_email or "",
+                        str(p.item) + (" – " + str(p.variation) if p.variation else ""),
+                    ]
+
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+    def get_filename(self):
+        return "{}_rooms".format(self.event.slug)
@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+from django.utils.translation import get_language
+
+# Rendered room panels are cached per order and language. A cached panel is
+# only used as long as the version stamps it was rendered with are unchanged:
+#
+# * the order's own stamp changes when the order joins or leaves a room,
+# * the room's stamp changes when the room or its membership changes (including
+#   status changes of member orders, see refresh_occupancy),
+# * the order's last_modified timestamp changes with every change to the order.
+
+TIMEOUT = 24 * 3600
+
+
+def _order_key(order_id):
+    return "pretix_roomsharing:order_version:%d" % order_id
+
+
+def _room_key(room_id):
+    return "pretix_roomsharing:room_version:%d" % room_id
+
+
+def _panel_key(order_id, language):
+    return "pretix_roomsharing:order_info:%d:%s" % (order_id, language)
+
+
+def bump_order_version(order_id):
+    cache.set(_order_key(order_id), get_random_string(12), TIMEOUT)
+
+
+def bump_order_versions(order_ids):
+    cache.set_many(
+        {_order_key(order_id): get_random_string(12) for order_id in order_ids},
+        TIMEOUT,
+    )
+
+
+def bump_room_versions(room_ids):
+    cache.set_many(
+        {_room_key(room_id): get_random_string(12) for room_id in room_ids if room_id},
+        TIMEOUT,
+    )
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, get_random_string(12), TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def cached_order_panel(order, stamp, render):
+    """
+    Returns the room panel of an order from the cache, or renders it by calling
+    ``render()``, which needs to return a tuple of the HTML and the ID of the
+    room shown in it.
+
+    ``stamp`` may contain any further data the panel depends on.
+    """
+    panel_key = _panel_key(order.pk, get_language())
+    values = cache.get_many([panel_key, _order_key(order.pk)])
+    stamp = (values.get(_order_key(order.pk)), order.last_modified, stamp)
+
+    panel = values.get(panel_key)
+    if (
+        panel
+        and stamp[0] is not None
+        and panel["stamp"] == stamp
+        and (
+            not panel["room"]
+            or cache.get(_room_key(panel["room"])) == panel["room_version"]
+        )
+    ):
+        return panel["html"]
+
+    if stamp[0] is None:
+        stamp = (_version(_order_key(order.pk)),) + stamp[1:]
+    html, room_id = render()
+    cache.set(
+        panel_key,
+        {
+            "stamp": stamp,
+            "room": room_id,
+            "room_version": _version(_room_key(room_id)) if room_id else None,
+            "html": html,
+        },
+        TIMEOUT,
+    )
+    return html
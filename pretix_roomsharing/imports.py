@@ -0,0 +1,264 @@
+import csv
+import io
+from collections import namedtuple
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Min
+from django.utils.crypto import get_random_string
+from django.utils.translation import gettext as _, gettext_lazy
+from pretix.base.modelimport import ImportColumn
+from pretix.base.models import LogEntry, Order, OrderPosition
+
+from .availability import forget_missing_rooms
+from .fragments import bump_order_versions
+from .models import OrderRoom, Room, normalize_room_name
+from .occupancy import refresh_occupancy
+from .stats import invalidate_metrics
+
+TRUE_VALUES = {"1", "x", "y", "yes", "true", "admin"}
+FALSE_VALUES = {"", "0", "n", "no", "false"}
+HEADER_VALUES = {"order", "order code", "code"}
+
+
+ImportRow = namedtuple("ImportRow", "line code name admin")
+
+
+def parse_rows(f):
+    """
+    Reads ``(order code, room name, administrator flag)`` rows from an uploaded
+    CSV file. A header row is skipped, the administrator column is optional.
+    """
+    content = f.read()
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig", errors="replace")
+    try:
+        dialect = csv.Sniffer().sniff(content[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = []
+    for line, cols in enumerate(csv.reader(io.StringIO(content), dialect), start=1):
+        cols = [c.strip() for c in cols] + ["", "", ""]
+        if not any(cols):
+            continue
+        if line == 1 and cols[0].lower() in HEADER_VALUES:
+            continue
+        rows.append(
+            ImportRow(line, cols[0].upper(), " ".join(cols[1].split()), cols[2])
+        )
+    return rows
+
+
+def import_rooms(event, rows, user=None, auth=None):
+    """
+    Validates the given ``ImportRow`` objects and, if all of them are valid,
+    creates the missing rooms and moves the orders into their rooms.
+
+    All lookups are made against indexes of the event's order codes, rooms and
+    room memberships that are loaded once, and all changes are written with bulk
+    queries in a single transaction. Returns a list of ``(line, message)`` errors
+    and a dict with the number of created rooms and assigned orders; nothing is
+    written if there are errors.
+    """
+    orders = dict(event.orders.values_list("code", "pk"))
+    rooms = dict(event.rooms.values_list("name_key", "pk"))
+    memberships = {o.order_id: o for o in OrderRoom.objects.filter(order__event=event)}
+
+    errors = []
+    seen = set()
+    valid = []
+    for row in rows:
+        order_id = orders.get(row.code)
+        if order_id is None:
+            errors.append(
+                (row.line, _("Unknown order code: {code}").format(code=row.code))
+            )
+        elif order_id in seen:
+            errors.append(
+                (
+                    row.line,
+                    _("The order {code} is listed more than once.").format(
+                        code=row.code
+                    ),
+                )
+            )
+        elif not row.name:
+            errors.append((row.line, _("No room name given.")))
+        elif len(row.name) > Room._meta.get_field("name").max_length:
+            errors.append((row.line, _("The room name is too long.")))
+        elif row.admin.lower() not in TRUE_VALUES | FALSE_VALUES:
+            errors.append(
+                (
+                    row.line,
+                    _(
+                        "Invalid value for the room administrator column: {value}"
+                    ).format(value=row.admin),
+                )
+            )
+        else:
+            seen.add(order_id)
+            valid.append((order_id, row.name, row.admin.lower() in TRUE_VALUES))
+    if errors:
+        return errors, {}
+
+    new_rooms = {}
+    for order_id, name, is_admin in valid:
+        key = normalize_room_name(name)
+        if key not in rooms and key not in new_rooms:
+            new_rooms[key] = Room(
+                event=event,
+                name=name,
+                name_key=key,
+                password=get_random_string(16),
+            )
+
+    if new_rooms and event.has_subevents:
+        first_members = {}
+        for order_id, name, is_admin in valid:
+            first_members.setdefault(normalize_room_name(name), order_id)
+        subevents = dict(
+            OrderPosition.objects.filter(
+                order_id__in=first_members.values(), subevent__isnull=False
+            )
+            .order_by()
+            .values("order_id")
+            .annotate(subevent=Min("subevent_id"))
+            .values_list("order_id", "subevent")
+        )
+        for key, room in new_rooms.items():
+            room.subevent_id = subevents.get(first_members.get(key))
+
+    with transaction.atomic():
+        Room.objects.bulk_create(new_rooms.values())
+        rooms.update({key: room.pk for key, room in new_rooms.items()})
+
+        to_create, to_update, logentries = [], [], []
+        touched = set()
+        for order_id, name, is_admin in valid:
+            room_id = rooms[normalize_room_name(name)]
+            current = memberships.get(order_id)
+            if current is None:
+                to_create.append(
+                    OrderRoom(order_id=order_id, room_id=room_id, is_admin=is_admin)
+                )
+            elif current.room_id != room_id or current.is_admin != is_admin:
+                touched.add(current.room_id)
+                current.room_id = room_id
+                current.is_admin = is_admin
+                to_update.append(current)
+            else:
+                continue
+            touched.add(room_id)
+            logentries.append(
+                Order(pk=order_id, event=event).log_action(
+                    "pretix_roomsharing.order.imported",
+                    data={"room": room_id, "is_admin": is_admin},
+                    user=user,
+                    auth=auth,
+                    save=False,
+                )
+            )
+        OrderRoom.objects.bulk_create(to_create, batch_size=1000)
+        OrderRoom.objects.bulk_update(to_update, ["room", "is_admin"], batch_size=1000)
+        LogEntry.bulk_create_and_postprocess(logentries)
+
+        refresh_occupancy(touched)
+        order_ids = [o.order_id for o in to_create + to_update]
+        transaction.on_commit(lambda: bump_order_versions(order_ids))
+        transaction.on_commit(lambda: invalidate_metrics(event.pk))
+        created = list(new_rooms.values())
+        transaction.on_commit(lambda: forget_missing_rooms(created))
+
+    return [], {"rooms": len(new_rooms), "orders": len(logentries)}
+
+
+class RoomColumn(ImportColumn):
+    """
+    Room name column for pretix's order import. Orders with the same room name
+    share a room, which is created if it does not exist yet.
+
+    ``save()`` is called once per imported order, inside the import transaction.
+    Instead of writing anything there, the orders are collected until the last
+    one with a room has been saved, and then all rooms and memberships of the
+    import are written at once.
+    """
+
+    identifier = "roomsharing_room"
+    verbose_name = gettext_lazy("Room name")
+    order_level = True
+
+    def __init__(self, event):
+        super().__init__(event)
+        self._rooms = {}
+        self._pending = set()
+
+    def clean(self, value, previous_values):
+        if value:
+            value = " ".join(value.split())
+            if len(value) > Room._meta.get_field("name").max_length:
+                raise ValidationError(_("The room name is too long."))
+        return value or None
+
+    def assign(self, value, order, position, invoice_address, **kwargs):
+        if value:
+            self._rooms[id(order)] = (order, value)
+            self._pending.add(id(order))
+
+    def save(self, obj):
+        if id(obj) in self._pending:
+            self._pending.remove(id(obj))
+            if not self._pending:
+                self._save_rooms()
+
+    def _save_rooms(self):
+        event = self.event
+        entries = list(self._rooms.values())
+        rooms = dict(
+            event.rooms.filter(
+                name_key__in={normalize_room_name(name) for order, name in entries}
+            ).values_list("name_key", "pk")
+        )
+
+        new_rooms = {}
+        orderrooms = []
+        for order, name in entries:
+            key = normalize_room_name(name)
+            is_admin = key not in rooms and key not in new_rooms
+            if is_admin:
+                new_rooms[key] = Room(
+                    event=event,
+                    name=name,
+                    name_key=key,
+                    password=get_random_string(16),
+                    subevent_id=next(
+                        (p.subevent_id for p in order._positions if p.subevent_id),
+                        None,
+                    ),
+                )
+            orderrooms.append((order, key, is_admin))
+        Room.objects.bulk_create(new_rooms.values())
+        rooms.update({key: room.pk for key, room in new_rooms.items()})
+
+        OrderRoom.objects.bulk_create(
+            [
+                OrderRoom(order=order, room_id=rooms[key], is_admin=is_admin)
+                for order, key, is_admin in orderrooms
+            ],
+            batch_size=1000,
+        )
+        LogEntry.bulk_create_and_postprocess(
+            [
+                order.log_action(
+                    "pretix_roomsharing.order.imported",
+                    data={"room": rooms[key], "is_admin": is_admin},
+                    save=False,
+                )
+                for order, key, is_admin in orderrooms
+            ]
+        )
+        refresh_occupancy(set(rooms.values()))
+        for order, name in entries:
+            # Spares the refresh in the order_paid receiver
+            order._roomsharing_counted = True
+        transaction.on_commit(lambda: invalidate_metrics(event.pk))
+        created = list(new_rooms.values())
+        transaction.on_commit(lambda: forget_missing_rooms(created))
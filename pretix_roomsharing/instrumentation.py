@@ -0,0 +1,133 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.db import connection
+
+# Receivers and views of this plugin run within pretix' own pages. To see what
+# they add to them, every call can be timed and its database queries counted.
+# The numbers are kept in memory of the current process and exposed as
+# histograms on the metrics endpoint. Enable it in pretix.cfg with:
+#
+#     [pretix_roomsharing]
+#     instrumentation=on
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more counter for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def metrics(self, name, label):
+        """
+        Returns the cumulative buckets, sum and count in the format of
+        :py:meth:`TicketStats.metrics`.
+        """
+        m = {name + "_bucket": {}}
+        total = 0
+        for le, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            m[name + "_bucket"]['{%s,le="%s"}' % (label, le)] = total
+        m[name + "_sum"] = {"{%s}" % label: self.sum}
+        m[name + "_count"] = {"{%s}" % label: total}
+        return m
+
+
+_lock = threading.Lock()
+_histograms = {}
+
+
+def enabled():
+    return settings.CONFIG_FILE.getboolean(
+        "pretix_roomsharing", "instrumentation", fallback=False
+    )
+
+
+def record(kind, name, seconds, queries):
+    with _lock:
+        if (kind, name) not in _histograms:
+            _histograms[kind, name] = (
+                Histogram(SECONDS_BUCKETS),
+                Histogram(QUERIES_BUCKETS),
+            )
+        seconds_histogram, queries_histogram = _histograms[kind, name]
+        seconds_histogram.observe(seconds)
+        queries_histogram.observe(queries)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def measure(kind, name):
+    """
+    Returns a decorator that records the wall time and number of queries of
+    every call of the decorated function under the given kind, e.g. "receiver"
+    or "view", and name.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+
+            queries = 0
+
+            def count(execute, sql, params, many, context):
+                nonlocal queries
+                queries += 1
+                return execute(sql, params, many, context)
+
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(count):
+                    return func(*args, **kwargs)
+            finally:
+                record(kind, name, time.perf_counter() - started, queries)
+
+        return wrapper
+
+    return decorator
+
+
+def instrumented_receiver(func):
+    return measure("receiver", func.__name__)(func)
+
+
+def instrumented_view(view_class, **initkwargs):
+    """
+    Returns ``view_class.as_view(**initkwargs)``, instrumented under the name of
+    the class.
+    """
+    return measure("view", view_class.__name__)(view_class.as_view(**initkwargs))
+
+
+def metrics():
+    """
+    Returns the recorded histograms in the format of
+    :py:meth:`TicketStats.metrics`.
+    """
+    m = {}
+    with _lock:
+        for (kind, name), histograms in sorted(_histograms.items()):
+            seconds_histogram, queries_histogram = histograms
+            label = '%s="%s"' % (kind, name)
+            for prefix, histogram in (
+                ("roomsharing_%s_seconds" % kind, seconds_histogram),
+                ("roomsharing_%s_queries" % kind, queries_histogram),
+            ):
+                for metric, values in histogram.metrics(prefix, label).items():
+                    m.setdefault(metric, {}).update(values)
+    return m
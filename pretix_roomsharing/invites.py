@@ -0,0 +1,66 @@
+from django.core.signing import BadSignature, Signer
+from django.utils.crypto import salted_hmac
+
+from .models import Room
+
+# Room administrators can share an invite link instead of the room name and
+# password. Its token is signed, so it can be checked without the database and
+# the room is then loaded by its primary key. The token carries a version of the
+# room password, so changing the password invalidates all earlier links. The
+# version is derived from the password itself, which covers every way the
+# password can be changed.
+
+_signer = Signer(salt="pretix_roomsharing.invite")
+
+
+def password_version(room):
+    digest = salted_hmac("pretix_roomsharing.invite.password", room.password)
+    return digest.hexdigest()[:12]
+
+
+def make_invite_token(room):
+    return _signer.sign("%d.%d.%s" % (room.event_id, room.pk, password_version(room)))
+
+
+def read_invite_token(event, token):
+    """
+    Returns the room id and password version of a valid invite token for the
+    given event, or ``None``. Does not access the database.
+    """
+    try:
+        event_id, room_id, version = _signer.unsign(token or "").split(".")
+        if int(event_id) != event.pk:
+            return None
+        return int(room_id), version
+    except (BadSignature, ValueError):
+        return None
+
+
+def room_for_invite(event, token):
+    """
+    Returns the room an invite token is valid for, or ``None``.
+    """
+    invite = read_invite_token(event, token)
+    if invite is None:
+        return None
+    room_id, version = invite
+    room = Room.objects.filter(event=event, pk=room_id).first()
+    if room is None or password_version(room) != version:
+        return None
+    return room
+
+
+def _session_key(event):
+    return "pretix_roomsharing_invite_%d" % event.pk
+
+
+def remember_invite(request, token):
+    request.session[_session_key(request.event)] = token
+
+
+def remembered_invite(request):
+    return request.session.get(_session_key(request.event))
+
+
+def forget_invite(request):
+    request.session.pop(_session_key(request.event), None)
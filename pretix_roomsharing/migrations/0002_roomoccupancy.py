@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django_scopes import scopes_disabled
+
+
+@scopes_disabled()
+def backfill_occupancy(apps, schema_editor):
+    OrderPosition = apps.get_model("pretixbase", "OrderPosition")
+    RoomOccupancy = apps.get_model("pretix_roomsharing", "RoomOccupancy")
+
+    counts = (
+        OrderPosition.all.filter(
+            canceled=False,
+            order__status__in=("n", "p"),
+            order__orderroom__isnull=False,
+            item__admission=True,
+        )
+        .order_by()
+        .values("order__orderroom__room", "subevent")
+        .annotate(c=Count("id"))
+    )
+    RoomOccupancy.objects.bulk_create(
+        [
+            RoomOccupancy(
+                room_id=r["order__orderroom__room"],
+                subevent_id=r["subevent"],
+                size=r["c"],
+            )
+            for r in counts.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0118_auto_20190423_0839"),
+        ("pretix_roomsharing", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomOccupancy",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("size", models.PositiveIntegerField(default=0)),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="occupancies",
+                        to="pretix_roomsharing.Room",
+                    ),
+                ),
+                (
+                    "subevent",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.SubEvent",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("room", "subevent")},
+            },
+        ),
+        migrations.RunPython(backfill_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+def backfill_name_key(apps, schema_editor):
+    Room = apps.get_model("pretix_roomsharing", "Room")
+
+    batch = []
+    for room in Room.objects.only("pk", "name").iterator():
+        room.name_key = " ".join(room.name.split()).casefold()
+        batch.append(room)
+        if len(batch) >= 1000:
+            Room.objects.bulk_update(batch, ["name_key"])
+            batch = []
+    Room.objects.bulk_update(batch, ["name_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0118_auto_20190423_0839"),
+        ("pretix_roomsharing", "0002_roomoccupancy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="name_key",
+            field=models.CharField(default="", editable=False, max_length=190),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_name_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["event", "name_key"], name="pretix_room_event_i_071cd4_idx"
+            ),
+        ),
+    ]
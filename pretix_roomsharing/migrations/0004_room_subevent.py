@@ -0,0 +1,53 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_subevent(apps, schema_editor):
+    Room = apps.get_model("pretix_roomsharing", "Room")
+    RoomOccupancy = apps.get_model("pretix_roomsharing", "RoomOccupancy")
+
+    batch = []
+    seen = set()
+    for o in (
+        RoomOccupancy.objects.filter(size__gt=0, subevent__isnull=False)
+        .order_by("room_id", "-size")
+        .iterator()
+    ):
+        if o.room_id in seen:
+            continue
+        seen.add(o.room_id)
+        batch.append(Room(pk=o.room_id, subevent_id=o.subevent_id))
+        if len(batch) >= 1000:
+            Room.objects.bulk_update(batch, ["subevent"])
+            batch = []
+    Room.objects.bulk_update(batch, ["subevent"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0118_auto_20190423_0839"),
+        ("pretix_roomsharing", "0003_room_name_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="subevent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="pretixbase.SubEvent",
+                verbose_name="Date",
+            ),
+        ),
+        migrations.RunPython(backfill_subevent, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["event", "subevent"], name="pretix_room_event_i_0a5022_idx"
+            ),
+        ),
+    ]
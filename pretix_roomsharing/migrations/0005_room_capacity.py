@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretixbase", "0118_auto_20190423_0839"),
+        ("pretix_roomsharing", "0004_room_subevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="capacity",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text=(
+                    "Number of attendees that fit into this room. If empty, the "
+                    "capacity configured for the room product is used."
+                ),
+                null=True,
+                verbose_name="Capacity",
+            ),
+        ),
+    ]
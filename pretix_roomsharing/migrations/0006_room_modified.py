@@ -0,0 +1,26 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_roomsharing", "0005_room_capacity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="room",
+            name="modified",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name="room",
+            index=models.Index(
+                fields=["event", "modified"], name="pretix_room_event_i_07377a_idx"
+            ),
+        ),
+    ]
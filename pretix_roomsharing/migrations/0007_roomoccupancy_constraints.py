@@ -0,0 +1,75 @@
+from django.db import migrations, models
+from django.db.models import Count
+from django_scopes import scopes_disabled
+
+
+@scopes_disabled()
+def rebuild_duplicate_occupancy(apps, schema_editor):
+    OrderPosition = apps.get_model("pretixbase", "OrderPosition")
+    RoomOccupancy = apps.get_model("pretix_roomsharing", "RoomOccupancy")
+
+    # Concurrent refreshes could add several rows without a subevent per room
+    room_ids = list(
+        RoomOccupancy.objects.filter(subevent__isnull=True)
+        .order_by()
+        .values("room")
+        .annotate(c=Count("id"))
+        .filter(c__gt=1)
+        .values_list("room", flat=True)
+    )
+    if not room_ids:
+        return
+    RoomOccupancy.objects.filter(room_id__in=room_ids).delete()
+    counts = (
+        OrderPosition.all.filter(
+            canceled=False,
+            order__status__in=("n", "p"),
+            order__orderroom__room_id__in=room_ids,
+            item__admission=True,
+        )
+        .order_by()
+        .values("order__orderroom__room", "subevent")
+        .annotate(c=Count("id"))
+    )
+    RoomOccupancy.objects.bulk_create(
+        [
+            RoomOccupancy(
+                room_id=r["order__orderroom__room"],
+                subevent_id=r["subevent"],
+                size=r["c"],
+            )
+            for r in counts.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_roomsharing", "0006_room_modified"),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_duplicate_occupancy, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="roomoccupancy",
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name="roomoccupancy",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(subevent__isnull=False),
+                fields=("room", "subevent"),
+                name="roomsharing_occupancy_unique_subevent",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="roomoccupancy",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(subevent__isnull=True),
+                fields=("room",),
+                name="roomsharing_occupancy_unique_no_subevent",
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_names(apps, schema_editor):
+    Room = apps.get_model("pretix_roomsharing", "Room")
+
+    # Rooms created before names were normalized may share a normalized name.
+    # All but the oldest of them get their ID added to the name.
+    duplicates = (
+        Room.objects.order_by()
+        .values("event", "name_key")
+        .annotate(c=Count("id"))
+        .filter(c__gt=1)
+    )
+    max_length = Room._meta.get_field("name").max_length
+    for d in duplicates.iterator():
+        rooms = Room.objects.filter(
+            event_id=d["event"], name_key=d["name_key"]
+        ).order_by("pk")
+        for room in rooms[1:]:
+            suffix = " (%d)" % room.pk
+            keep = max_length - len(suffix)
+            room.name = room.name[:keep] + suffix
+            room.name_key = " ".join(room.name.split()).casefold()
+            room.save(update_fields=["name", "name_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pretix_roomsharing", "0007_roomoccupancy_constraints"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="room",
+            constraint=models.UniqueConstraint(
+                fields=("event", "name_key"),
+                name="roomsharing_room_unique_name_key",
+            ),
+        ),
+    ]
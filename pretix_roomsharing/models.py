@@ -1,23 +1,199 @@
 from django.db import models
-from django.utils.translation import gettext_lazy as _
-from pretix.base.models import LoggedModel
+from django.db.models import (
+    Case,
+    Count,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext_lazy as _, pgettext_lazy
+from pretix.base.models import LoggedModel, Order, OrderPosition
+
+
+def normalize_room_name(name):
+    """
+    Returns the key room names are compared by: case-folded, with surrounding
+    whitespace removed and inner whitespace collapsed.
+    """
+    return " ".join(name.split()).casefold()
+
+
+class RoomQuerySet(models.QuerySet):
+    def by_name(self, name):
+        """
+        Filters rooms by name, ignoring case and whitespace differences.
+        """
+        return self.filter(name_key=normalize_room_name(name))
+
+    def search(self, prefix):
+        """
+        Filters rooms by a prefix of their name, ignoring case and whitespace
+        differences. The range conditions allow the database to find the rooms on
+        the name index instead of scanning all rooms of the event.
+        """
+        key = normalize_room_name(prefix)
+        if not key:
+            return self.all()
+        return self.filter(
+            name_key__gte=key,
+            name_key__lt=key[:-1] + chr(ord(key[-1]) + 1),
+            name_key__startswith=key,
+        )
+
+    def with_members(self):
+        """
+        Annotates every room with its number of members (``members``), as counted
+        in its occupancy.
+        """
+        return self.annotate(
+            members=Coalesce(
+                Subquery(
+                    RoomOccupancy.objects.filter(room=OuterRef("pk"))
+                    .order_by()
+                    .values("room")
+                    .annotate(s=Sum("size"))
+                    .values("s"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+        )
+
+    def with_capacity(self, capacities):
+        """
+        Annotates every room with its capacity (``effective_capacity``) like
+        :py:func:`pretix_roomsharing.occupancy.room_capacity`: its own capacity
+        or, if it has none, the smallest capacity configured for the products of
+        its members. ``capacities`` maps product IDs to their capacity, as
+        returned by :py:func:`pretix_roomsharing.eligibility.room_capacities`.
+        """
+        if not capacities:
+            return self.annotate(effective_capacity=models.F("capacity"))
+        product_capacity = Subquery(
+            OrderPosition.objects.filter(
+                order__orderroom__room=OuterRef("pk"),
+                order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+                item_id__in=capacities,
+            )
+            .annotate(
+                c=Case(
+                    *[When(item_id=i, then=Value(c)) for i, c in capacities.items()],
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("c")
+            .values("c")[:1],
+            output_field=IntegerField(),
+        )
+        return self.annotate(effective_capacity=Coalesce("capacity", product_capacity))
+
+    def with_stats(self):
+        """
+        Annotates every room with its number of members (``members``), the
+        number of members in paid and pending orders (``paid``, ``pending``) and
+        the order code of its administrator (``admin_code``).
+        """
+
+        def count_members(status):
+            return Coalesce(
+                Subquery(
+                    OrderPosition.objects.filter(
+                        order__orderroom__room=OuterRef("pk"),
+                        order__status=status,
+                        item__admission=True,
+                    )
+                    .order_by()
+                    .values("order__orderroom__room")
+                    .annotate(c=Count("id"))
+                    .values("c"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            )
+
+        return self.with_members().annotate(
+            paid=count_members(Order.STATUS_PAID),
+            pending=count_members(Order.STATUS_PENDING),
+            admin_code=Subquery(
+                OrderRoom.objects.filter(room=OuterRef("pk"), is_admin=True).values(
+                    "order__code"
+                )[:1]
+            ),
+        )
 
 
 class Room(LoggedModel):
     event = models.ForeignKey(
         "pretixbase.Event", on_delete=models.CASCADE, related_name="rooms"
     )
+    subevent = models.ForeignKey(
+        "pretixbase.SubEvent",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=pgettext_lazy("subevent", "Date"),
+    )
     name = models.CharField(max_length=190)
+    name_key = models.CharField(max_length=190, editable=False)
     password = models.CharField(max_length=190, blank=True)
+    capacity = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Capacity"),
+        help_text=_(
+            "Number of attendees that fit into this room. If empty, the capacity "
+            "configured for the room product is used."
+        ),
+    )
     created = models.DateTimeField(auto_now_add=True)
+    # Also updated whenever the membership of the room changes, see
+    # refresh_occupancy
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = RoomQuerySet.as_manager()
 
     class Meta:
         unique_together = (("event", "name"),)
+        constraints = [
+            # Guards rooms created concurrently, e.g. by two orders placed with
+            # the same room name
+            models.UniqueConstraint(
+                fields=["event", "name_key"],
+                name="roomsharing_room_unique_name_key",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["event", "name_key"]),
+            models.Index(fields=["event", "subevent"]),
+            models.Index(fields=["event", "modified"]),
+        ]
         ordering = ("name",)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.name_key = normalize_room_name(self.name)
+        if "update_fields" in kwargs and "name" in kwargs["update_fields"]:
+            kwargs["update_fields"] = {"name_key"}.union(kwargs["update_fields"])
+        super().save(*args, **kwargs)
+
+    def pin_subevent(self, subevent_id):
+        """
+        Records the date of the room, unless it already has one. Used when a room
+        is created or joined for the first time.
+        """
+        if self.subevent_id is None and subevent_id:
+            Room.objects.filter(pk=self.pk, subevent__isnull=True).update(
+                subevent_id=subevent_id
+            )
+            self.subevent_id = subevent_id
+
 
 class OrderRoom(models.Model):
     order = models.OneToOneField(
@@ -30,3 +206,35 @@ class OrderRoom(models.Model):
         verbose_name=_("Room"),
     )
     is_admin = models.BooleanField(default=False, verbose_name=_("Room administrator"))
+
+
+class RoomOccupancy(models.Model):
+    """
+    Number of admission positions in pending or paid orders per room and subevent.
+
+    This is denormalized from ``OrderRoom`` → ``Order`` → ``OrderPosition`` and
+    refreshed through :py:func:`pretix_roomsharing.occupancy.refresh_occupancy`
+    whenever room membership or the status of a member order changes.
+    """
+
+    room = models.ForeignKey(Room, related_name="occupancies", on_delete=models.CASCADE)
+    subevent = models.ForeignKey(
+        "pretixbase.SubEvent", null=True, related_name="+", on_delete=models.CASCADE
+    )
+    size = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # A pair of conditional constraints, as rows without a subevent would not
+        # be unique otherwise
+        constraints = [
+            models.UniqueConstraint(
+                fields=["room", "subevent"],
+                condition=models.Q(subevent__isnull=False),
+                name="roomsharing_occupancy_unique_subevent",
+            ),
+            models.UniqueConstraint(
+                fields=["room"],
+                condition=models.Q(subevent__isnull=True),
+                name="roomsharing_occupancy_unique_no_subevent",
+            ),
+        ]
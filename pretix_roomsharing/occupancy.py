@@ -0,0 +1,211 @@
+import logging
+import time
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count, Sum
+from django.utils.timezone import now
+from pretix.base.models import Order, OrderPosition
+
+from .eligibility import product_capacity
+from .fragments import bump_room_versions
+from .models import OrderRoom, Room, RoomOccupancy
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for waiting on the lock of a busy room (PostgreSQL only) and the
+# hold time after which a join is logged as slow. Orders that are already placed
+# wait longer, as they cannot ask the customer to try again.
+LOCK_TIMEOUT = "2s"
+PLACEMENT_LOCK_TIMEOUT = "30s"
+SLOW_JOIN = 0.5
+
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class RoomFull(Exception):
+    pass
+
+
+class RoomBusy(Exception):
+    pass
+
+
+class WrongDate(Exception):
+    pass
+
+
+def _sqlstate(exc):
+    cause = exc.__cause__
+    return getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+
+
+@transaction.atomic
+def refresh_occupancy(room_ids):
+    """
+    Recomputes the occupancy counters of the given rooms from their member orders.
+
+    Counters are rebuilt from the source of truth for the affected rooms only,
+    instead of applying deltas, so order changes that add or cancel single
+    positions can never make them drift. The rooms are locked while doing so,
+    so concurrent refreshes of the same room run one after the other.
+    """
+    room_ids = {r for r in room_ids if r}
+    if not room_ids:
+        return
+    # Always locked in the same order, so refreshes of several rooms cannot
+    # deadlock each other
+    list(
+        Room.objects.select_for_update()
+        .filter(pk__in=room_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    counts = (
+        OrderPosition.objects.filter(
+            order__orderroom__room_id__in=room_ids,
+            order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+            item__admission=True,
+        )
+        .order_by()
+        .values("order__orderroom__room", "subevent")
+        .annotate(c=Count("id"))
+    )
+    rows = [
+        RoomOccupancy(
+            room_id=r["order__orderroom__room"], subevent_id=r["subevent"], size=r["c"]
+        )
+        for r in counts
+    ]
+    RoomOccupancy.objects.filter(room_id__in=room_ids).delete()
+    RoomOccupancy.objects.bulk_create(rows)
+    # Lets API clients pick up membership changes with modified_since
+    Room.objects.filter(pk__in=room_ids).update(modified=now())
+
+    # Members see each other on their order pages
+    transaction.on_commit(lambda: bump_room_versions(room_ids))
+
+
+def refresh_order_occupancy(order):
+    """
+    Recomputes the occupancy of the room the given order is part of, if any.
+    """
+    refresh_occupancy(
+        OrderRoom.objects.filter(order=order).values_list("room_id", flat=True)
+    )
+
+
+def pin_room_subevent(room, order):
+    """
+    Records the date of the order's tickets on the room, if it has none yet.
+    """
+    if room.subevent_id is None and order.event.has_subevents:
+        room.pin_subevent(
+            order.positions.filter(subevent__isnull=False)
+            .values_list("subevent_id", flat=True)
+            .first()
+        )
+
+
+def room_capacity(room, item_ids):
+    """
+    Returns the capacity of the room for members with the given products, or
+    ``None`` if it is unlimited.
+    """
+    if room.capacity:
+        return room.capacity
+    return product_capacity(room.event, item_ids)
+
+
+def has_space(room, size, item_ids):
+    """
+    Returns whether ``size`` further attendees fit into the room. An empty room
+    always fits at least one order.
+
+    This does not lock anything and is only meant for early feedback, the
+    binding check happens in :py:func:`join_room`.
+    """
+    capacity = room_capacity(room, item_ids)
+    if capacity is None:
+        return True
+    occupied = room.occupancies.aggregate(s=Sum("size"))["s"] or 0
+    return not occupied or occupied + size <= capacity
+
+
+def join_room(room, order, is_admin=False, lock_timeout=LOCK_TIMEOUT):
+    """
+    Adds the order to the room and raises ``RoomFull`` if its admission
+    positions do not fit into the remaining capacity.
+
+    Concurrent joins of the same room are serialized by a row lock on the room,
+    which is only held for the capacity check, the insert and the refresh of the
+    room's occupancy. Everything else is done before or after it. On PostgreSQL,
+    waiting for the lock is bounded by ``lock_timeout``, after which ``RoomBusy``
+    is raised instead of piling up requests behind it.
+
+    Call this outside of other transactions, or the lock is held until they end.
+    """
+    positions = list(order.positions.values_list("item_id", "item__admission"))
+    size = sum(1 for item_id, admission in positions if admission)
+    capacity = room.capacity or product_capacity(
+        order.event, {item_id for item_id, admission in positions}
+    )
+
+    started = time.monotonic()
+    try:
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL lock_timeout = %s", [lock_timeout])
+            locked_capacity = (
+                Room.objects.select_for_update()
+                .values_list("capacity", flat=True)
+                .get(pk=room.pk)
+            )
+            acquired = time.monotonic()
+            capacity = locked_capacity or capacity
+            if capacity is not None:
+                occupied = room.occupancies.aggregate(s=Sum("size"))["s"] or 0
+                if occupied and occupied + size > capacity:
+                    raise RoomFull()
+            orderroom = OrderRoom.objects.create(
+                room=room, order=order, is_admin=is_admin
+            )
+            refresh_occupancy([room.pk])
+    except OperationalError as e:
+        if _sqlstate(e) != LOCK_NOT_AVAILABLE:
+            raise
+        logger.warning(
+            "Timed out after %.3fs waiting for the lock on room %d",
+            time.monotonic() - started,
+            room.pk,
+        )
+        raise RoomBusy()
+
+    held = time.monotonic() - acquired
+    (logger.warning if held > SLOW_JOIN else logger.debug)(
+        "Joined order %s to room %d, waited %.3fs for the lock and held it %.3fs",
+        order.code,
+        room.pk,
+        acquired - started,
+        held,
+    )
+    pin_room_subevent(room, order)
+    return orderroom
+
+
+def create_room(room, order):
+    """
+    Saves the new, unsaved room and adds the order to it as its administrator,
+    in a single transaction. If either fails, e.g. because the order is already
+    part of a room, neither is saved.
+    """
+    try:
+        with transaction.atomic():
+            room.save()
+            orderroom = OrderRoom.objects.create(room=room, order=order, is_admin=True)
+            refresh_occupancy([room.pk])
+    except IntegrityError:
+        room.pk = None
+        raise
+    pin_room_subevent(room, order)
+    return orderroom
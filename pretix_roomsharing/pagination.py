@@ -0,0 +1,165 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+
+def decode_cursor(cursor, field=None):
+    """
+    Returns the ``(value, pk)`` pair of a cursor, or ``None`` if it is invalid.
+    If the model field of the sort key is given, the value is converted to its
+    type, so a tampered cursor cannot make the database query fail.
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if field is not None:
+            value = field.to_python(value)
+        if value is None:
+            return None
+        return value, int(pk)
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _sort_field(qs, field):
+    if field in qs.query.annotations:
+        return qs.query.annotations[field].output_field
+    if field == "pk":
+        return qs.model._meta.pk
+    return qs.model._meta.get_field(field)
+
+
+class KeysetPage:
+    """
+    One page of a queryset paginated by a ``(field, pk)`` keyset.
+
+    Instead of ``OFFSET``, every page is fetched with a range condition on the
+    sort key of the last (or first) row of the neighbouring page, so fetching
+    page 400 costs the same as fetching page 1 as long as the sort key is
+    indexed or cheap to compute.
+
+    Invalid cursors are ignored and set ``invalid_cursor``, so the first page is
+    shown instead.
+    """
+
+    def __init__(self, qs, field, page_size, descending=False, after=None, before=None):
+        self.field = field
+        self.has_next = self.has_previous = False
+
+        key = _sort_field(qs, field)
+        self.invalid_cursor = False
+        if after:
+            after = decode_cursor(after, key)
+            self.invalid_cursor = after is None
+        if before:
+            before = decode_cursor(before, key)
+            self.invalid_cursor = self.invalid_cursor or before is None
+        after, before = after or None, before or None
+        backwards = before is not None and after is None
+        forward_order = "-" if descending else ""
+        backward_order = "" if descending else "-"
+
+        if backwards:
+            qs = qs.filter(self._range(before, not descending)).order_by(
+                backward_order + field, backward_order + "pk"
+            )
+            rows = list(qs[: page_size + 1])
+            self.has_previous = len(rows) > page_size
+            self.has_next = True
+            self.rows = list(reversed(rows[:page_size]))
+        else:
+            if after:
+                qs = qs.filter(self._range(after, descending))
+            qs = qs.order_by(forward_order + field, forward_order + "pk")
+            rows = list(qs[: page_size + 1])
+            self.has_next = len(rows) > page_size
+            self.has_previous = after is not None
+            self.rows = rows[:page_size]
+
+    def _range(self, cursor, descending):
+        value, pk = cursor
+        op = "lt" if descending else "gt"
+        return Q(**{"%s__%s" % (self.field, op): value}) | Q(
+            **{self.field: value, "pk__%s" % op: pk}
+        )
+
+    def _cursor(self, row):
+        return encode_cursor(getattr(row, self.field), row.pk)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.rows:
+            return self._cursor(self.rows[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.rows:
+            return self._cursor(self.rows[0])
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class KeysetPagination(BasePagination):
+    """
+    API pagination by :py:class:`KeysetPage` over the primary key. Responses
+    contain a ``next`` link with an opaque cursor instead of page numbers, so
+    walking through a large list costs the same for every page and rows that are
+    added while paging are neither skipped nor repeated.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 50
+    max_page_size = 1000
+    invalid_cursor_message = _("Invalid cursor")
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor and decode_cursor(cursor, queryset.model._meta.pk) is None:
+            raise NotFound(self.invalid_cursor_message)
+        self.request = request
+        self.page = KeysetPage(
+            queryset, "pk", self.get_page_size(request), after=cursor
+        )
+        return list(self.page)
+
+    def get_next_link(self):
+        if self.page.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.page.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,48 @@
+import hashlib
+from django.core.cache import cache
+
+from .models import normalize_room_name
+
+# Rooms chosen to be created in the checkout only exist once the order is
+# placed. Until then, their name is reserved for the cart in the cache, so the
+# checkout does not need to write to the database and abandoned carts do not
+# leave rooms behind. The reservation lasts as long as the cart's positions and
+# is extended whenever the cart submits the name again.
+
+
+def _key(event, name):
+    digest = hashlib.sha1(normalize_room_name(name).encode()).hexdigest()
+    return "pretix_roomsharing:room_name:%d:%s" % (event.pk, digest)
+
+
+def _timeout(event):
+    return event.settings.reservation_time * 60
+
+
+def reserve_room_name(event, name, cart_id):
+    """
+    Reserves a room name for a cart and returns whether it succeeded, i.e.
+    whether the name is not reserved by another cart. Names of existing rooms
+    need to be checked separately.
+    """
+    key = _key(event, name)
+    if cache.add(key, cart_id, _timeout(event)):
+        return True
+    if cache.get(key) == cart_id:
+        cache.touch(key, _timeout(event))
+        return True
+    return False
+
+
+def release_room_name(event, name, cart_id):
+    key = _key(event, name)
+    if cache.get(key) == cart_id:
+        cache.delete(key)
+
+
+def room_name_reserved(event, name, cart_id=None):
+    """
+    Returns whether a room name is reserved by any cart but ``cart_id``.
+    """
+    holder = cache.get(_key(event, name))
+    return holder is not None and holder != cart_id
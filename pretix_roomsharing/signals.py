@@ -1,20 +1,47 @@
 # Register your receivers here
+import json
 import logging
 from django import forms
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.http import HttpRequest
 from django.template.loader import get_template
 from django.urls import resolve, reverse
+from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
-from pretix.base.models import Event, Order, OrderPosition
+from django_scopes import scopes_disabled
+from pretix.base.i18n import language
+from pretix.base.models import (
+    Event,
+    Event_SettingsStore,
+    Item,
+    Order,
+    OrderPosition,
+    OrderRefund,
+)
 from pretix.base.settings import settings_hierarkey
-from pretix.base.signals import logentry_display, order_placed
+from pretix.base.signals import (
+    logentry_display,
+    order_approved,
+    order_canceled,
+    order_changed,
+    order_denied,
+    order_expired,
+    order_import_columns,
+    order_paid,
+    order_placed,
+    order_reactivated,
+    periodic_task,
+    register_data_exporters,
+)
 from pretix.control.forms.filter import FilterForm
 from pretix.control.signals import (
     nav_event,
     nav_event_settings,
     order_info as control_order_info,
 )
+from pretix.helpers.periodic import minimum_interval
 from pretix.presale.signals import (
     checkout_confirm_page_content,
     checkout_flow_steps,
@@ -23,13 +50,30 @@ from pretix.presale.signals import (
 )
 from pretix.presale.views.cart import cart_session
 
+from .availability import forget_missing_room
 from .checkoutflow import RoomStep
-from .models import OrderRoom, Room
+from .cleanup import delete_empty_rooms
+from .eligibility import invalidate_room_products, needs_room, room_product_ids
+from .fragments import bump_order_version, bump_room_versions, cached_order_panel
+from .instrumentation import instrumented_receiver
+from .invites import make_invite_token
+from .models import OrderRoom, Room, normalize_room_name
+from .occupancy import (
+    PLACEMENT_LOCK_TIMEOUT,
+    RoomBusy,
+    RoomFull,
+    create_room,
+    join_room,
+    refresh_order_occupancy,
+)
+from .reservations import release_room_name
+from .stats import invalidate_metrics
 
 logger = logging.getLogger(__name__)
 
 
 @receiver(signal=checkout_flow_steps, dispatch_uid="room_checkout_step")
+@instrumented_receiver
 def signal_checkout_flow_steps(sender, **kwargs):
     return RoomStep
 
@@ -54,8 +98,11 @@ def navbar_settings(sender, request, **kwargs):
 
 
 @receiver(order_meta_from_request, dispatch_uid="room_order_meta")
+@instrumented_receiver
 def order_meta_signal(sender: Event, request: HttpRequest, **kwargs):
     cs = cart_session(request)
+    # The password of a room to be created is removed again once the room has
+    # been created, in the transaction placing the order, see placed_order
     return {
         "room_mode": cs.get("room_mode"),
         "room_join": cs.get("room_join"),
@@ -64,25 +111,132 @@ def order_meta_signal(sender: Event, request: HttpRequest, **kwargs):
 
 
 @receiver(order_placed, dispatch_uid="room_order_placed")
+@instrumented_receiver
 def placed_order(sender: Event, order: Order, **kwargs):
+    # Orders are placed in one long transaction. Existing rooms are joined after
+    # it has been committed, so a busy room is only locked for the join itself.
+    # New rooms cannot be busy and are created within it, so the order is never
+    # placed without its room.
     if order.meta_info_data and order.meta_info_data.get("room_mode") == "create":
+        created = order.meta_info_data.get("room_create")
+        if isinstance(created, dict):
+            create_placed_room(sender, order, created)
+            return
+        # Orders from carts of earlier versions, which created the room before
         try:
-            c = sender.rooms.get(pk=order.meta_info_data["room_create"])
+            c = sender.rooms.get(pk=created)
         except Room.DoesNotExist:
             logger.error("Room did not exist in room creation, can't add user to room")
             return
         else:
-            c.orderrooms.create(order=order, is_admin=True)
+            transaction.on_commit(lambda: join_placed_order(c, order, is_admin=True))
     elif order.meta_info_data and order.meta_info_data.get("room_mode") == "join":
         try:
             c = sender.rooms.get(pk=order.meta_info_data["room_join"])
         except Room.DoesNotExist:
             return
         else:
-            c.orderrooms.create(order=order, is_admin=False)
+            transaction.on_commit(lambda: join_placed_order(c, order))
+
+
+def join_placed_order(room, order, is_admin=False):
+    try:
+        join_room(room, order, is_admin=is_admin, lock_timeout=PLACEMENT_LOCK_TIMEOUT)
+    except RoomFull:
+        room_not_joined(room, order, busy=False)
+    except RoomBusy:
+        room_not_joined(room, order, busy=True)
+
+
+def room_not_joined(room, order, busy):
+    """
+    Records that a placed order could not be added to the room chosen in the
+    checkout, which is then shown on the order's page, and tells the customer.
+    """
+    order.log_action(
+        "pretix_roomsharing.order.busy" if busy else "pretix_roomsharing.order.full",
+        data={"room": room.pk, "name": room.name},
+    )
+    bump_order_version(order.pk)
+    with language(order.locale, order.event.settings.region):
+        order.send_mail(
+            str(_("We could not add your order to your room")),
+            "pretix_roomsharing/email/room_not_joined.txt",
+            {"room": room.name, "busy": busy},
+            "pretix_roomsharing.order.email.room_not_joined",
+        )
+
+
+def _create_room(room, order):
+    try:
+        create_room(room, order)
+    except IntegrityError:
+        return False
+    return True
+
+
+def create_placed_room(event, order, created):
+    """
+    Creates the room chosen in the checkout of a placed order and adds the order
+    to it as its administrator, within the transaction placing the order.
+
+    If another room with the same name has been created since, e.g. after the
+    reservation of the name expired, the order's code is added to the name. The
+    unique normalized name guards against rooms created at the same time. If no
+    password has been chosen, a random one is set, which the order can change.
+    Both are shown on the order's page.
+
+    The password is removed from the order's meta data before the order is
+    committed.
+    """
+    name = created["name"]
+    password = created.get("password")
+    room = Room(event=event, name=name, password=password or get_random_string(12))
+    if event.rooms.by_name(name).exists() or not _create_room(room, order):
+        max_length = Room._meta.get_field("name").max_length - len(order.code) - 3
+        room.name = "{} ({})".format(name[:max_length], order.code)
+        create_room(room, order)
+        order.log_action(
+            "pretix_roomsharing.order.renamed",
+            data={"room": room.pk, "name": name, "new_name": room.name},
+        )
+    if not password:
+        order.log_action(
+            "pretix_roomsharing.order.password_reset", data={"room": room.pk}
+        )
+
+    meta = order.meta_info_data
+    meta["room_create"] = {"name": name, "cart": created.get("cart")}
+    order.meta_info = json.dumps(meta)
+    order.save(update_fields=["meta_info"])
+
+    cart_id = created.get("cart")
+    transaction.on_commit(lambda: release_room_name(event, name, cart_id))
+
+
+@receiver(periodic_task, dispatch_uid="room_delete_empty")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=60)
+def periodic_delete_empty_rooms(sender, **kwargs):
+    delete_empty_rooms()
+
+
+@receiver(register_data_exporters, dispatch_uid="room_export_roominglist")
+def register_roominglist_exporter(sender, **kwargs):
+    from .exporters import RoomingListExporter
+
+    return RoomingListExporter
+
+
+@receiver(order_import_columns, dispatch_uid="room_import_columns")
+def import_columns(sender, **kwargs):
+    from .imports import RoomColumn
+
+    return [RoomColumn(sender)]
 
 
 @receiver(checkout_confirm_page_content, dispatch_uid="room_confirm")
+@instrumented_receiver
 def confirm_page(sender: Event, request: HttpRequest, **kwargs):
     cs = cart_session(request)
 
@@ -97,51 +251,107 @@ def confirm_page(sender: Event, request: HttpRequest, **kwargs):
         except Room.DoesNotExist:
             return
     elif cs.get("room_mode") == "create":
-        try:
-            ctx["room"] = sender.rooms.get(pk=cs.get("room_create"))
-        except Room.DoesNotExist:
+        if not isinstance(cs.get("room_create"), dict):
             return
+        ctx["room"] = {"name": cs["room_create"]["name"]}
     return template.render(ctx)
 
 
+def room_not_joined_name(order):
+    """
+    Returns the name of the room the order could not be added to when it was
+    placed, unless its room has been changed since.
+    """
+    entry = (
+        order.all_logentries()
+        .filter(action_type__startswith="pretix_roomsharing.order.")
+        .exclude(action_type="pretix_roomsharing.order.email.room_not_joined")
+        .order_by("-datetime", "-pk")
+        .first()
+    )
+    if entry and entry.action_type in (
+        "pretix_roomsharing.order.full",
+        "pretix_roomsharing.order.busy",
+    ):
+        return entry.parsed_data.get("name")
+
+
+def placed_room_changes(order, room):
+    """
+    Returns the name chosen for the room created with the order, if the room had
+    to be named differently, and whether it got a random password instead of
+    the chosen one. Each is only returned until the room's name or password is
+    changed.
+    """
+    renamed_from, password_reset = None, False
+    entries = (
+        order.all_logentries()
+        .filter(
+            action_type__in=(
+                "pretix_roomsharing.order.renamed",
+                "pretix_roomsharing.order.password_reset",
+                "pretix_roomsharing.order.changed",
+            )
+        )
+        .order_by("datetime", "pk")
+    )
+    for entry in entries:
+        if entry.action_type == "pretix_roomsharing.order.renamed":
+            if entry.parsed_data.get("new_name") == room.name:
+                renamed_from = entry.parsed_data.get("name")
+        else:
+            password_reset = (
+                entry.action_type == "pretix_roomsharing.order.password_reset"
+            )
+    return renamed_from, password_reset
+
+
 @receiver(order_info, dispatch_uid="room_order_info")
+@instrumented_receiver
 def order_info(sender: Event, order: Order, **kwargs):
-    template = get_template("pretix_roomsharing/order_info.html")
+    def render():
+        template = get_template("pretix_roomsharing/order_info.html")
 
-    ctx = {
-        "order": order,
-        "event": sender,
-    }
-
-    # Show link for user to change room
-    order_has_room = False
-    for orderPosition in order.positions.all():
-        if (
-            str(orderPosition.item.id)
-            in sender.settings.roomsharing__products
-        ):
-            order_has_room = True
-    ctx["order_has_room"] = order_has_room
-
-    # Show current room details
-    try:
-        c = order.orderroom
-        fellows_orders = OrderPosition.objects.filter(
-            order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
-            order__orderroom__room=c.room,
-            item__admission=True,
-        ).exclude(order=order)
+        ctx = {
+            "order": order,
+            "event": sender,
+        }
 
-        ctx["room"] = c.room
-        ctx["is_admin"] = c.is_admin
-        ctx["fellows"] = fellows_orders
-    except OrderRoom.DoesNotExist:
-        pass
+        # Show link for user to change room
+        ctx["order_has_room"] = needs_room(sender, order.positions.all())
 
-    return template.render(ctx)
+        # Show current room details
+        try:
+            c = order.orderroom
+            fellows_orders = (
+                OrderPosition.objects.filter(
+                    order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+                    order__orderroom__room=c.room,
+                    item__admission=True,
+                )
+                .exclude(order=order)
+                .select_related("order")
+            )
+
+            ctx["room"] = c.room
+            ctx["is_admin"] = c.is_admin
+            ctx["fellows"] = fellows_orders
+            if c.is_admin:
+                ctx["invite_token"] = make_invite_token(c.room)
+                ctx["renamed_from"], ctx["password_reset"] = placed_room_changes(
+                    order, c.room
+                )
+        except OrderRoom.DoesNotExist:
+            if ctx["order_has_room"]:
+                ctx["not_joined"] = room_not_joined_name(order)
+
+        return template.render(ctx), ctx.get("room") and ctx["room"].pk
+
+    return cached_order_panel(order, tuple(sorted(room_product_ids(sender))), render)
 
 
 @receiver(control_order_info, dispatch_uid="room_control_order_info")
+@instrumented_receiver
 def control_order_info(sender: Event, request, order: Order, **kwargs):
     template = get_template("pretix_roomsharing/control_order_info.html")
 
@@ -171,15 +381,52 @@ def shipping_logentry_display(sender, logentry, **kwargs):
         "pretix_roomsharing.order.created": _("The user created a new room."),
         "pretix_roomsharing.order.changed": _("The user changed a room password."),
         "pretix_roomsharing.order.deleted": _("The room has been deleted."),
+        "pretix_roomsharing.order.moved": _(
+            "The order has been moved to a different room."
+        ),
+        "pretix_roomsharing.order.busy": _(
+            "The requested room was busy for too long, the order has not been added "
+            "to it."
+        ),
+        "pretix_roomsharing.order.email.room_not_joined": _(
+            "The customer has been told that the order has not been added to the "
+            "requested room."
+        ),
+        "pretix_roomsharing.order.password_reset": _(
+            "The room has been created with a random password, as the chosen one "
+            "was not available."
+        ),
+        "pretix_roomsharing.order.full": _(
+            "The requested room was full, the order has not been added to it."
+        ),
+        "pretix_roomsharing.order.imported": _(
+            "The order has been assigned to a room by an import."
+        ),
+        "pretix_roomsharing.order.assigned": _(
+            "The order has been assigned to a room automatically."
+        ),
+        "pretix_roomsharing.order.renamed": _(
+            "The chosen room name has been taken while the order was placed, the "
+            "room has been created with the order code added to its name."
+        ),
+        "pretix_roomsharing.room.created": _("The room has been created."),
         "pretix_roomsharing.room.deleted": _("The room has been changed."),
         "pretix_roomsharing.room.changed": _("The room has been deleted."),
+        "pretix_roomsharing.room.password_reset": _(
+            "The room password has been reset."
+        ),
     }
 
     if logentry.action_type in plains:
         return plains[logentry.action_type]
+    elif logentry.action_type == "pretix_roomsharing.rooms.cleaned":
+        return _("{count} rooms without members have been deleted.").format(
+            count=logentry.parsed_data.get("count")
+        )
 
 
 @receiver(nav_event, dispatch_uid="room_nav")
+@instrumented_receiver
 def control_nav_event(sender, request=None, **kwargs):
     url = resolve(request.path_info)
     if not request.user.has_event_permission(
@@ -219,7 +466,9 @@ class RoomSearchForm(FilterForm):
         fdata = self.cleaned_data
         qs = super().filter_qs(qs)
         if fdata.get("room_name"):
-            qs = qs.filter(orderroom__room__name__iexact=fdata.get("room_name"))
+            qs = qs.filter(
+                orderroom__room__name_key=normalize_room_name(fdata.get("room_name"))
+            )
         return qs
 
 
@@ -237,4 +486,96 @@ try:
 except ImportError:
     pass
 
-settings_hierarkey.add_default('roomsharing__products', None, list)
\ No newline at end of file
+
+@receiver(order_placed, dispatch_uid="room_metrics_order_placed")
+@receiver(order_paid, dispatch_uid="room_metrics_order_paid")
+@receiver(order_canceled, dispatch_uid="room_metrics_order_canceled")
+@receiver(order_expired, dispatch_uid="room_metrics_order_expired")
+@receiver(order_reactivated, dispatch_uid="room_metrics_order_reactivated")
+@receiver(order_approved, dispatch_uid="room_metrics_order_approved")
+@receiver(order_denied, dispatch_uid="room_metrics_order_denied")
+@receiver(order_changed, dispatch_uid="room_metrics_order_changed")
+def order_status_metrics(sender: Event, order: Order, **kwargs):
+    invalidate_metrics(sender.pk)
+
+
+@receiver(order_paid, dispatch_uid="room_occupancy_order_paid")
+@receiver(order_canceled, dispatch_uid="room_occupancy_order_canceled")
+@receiver(order_expired, dispatch_uid="room_occupancy_order_expired")
+@receiver(order_reactivated, dispatch_uid="room_occupancy_order_reactivated")
+@receiver(order_denied, dispatch_uid="room_occupancy_order_denied")
+@receiver(order_changed, dispatch_uid="room_occupancy_order_changed")
+def order_status_occupancy(sender: Event, order: Order, **kwargs):
+    # Orders imported with a room are counted in bulk by the import column
+    if getattr(order, "_roomsharing_counted", False):
+        return
+    refresh_order_occupancy(order)
+
+
+@receiver(post_save, sender=OrderRoom, dispatch_uid="room_metrics_orderroom_saved")
+@receiver(post_delete, sender=OrderRoom, dispatch_uid="room_metrics_orderroom_deleted")
+def orderroom_metrics(sender, instance: OrderRoom, **kwargs):
+    # Use whichever relation is already loaded, so this does not need a query
+    if OrderRoom.order.is_cached(instance):
+        invalidate_metrics(instance.order.event_id)
+    else:
+        invalidate_metrics(instance.room.event_id)
+
+
+# Refunds are counted in the metrics, but pretix has no signal for them
+@receiver(post_save, sender=OrderRefund, dispatch_uid="room_metrics_refund_saved")
+def refund_metrics(sender, instance: OrderRefund, **kwargs):
+    invalidate_metrics(instance.order.event_id)
+
+
+@receiver(
+    post_save, sender=Event_SettingsStore, dispatch_uid="room_products_setting_saved"
+)
+@receiver(
+    post_delete,
+    sender=Event_SettingsStore,
+    dispatch_uid="room_products_setting_deleted",
+)
+def room_products_settings(sender, instance: Event_SettingsStore, **kwargs):
+    # Covers the settings form as well as the settings API and event.settings.set.
+    # Invalidated again after commit, so a request reading the old settings in
+    # between does not cache them.
+    if instance.key == "roomsharing__products" or instance.key.startswith(
+        "roomsharing__capacity_"
+    ):
+        event = instance.object
+        invalidate_room_products(event)
+        transaction.on_commit(lambda: invalidate_room_products(event))
+
+
+@receiver(post_delete, sender=Item, dispatch_uid="room_products_item_deleted")
+def room_products_item(sender, instance: Item, **kwargs):
+    if instance.pk in room_product_ids(instance.event):
+        invalidate_room_products(instance.event)
+
+
+@receiver(post_save, sender=Room, dispatch_uid="room_availability_room_saved")
+def room_availability(sender, instance: Room, **kwargs):
+    transaction.on_commit(lambda: forget_missing_room(instance))
+
+
+@receiver(post_save, sender=Room, dispatch_uid="room_fragments_room_saved")
+def room_fragments(sender, instance: Room, **kwargs):
+    transaction.on_commit(lambda: bump_room_versions([instance.pk]))
+
+
+@receiver(post_save, sender=OrderRoom, dispatch_uid="room_fragments_orderroom_saved")
+@receiver(
+    post_delete, sender=OrderRoom, dispatch_uid="room_fragments_orderroom_deleted"
+)
+def orderroom_fragments(sender, instance: OrderRoom, **kwargs):
+    def bump():
+        bump_order_version(instance.order_id)
+        bump_room_versions([instance.room_id])
+
+    transaction.on_commit(bump)
+
+
+settings_hierarkey.add_default('roomsharing__products', None, list)
+settings_hierarkey.add_default("roomsharing__metrics_max_age", 60, int)
+settings_hierarkey.add_default("roomsharing__delete_empty_rooms", False, bool)
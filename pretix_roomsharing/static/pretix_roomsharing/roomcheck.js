@@ -0,0 +1,83 @@
+/*globals $ */
+// Checks room names and join passwords while they are typed, so mistakes show
+// up before the checkout step is submitted. The forms are still validated on
+// submit, so failed checks (e.g. when rate limited) are simply not shown.
+$(function () {
+    var $accordion = $("#room_accordion[data-room-check-url]");
+    if (!$accordion.length) {
+        return;
+    }
+    var url = $accordion.attr("data-room-check-url");
+    var csrf = $accordion.closest("form").find("input[name=csrfmiddlewaretoken]").val();
+
+    function show($input, state, message) {
+        var $group = $input.closest(".form-group");
+        $group.removeClass("has-error has-success");
+        $group.find(".roomsharing-check").remove();
+        if (state) {
+            $group.addClass(state);
+        }
+        if (message) {
+            $("<div>").addClass("help-block roomsharing-check").text(message).insertAfter($input);
+        }
+    }
+
+    function watch(mode) {
+        var $name = $("#id_" + mode + "-name");
+        var $password = $("#id_" + mode + "-password");
+        var timer = null;
+        var pending = null;
+        var last = null;
+
+        function check() {
+            var data = {mode: mode, name: $.trim($name.val())};
+            if (mode === "join") {
+                data.password = $password.val();
+            }
+            if (!data.name) {
+                show($name, null);
+                return;
+            }
+            var key = JSON.stringify(data);
+            if (key === last) {
+                return;
+            }
+            last = key;
+            if (pending) {
+                pending.abort();
+            }
+            pending = $.ajax({
+                url: url,
+                method: "POST",
+                data: data,
+                dataType: "json",
+                headers: {"X-CSRFToken": csrf}
+            }).done(function (result) {
+                if (result.field === "name") {
+                    show($name, "has-error", result.message);
+                } else {
+                    show($name, "has-success");
+                }
+                if (mode === "join") {
+                    if (result.field === "password") {
+                        show($password, "has-error", result.message);
+                    } else {
+                        show($password, result.ok && data.password ? "has-success" : null);
+                    }
+                }
+            }).fail(function () {
+                last = null;
+            });
+        }
+
+        $name.on("input", function () {
+            window.clearTimeout(timer);
+            timer = window.setTimeout(check, 400);
+        });
+        // Passwords are only checked when complete, not on every key
+        $password.on("change", check);
+    }
+
+    watch("join");
+    watch("create");
+});
@@ -0,0 +1,313 @@
+import time
+from collections import defaultdict
+from django.core.cache import cache
+from django.db.models import BooleanField, Count, Exists, ExpressionWrapper, OuterRef, Q
+from django.utils.crypto import get_random_string
+from django.utils.translation import gettext_lazy as _
+from pretix.base.models import Order, OrderPosition, OrderRefund
+
+# Every statistic is a filter on OrderPosition. "cliq" statistics are additionally
+# broken down by room membership and number of distinct rooms.
+TICKET_STATS = [
+    {
+        "id": "tickets_total",
+        "label": _("All tickets, total"),
+        "q": Q(order__status=Order.STATUS_PENDING, order__require_approval=True),
+        "cliq": True,
+    },
+    {
+        "id": "tickets_registered",
+        "label": _("Tickets Pending"),
+        "q": Q(order__status=Order.STATUS_PENDING, order__require_approval=True),
+        "cliq": True,
+    },
+    {
+        "id": "tickets_approved",
+        "label": _("Tickets in approved orders (regardless of payment status)"),
+        "q": Q(order__require_approval=False),
+        "cliq": True,
+    },
+    {
+        "id": "tickets_paid",
+        "label": _("Tickets in paid orders"),
+        "q": Q(order__require_approval=False, order__status=Order.STATUS_PAID),
+    },
+    {
+        "id": "tickets_pending",
+        "label": _("Tickets in pending orders"),
+        "q": Q(order__require_approval=False, order__status=Order.STATUS_PENDING),
+    },
+    {
+        "id": "tickets_canceled",
+        "label": _("Tickets in canceled orders (except the ones not chosen in raffle)"),
+        "q": Q(order__require_approval=False, order__status=Order.STATUS_CANCELED),
+    },
+    {
+        "id": "tickets_canceled_refunded",
+        "label": _("Tickets in canceled and at least partially refunded orders"),
+        "q": Q(price__gt=0, order__status=Order.STATUS_CANCELED, has_refund=True),
+    },
+    {
+        "id": "tickets_denied",
+        "label": _("Tickets denied (not chosen in raffle)"),
+        "q": Q(order__require_approval=True, order__status=Order.STATUS_CANCELED),
+        "cliq": True,
+    },
+]
+
+
+def stats_queryset(positions, *group_by):
+    """
+    Groups the given positions by subevent, item, room and any further fields
+    in ``group_by`` and counts them for every statistic.
+    """
+    return (
+        positions.annotate(
+            has_refund=Exists(
+                OrderRefund.objects.filter(
+                    order_id=OuterRef("order_id"),
+                    state__in=[OrderRefund.REFUND_STATE_DONE],
+                )
+            )
+        )
+        .order_by()
+        .values(*group_by, "subevent", "item", "order__orderroom__room")
+        .annotate(**{d["id"]: Count("id", filter=d["q"]) for d in TICKET_STATS})
+    )
+
+
+def stat_metrics(rows, d):
+    """
+    Returns ``{metric: {labels: value}}`` of the statistic ``d`` for the given
+    rows of :py:func:`stats_queryset`. The labels are not enclosed in braces yet,
+    so further labels can be added.
+    """
+    stat = d["id"]
+    m = defaultdict(dict)
+    if d.get("cliq"):
+        counts = defaultdict(lambda: 0)
+        rooms = defaultdict(set)
+        for r in rows:
+            if not r[stat]:
+                continue
+            room = r["order__orderroom__room"]
+            counts[r["item"], r["subevent"], room is not None] += r[stat]
+            if room is not None:
+                rooms[r["item"], r["subevent"]].add(room)
+        for (item, subevent, has_room), c in counts.items():
+            m[stat][
+                'item="%s",subevent="%s",hasroom="%s"' % (item, subevent, has_room)
+            ] = c
+        for (item, subevent), room_ids in rooms.items():
+            m[stat + "_unique_rooms"]['item="%s",subevent="%s"' % (item, subevent)] = (
+                len(room_ids)
+            )
+    else:
+        counts = defaultdict(lambda: 0)
+        for r in rows:
+            if r[stat]:
+                counts[r["item"], r["subevent"]] += r[stat]
+        for (item, subevent), c in counts.items():
+            m[stat]['item="%s",subevent="%s"' % (item, subevent)] = c
+    return m
+
+
+class TicketStats:
+    """
+    Computes all statistics of an event in a single query.
+
+    The positions are grouped by subevent, item and room, every statistic is a
+    filtered count on these groups. Everything else (sums per subevent or item,
+    room membership and distinct room counts) is derived in Python from the
+    resulting rows, so the database only has to scan the positions once.
+    """
+
+    def __init__(self, event):
+        self.event = event
+        self.rows = list(self.get_queryset())
+
+    def get_queryset(self):
+        return stats_queryset(OrderPosition.objects.filter(order__event=self.event))
+
+    def by_item(self, stat):
+        d = defaultdict(lambda: defaultdict(lambda: 0))
+        for r in self.rows:
+            if r[stat]:
+                d[r["item"]][r["subevent"]] += r[stat]
+        return d
+
+    def by_subevent(self, stat):
+        d = defaultdict(lambda: defaultdict(lambda: 0))
+        for r in self.rows:
+            if r[stat]:
+                d[r["subevent"]][r["item"]] += r[stat]
+        return d
+
+    def by_room(self, stat):
+        d = defaultdict(lambda: defaultdict(lambda: 0))
+        for r in self.rows:
+            if r[stat]:
+                d[r["order__orderroom__room"] is not None][r["subevent"]] += r[stat]
+        return d
+
+    def by_unique_room(self, stat):
+        rooms = defaultdict(lambda: defaultdict(set))
+        for r in self.rows:
+            if r[stat] and r["order__orderroom__room"] is not None:
+                rooms[True][r["subevent"]].add(r["order__orderroom__room"])
+        d = defaultdict(lambda: defaultdict(lambda: 0))
+        for has_room, subevents in rooms.items():
+            for subevent, room_ids in subevents.items():
+                d[has_room][subevent] = len(room_ids)
+        return d
+
+    def metrics(self):
+        """
+        Returns ``{metric: {labels: value}}`` in the format used by the metrics
+        endpoint.
+        """
+        m = {}
+        for d in TICKET_STATS:
+            for metric, values in stat_metrics(self.rows, d).items():
+                m[metric] = {"{%s}" % labels: c for labels, c in values.items()}
+        return m
+
+    def ticket_stats(self):
+        """
+        Returns one ``(label, by_item, by_subevent, by_room, by_unique_room)``
+        tuple per statistic, as rendered by the stats page.
+        """
+        result = []
+        for d in TICKET_STATS:
+            if d.get("cliq"):
+                c1 = self.by_room(d["id"])
+                c2 = self.by_unique_room(d["id"])
+            else:
+                c1 = c2 = None
+            result.append(
+                (
+                    d["label"],
+                    self.by_item(d["id"]),
+                    self.by_subevent(d["id"]),
+                    c1,
+                    c2,
+                )
+            )
+        return result
+
+
+def render_metrics(m):
+    output = []
+    for metric, sub in m.items():
+        for label, value in sub.items():
+            output.append("{}{} {}".format(metric, label, str(value)))
+    return "\n".join(output) + "\n"
+
+
+def _metric_querysets(positions, d):
+    """
+    Yields ``(metric, queryset, labels)`` for every metric of the statistic
+    ``d``. Every queryset counts the metric in ``c``, grouped by event,
+    subevent and item and ordered by event. ``labels`` are the fields of the
+    rows used as labels of the samples.
+    """
+    positions = positions.annotate(
+        has_refund=Exists(
+            OrderRefund.objects.filter(
+                order_id=OuterRef("order_id"),
+                state__in=[OrderRefund.REFUND_STATE_DONE],
+            )
+        ),
+        hasroom=ExpressionWrapper(
+            Q(order__orderroom__room__isnull=False), output_field=BooleanField()
+        ),
+    ).filter(d["q"])
+    group_by = ["order__event", "subevent", "item"]
+    if not d.get("cliq"):
+        qs = positions.values(*group_by).annotate(c=Count("id"))
+        yield d["id"], qs.order_by(*group_by), ("item", "subevent")
+        return
+
+    qs = positions.values(*group_by, "hasroom").annotate(c=Count("id"))
+    yield d["id"], qs.order_by(*group_by), ("item", "subevent", "hasroom")
+    qs = (
+        positions.filter(order__orderroom__isnull=False)
+        .values(*group_by)
+        .annotate(c=Count("order__orderroom__room", distinct=True))
+    )
+    yield d["id"] + "_unique_rooms", qs.order_by(*group_by), ("item", "subevent")
+
+
+def iter_openmetrics(events):
+    """
+    Yields the room metrics of the given queryset of events in the OpenMetrics
+    text format, labelled with the organizer and event of every sample.
+
+    Every metric is counted in one query grouped by event, subevent and item,
+    and its samples are yielded while the rows arrive, so memory use does not
+    grow with the number of events.
+    """
+    labels = {
+        pk: 'organizer="%s",event="%s"' % (organizer, event)
+        for pk, organizer, event in events.values_list("pk", "organizer__slug", "slug")
+    }
+    positions = OrderPosition.objects.filter(order__event__in=events.values("pk"))
+    for d in TICKET_STATS:
+        for metric, qs, fields in _metric_querysets(positions, d):
+            typed = False
+            for r in qs.iterator():
+                # Skips events created after their labels were fetched
+                if r["order__event"] not in labels:
+                    continue
+                if not typed:
+                    yield "# TYPE %s gauge\n" % metric
+                    typed = True
+                yield "%s{%s,%s} %s\n" % (
+                    metric,
+                    labels[r["order__event"]],
+                    ",".join('%s="%s"' % (f, r[f]) for f in fields),
+                    r["c"],
+                )
+    yield "# EOF\n"
+
+
+def _version_key(event_id):
+    return "pretix_roomsharing:metrics_version:%d" % event_id
+
+
+def invalidate_metrics(event_id):
+    """
+    Marks the cached metrics snapshot of the event with the given ID as outdated.
+    """
+    cache.set(_version_key(event_id), get_random_string(12), None)
+
+
+def get_metrics(event):
+    """
+    Returns the rendered metrics of an event from a cached snapshot.
+
+    The snapshot is only recomputed if it has been invalidated through
+    :py:func:`invalidate_metrics` *and* is older than the event's
+    ``roomsharing__metrics_max_age`` setting, so scrapes during a busy sale
+    cost at most one computation per interval and scrapes of a quiet event
+    are plain cache reads.
+    """
+    version = cache.get(_version_key(event.pk))
+    snapshot = event.cache.get("roomsharing_metrics")
+    if snapshot and (
+        snapshot["version"] == version
+        or time.time() - snapshot["created"]
+        < event.settings.roomsharing__metrics_max_age
+    ):
+        return snapshot["content"]
+
+    if version is None:
+        version = get_random_string(12)
+        cache.set(_version_key(event.pk), version, None)
+    content = render_metrics(TicketStats(event).metrics())
+    event.cache.set(
+        "roomsharing_metrics",
+        {"version": version, "created": time.time(), "content": content},
+        24 * 3600,
+    )
+    return content
@@ -1,9 +1,278 @@
-# import random
-# from collections import defaultdict
-# from django.db.models import Count, IntegerField, OuterRef, Subquery
-# from pretix.base.models import Event, Order, OrderPosition, SubEvent, User
-# from pretix.base.services.orders import OrderError, approve_order, deny_order
-# from pretix.base.services.tasks import EventTask
-# from pretix.celery_app import app
-
-# TODO Check if we can remove empty rooms automatically?
+import logging
+import time
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, Exists, Min, OuterRef, Q
+from django.utils.crypto import get_random_string
+from django.utils.translation import gettext as _
+from pretix.base.models import Event, LogEntry, Order, OrderPosition, User
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+
+from .availability import forget_missing_rooms
+from .eligibility import room_capacities, room_product_ids
+from .fragments import bump_order_versions
+from .models import OrderRoom, Room, normalize_room_name
+from .occupancy import refresh_occupancy
+from .stats import invalidate_metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def _unroomed_orders(event, product_ids):
+    """
+    Returns ``{(subevent_id, item_id): [(size, order_id), ...]}`` for all pending
+    or paid orders that contain a room product but are not part of a room yet.
+    """
+    groups = defaultdict(list)
+    rows = (
+        OrderPosition.objects.filter(
+            order__event=event,
+            order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+            order__orderroom__isnull=True,
+        )
+        .order_by()
+        .values("order_id")
+        .annotate(
+            room_item=Min("item_id", filter=Q(item_id__in=product_ids)),
+            room_subevent=Min("subevent_id", filter=Q(item_id__in=product_ids)),
+            size=Count("id", filter=Q(item__admission=True)),
+        )
+        .filter(room_item__isnull=False)
+    )
+    for r in rows.iterator():
+        groups[r["room_subevent"], r["room_item"]].append(
+            (max(r["size"], 1), r["order_id"])
+        )
+    return groups
+
+
+def _open_rooms(event, product_ids, room_size):
+    """
+    Returns ``{(subevent_id, item_id): [(free, room_id), ...]}`` for all rooms that
+    have members and free beds. Rooms without a capacity of their own or of their
+    room product are assumed to have ``room_size`` beds.
+    """
+    capacities = room_capacities(event)
+    groups = defaultdict(list)
+    rows = (
+        OrderPosition.objects.filter(
+            order__event=event,
+            order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+            order__orderroom__isnull=False,
+        )
+        .order_by()
+        .values("order__orderroom__room", "order__orderroom__room__capacity")
+        .annotate(
+            room_item=Min("item_id", filter=Q(item_id__in=product_ids)),
+            room_subevent=Min("subevent_id", filter=Q(item_id__in=product_ids)),
+            size=Count("id", filter=Q(item__admission=True)),
+        )
+        .filter(room_item__isnull=False)
+    )
+    for r in rows.iterator():
+        capacity = (
+            r["order__orderroom__room__capacity"]
+            or capacities.get(r["room_item"])
+            or room_size
+        )
+        if r["size"] < capacity:
+            groups[r["room_subevent"], r["room_item"]].append(
+                (capacity - r["size"], r["order__orderroom__room"])
+            )
+    return groups
+
+
+def _empty_rooms(event):
+    """
+    Returns ``{subevent_id: [(capacity, room_id), ...]}`` for all rooms without
+    members, e.g. rooms created in advance, in which ``capacity`` is the room's
+    own capacity or ``None``.
+    """
+    groups = defaultdict(list)
+    rows = (
+        event.rooms.filter(
+            ~Exists(
+                OrderRoom.objects.filter(
+                    room=OuterRef("pk"),
+                    order__status__in=(Order.STATUS_PENDING, Order.STATUS_PAID),
+                )
+            )
+        )
+        .order_by("name_key")
+        .values_list("subevent_id", "capacity", "pk")
+    )
+    for subevent_id, capacity, room_id in rows.iterator():
+        groups[subevent_id].append((capacity, room_id))
+    return groups
+
+
+def pack(orders, open_rooms, room_size):
+    """
+    Distributes orders over rooms with a best-fit decreasing strategy.
+
+    ``orders`` is a list of ``(size, order_id)`` tuples and ``open_rooms`` a list of
+    ``(free, room_id)`` tuples. Rooms are kept in buckets by their number of free
+    beds, so placing an order costs at most as many steps as the largest room has
+    beds and the run time is dominated by sorting the orders.
+
+    Returns a list of ``(order_id, room)`` tuples, in which ``room`` is either the ID
+    of an existing room or a negative number standing for a new room, and the number
+    of new rooms needed, which have ``room_size`` beds each. Orders larger than
+    ``room_size`` get a new room of their own.
+    """
+    largest = max([room_size] + [free for free, room_id in open_rooms])
+    buckets = [[] for _ in range(largest + 1)]
+    for free, room_id in open_rooms:
+        buckets[free].append(room_id)
+
+    placements = []
+    new_rooms = 0
+    for size, order_id in sorted(orders, reverse=True):
+        for free in range(size, largest + 1):
+            if buckets[free]:
+                room = buckets[free].pop()
+                break
+        else:
+            new_rooms += 1
+            room = -new_rooms
+            free = max(size, room_size)
+        placements.append((order_id, room))
+        if free > size:
+            buckets[free - size].append(room)
+    return placements, new_rooms
+
+
+def _room_names(event, count):
+    taken = set(event.rooms.values_list("name_key", flat=True))
+    number = 0
+    while count:
+        number += 1
+        name = _("Room {number}").format(number=number)
+        if normalize_room_name(name) not in taken:
+            count -= 1
+            yield name
+
+
+@app.task(base=EventTask)
+def assign_rooms(
+    event: Event, room_size: int, dry_run: bool = False, user: int = None
+) -> dict:
+    """
+    Assigns all attendees that need a room but have not joined or created one to
+    rooms with free beds, and creates new rooms for the rest.
+
+    Orders are only placed with rooms of the same date and the same room product,
+    empty rooms of the same date are filled before new rooms are created.
+    With ``dry_run``, nothing is written and only the report is returned.
+    """
+    started = time.monotonic()
+    product_ids = room_product_ids(event)
+    report = {
+        "dry_run": dry_run,
+        "orders": 0,
+        "attendees": 0,
+        "existing_rooms": 0,
+        "new_rooms": 0,
+    }
+    if not product_ids:
+        return report
+
+    orders = _unroomed_orders(event, product_ids)
+    open_rooms = _open_rooms(event, product_ids, room_size)
+    empty_rooms = _empty_rooms(event)
+
+    capacities = room_capacities(event)
+    plan = []
+    for (subevent_id, item_id), group in orders.items():
+        capacity = capacities.get(item_id, room_size)
+        # Empty rooms of the date are shared by all room products, each of them
+        # belongs to the first product that is placed in it
+        empty = empty_rooms.get(subevent_id, [])
+        placements, new_rooms = pack(
+            group,
+            open_rooms.get((subevent_id, item_id), [])
+            + [(own or capacity, room_id) for own, room_id in empty],
+            capacity,
+        )
+        used = {room for order_id, room in placements}
+        empty_rooms[subevent_id] = [r for r in empty if r[1] not in used]
+        plan.append((subevent_id, capacity, placements))
+        report["orders"] += len(group)
+        report["attendees"] += sum(size for size, order_id in group)
+        report["existing_rooms"] += len(
+            {room for order_id, room in placements if room > 0}
+        )
+        report["new_rooms"] += new_rooms
+
+    if not dry_run and plan:
+        if user:
+            user = User.objects.get(pk=user)
+        names = _room_names(event, report["new_rooms"])
+        for subevent_id, capacity, placements in plan:
+            _write_placements(event, subevent_id, capacity, placements, names, user)
+        invalidate_metrics(event.pk)
+
+    logger.info(
+        "Assigned %d orders to %d existing and %d new rooms for event %s in %.2fs%s",
+        report["orders"],
+        report["existing_rooms"],
+        report["new_rooms"],
+        event.slug,
+        time.monotonic() - started,
+        " (dry run)" if dry_run else "",
+    )
+    return report
+
+
+def _write_placements(event, subevent_id, capacity, placements, names, user):
+    rooms = {}
+    for start in range(0, len(placements), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        chunk = placements[start:end]
+        with transaction.atomic():
+            # Orders that found a room of their own since the plan was made keep it
+            taken = set(
+                OrderRoom.objects.filter(
+                    order_id__in=[order_id for order_id, room in chunk]
+                ).values_list("order_id", flat=True)
+            )
+            chunk = [(o, room) for o, room in chunk if o not in taken]
+
+            new_rooms = []
+            for order_id, room in chunk:
+                if room < 0 and room not in rooms:
+                    name = next(names)
+                    rooms[room] = Room(
+                        event=event,
+                        subevent_id=subevent_id,
+                        name=name,
+                        name_key=normalize_room_name(name),
+                        capacity=capacity,
+                        password=get_random_string(16),
+                    )
+                    new_rooms.append(rooms[room])
+            Room.objects.bulk_create(new_rooms)
+            transaction.on_commit(lambda rooms=new_rooms: forget_missing_rooms(rooms))
+
+            orderrooms = []
+            logentries = []
+            for order_id, room in chunk:
+                room_id = rooms[room].pk if room < 0 else room
+                orderrooms.append(OrderRoom(order_id=order_id, room_id=room_id))
+                logentries.append(
+                    Order(pk=order_id, event=event).log_action(
+                        "pretix_roomsharing.order.assigned",
+                        data={"room": room_id},
+                        user=user,
+                        save=False,
+                    )
+                )
+            OrderRoom.objects.bulk_create(orderrooms)
+            LogEntry.bulk_create_and_postprocess(logentries)
+
+            refresh_occupancy({o.room_id for o in orderrooms})
+            order_ids = [o.order_id for o in orderrooms]
+            transaction.on_commit(lambda: bump_order_versions(order_ids))
@@ -1,12 +1,22 @@
 from django.urls import path, re_path
+from pretix.api.urls import event_router
 
+from .api import RoomViewSet
+from .instrumentation import instrumented_view
 from .views import (
     ControlRoomChange,
     MetricsView,
+    MultiEventMetricsView,
     OrderRoomChange,
+    RoomAssign,
+    RoomBulkAction,
+    RoomCheck,
     RoomDelete,
     RoomDetail,
+    RoomImport,
+    RoomInvite,
     RoomList,
+    RoomSelect2,
     SettingsView,
     StatsView,
 )
@@ -14,45 +24,87 @@ from .views import (
 urlpatterns = [
     re_path(
         r"^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/roomsharing/",
-        SettingsView.as_view(),
+        instrumented_view(SettingsView),
         name="control.room.settings",
     ),
     re_path(
         r"^control/event/(?P<organizer>[^/]+)/(?P<event>[^/]+)/orders/(?P<code>[0-9A-Z]+)/room$",
-        ControlRoomChange.as_view(),
+        instrumented_view(ControlRoomChange),
         name="control.order.room.modify",
     ),
     path(
         r"control/event/<str:organizer>/<str:event>/rooms/stats/",
-        StatsView.as_view(),
+        instrumented_view(StatsView),
         name="event.stats",
     ),
     path(
         r"control/event/<str:organizer>/<str:event>/rooms/",
-        RoomList.as_view(),
+        instrumented_view(RoomList),
         name="event.room.list",
     ),
+    path(
+        r"control/event/<str:organizer>/<str:event>/rooms/assign/",
+        instrumented_view(RoomAssign),
+        name="event.room.assign",
+    ),
+    path(
+        r"control/event/<str:organizer>/<str:event>/rooms/bulk/",
+        instrumented_view(RoomBulkAction),
+        name="event.room.bulk",
+    ),
+    path(
+        r"control/event/<str:organizer>/<str:event>/rooms/import/",
+        instrumented_view(RoomImport),
+        name="event.room.import",
+    ),
+    path(
+        r"control/event/<str:organizer>/<str:event>/rooms/select2/",
+        instrumented_view(RoomSelect2),
+        name="event.room.select2",
+    ),
     path(
         r"control/event/<str:organizer>/<str:event>/rooms/<int:pk>/",
-        RoomDetail.as_view(),
+        instrumented_view(RoomDetail),
         name="event.room.detail",
     ),
     path(
         r"control/event/<str:organizer>/<str:event>/rooms/<int:pk>/delete",
-        RoomDelete.as_view(),
+        instrumented_view(RoomDelete),
         name="event.room.delete",
     ),
     path(
         r"metrics/rooms/<str:organizer>/<str:event>/",
-        MetricsView.as_view(),
+        instrumented_view(MetricsView),
         name="metrics",
     ),
+    path(
+        r"metrics/rooms/<str:organizer>/",
+        instrumented_view(MultiEventMetricsView),
+        name="metrics.organizer",
+    ),
+    path(
+        r"metrics/rooms/",
+        instrumented_view(MultiEventMetricsView),
+        name="metrics.instance",
+    ),
 ]
 
 event_patterns = [
     re_path(
         r"^order/(?P<order>[^/]+)/(?P<secret>[A-Za-z0-9]+)/room/modify$",
-        OrderRoomChange.as_view(),
+        instrumented_view(OrderRoomChange),
         name="event.order.room.modify",
     ),
+    path(
+        "room/check",
+        instrumented_view(RoomCheck),
+        name="event.room.check",
+    ),
+    path(
+        "room/invite/<str:token>/",
+        instrumented_view(RoomInvite),
+        name="event.room.invite",
+    ),
 ]
+
+event_router.register("rooms", RoomViewSet)
@@ -1,26 +1,28 @@
 import base64
 import hmac
 import logging
-from collections import defaultdict
 from django import forms
 from django.conf import settings
 from django.contrib import messages
-from django.db import transaction
-from django.db.models import Count, Exists, OuterRef
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.forms.widgets import CheckboxSelectMultiple
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.utils.functional import cached_property
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, pgettext_lazy
 from django.views import View
 from django.views.decorators.clickjacking import xframe_options_exempt
-from django.views.generic import ListView, TemplateView
+from django.views.generic import FormView, ListView, TemplateView
 from django_scopes import scopes_disabled
+from django_scopes.forms import SafeModelChoiceField, SafeModelMultipleChoiceField
 from pretix.base.forms import SettingsForm
-from pretix.base.models import Event, Order, OrderPosition, OrderRefund
+from pretix.base.models import Event, Order, Organizer, SubEvent
 from pretix.base.views.metrics import unauthed_response
+from pretix.base.views.tasks import AsyncAction
+from pretix.control.forms.widgets import Select2
 from pretix.control.permissions import EventPermissionRequiredMixin
 from pretix.control.views import UpdateView
 from pretix.control.views.event import EventSettingsFormView, EventSettingsViewMixin
@@ -28,6 +30,7 @@ from pretix.control.views.orders import OrderView
 from pretix.helpers.compat import CompatDeleteView
 from pretix.multidomain.urlreverse import eventreverse
 from pretix.presale.views import EventViewMixin
+from pretix.presale.views.cart import get_or_create_cart_id
 from pretix.presale.views.order import OrderDetailMixin
 
 logger = logging.getLogger(__name__)
@@ -40,6 +43,23 @@ class RoomsharingSettingsForm(SettingsForm):
         required=False,
         widget=CheckboxSelectMultiple,
     )
+    roomsharing__metrics_max_age = forms.IntegerField(
+        label=_("Maximum age of metrics"),
+        help_text=_(
+            "Metrics are cached and recomputed after changes to orders or rooms, but "
+            "at most once within this number of seconds."
+        ),
+        min_value=0,
+        required=False,
+    )
+    roomsharing__delete_empty_rooms = forms.BooleanField(
+        label=_("Delete empty rooms"),
+        help_text=_(
+            "Rooms without members are deleted a day after they have been created. "
+            "Keep this disabled if you create rooms in advance."
+        ),
+        required=False,
+    )
 
     def __init__(self, *args, **kwargs):
         event = kwargs.get("obj")
@@ -50,8 +70,21 @@ class RoomsharingSettingsForm(SettingsForm):
         )
 
         self.fields["roomsharing__products"].choices = choices
+        for item in event.items.all():
+            self.fields["roomsharing__capacity_%d" % item.pk] = forms.IntegerField(
+                label=_("Beds per room: {product}").format(product=item.name),
+                help_text=_(
+                    "Rooms shared by holders of this product are considered full "
+                    "with this number of attendees, unless a room has its own capacity."
+                ),
+                min_value=1,
+                required=False,
+            )
         #self.initial["roomsharing__products"] = event.settings.roomsharing__products
 
+    def capacity_fields(self):
+        return [f for f in self if f.name.startswith("roomsharing__capacity_")]
+
 
 class SettingsView(EventSettingsViewMixin, EventSettingsFormView):
     model = Event
@@ -70,8 +103,31 @@ class SettingsView(EventSettingsViewMixin, EventSettingsFormView):
         )
 
 
+from . import instrumentation
+from .availability import check_room, rate_limited
+from .bulk import delete_rooms, move_members, reset_passwords
 from .checkoutflow import RoomCreateForm, RoomJoinForm
-from .models import OrderRoom, Room
+from .eligibility import room_capacities
+from .imports import import_rooms, parse_rows
+from .invites import (
+    forget_invite,
+    make_invite_token,
+    read_invite_token,
+    remember_invite,
+    remembered_invite,
+)
+from .models import OrderRoom, Room, normalize_room_name
+from .occupancy import (
+    RoomBusy,
+    RoomFull,
+    WrongDate,
+    create_room,
+    join_room,
+    refresh_occupancy,
+)
+from .pagination import KeysetPage
+from .stats import TicketStats, get_metrics, iter_openmetrics, render_metrics
+from .tasks import assign_rooms
 
 
 class RoomChangePasswordForm(forms.Form):
@@ -89,6 +145,65 @@ class RoomChangePasswordForm(forms.Form):
 
 
 @method_decorator(xframe_options_exempt, "dispatch")
+class RoomCheck(EventViewMixin, View):
+    """
+    Checks a room name, and for joins the password, while it is typed in the
+    checkout, without submitting the whole checkout step.
+    """
+
+    def post(self, request, *args, **kwargs):
+        mode = request.POST.get("mode")
+        if mode not in ("create", "join"):
+            return JsonResponse({"error": "Unknown mode."}, status=400)
+        # Rooms are only checked for someone who is about to choose one
+        cart_id = get_or_create_cart_id(request, create=False)
+        if cart_id is None:
+            return JsonResponse({"error": "No cart."}, status=403)
+
+        name = " ".join(request.POST.get("name", "").split())
+        password = request.POST.get("password", "")
+        if rate_limited(request, name if mode == "join" and password else None):
+            return JsonResponse(
+                {"error": str(_("Please wait a moment before trying again."))},
+                status=429,
+            )
+
+        if not name:
+            field, message = "name", RoomJoinForm.error_messages["required"]
+        else:
+            field, message = check_room(
+                request.event, mode, name, password, cart_id=cart_id
+            )
+        return JsonResponse(
+            {
+                "ok": field is None,
+                "field": field,
+                "message": str(message) if message else "",
+            }
+        )
+
+
+class RoomInvite(EventViewMixin, View):
+    """
+    Remembers the token of a room invite link, so the room is offered in the
+    checkout and when changing the room of an order, and continues to the shop.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if read_invite_token(request.event, kwargs["token"]) is None:
+            messages.error(request, RoomJoinForm.error_messages["invite_invalid"])
+        else:
+            remember_invite(request, kwargs["token"])
+            messages.info(
+                request,
+                _(
+                    "You have been invited to join a room. You can join it when you "
+                    "choose your room during checkout or on the page of your order."
+                ),
+            )
+        return redirect(eventreverse(request.event, "presale:event.index"))
+
+
 class OrderRoomChange(EventViewMixin, OrderDetailMixin, TemplateView):
     template_name = "pretix_roomsharing/order_room_change.html"
 
@@ -110,15 +225,17 @@ class OrderRoomChange(EventViewMixin, OrderDetailMixin, TemplateView):
 
         return super().dispatch(request, *args, **kwargs)
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        # Not atomic as a whole, join_room needs to run outside of transactions
         self.request = request
 
         mode = request.POST.get("room_mode")
         if mode == "leave":
             try:
                 c = self.order.orderroom
-                c.delete()
+                with transaction.atomic():
+                    c.delete()
+                    refresh_occupancy([c.room_id])
                 self.order.log_action(
                     "pretix_roomsharing.order.left", data={"room": c.pk}
                 )
@@ -164,25 +281,49 @@ class OrderRoomChange(EventViewMixin, OrderDetailMixin, TemplateView):
         elif mode == "join":
             if self.join_form.is_valid():
                 room = self.join_form.cleaned_data["room"]
-                OrderRoom.objects.create(room=room, order=self.order)
-                self.order.log_action(
-                    "pretix_roomsharing.order.joined", data={"room": room.pk}
-                )
-                messages.success(request, _("Great, we saved your changes!"))
-                return redirect(self.get_order_url())
+                try:
+                    join_room(room, self.order)
+                except RoomFull:
+                    self.join_form.add_error(
+                        "name", self.join_form.error_messages["room_full"]
+                    )
+                except RoomBusy:
+                    self.join_form.add_error(
+                        "name", self.join_form.error_messages["room_busy"]
+                    )
+                except IntegrityError:
+                    # Submitted twice, the order is already part of a room
+                    return redirect(self.get_order_url())
+                else:
+                    forget_invite(request)
+                    self.order.log_action(
+                        "pretix_roomsharing.order.joined", data={"room": room.pk}
+                    )
+                    messages.success(request, _("Great, we saved your changes!"))
+                    return redirect(self.get_order_url())
 
         elif mode == "create":
             if self.create_form.is_valid():
                 room = Room(event=self.request.event)
                 room.name = self.create_form.cleaned_data["name"]
                 room.password = self.create_form.cleaned_data["password"]
-                room.save()
-                OrderRoom.objects.create(room=room, order=self.order, is_admin=True)
-                self.order.log_action(
-                    "pretix_roomsharing.order.created", data={"room": room.pk}
-                )
-                messages.success(request, _("Great, we saved your changes!"))
-                return redirect(self.get_order_url())
+                try:
+                    create_room(room, self.order)
+                except IntegrityError:
+                    # Either the name has been taken in the meantime, or the form
+                    # was submitted twice and the order is already part of a room
+                    if not OrderRoom.objects.filter(order=self.order).exists():
+                        self.create_form.add_error(
+                            "name", self.create_form.error_messages["duplicate_name"]
+                        )
+                    else:
+                        return redirect(self.get_order_url())
+                else:
+                    self.order.log_action(
+                        "pretix_roomsharing.order.created", data={"room": room.pk}
+                    )
+                    messages.success(request, _("Great, we saved your changes!"))
+                    return redirect(self.get_order_url())
         elif mode == "none":
             messages.success(request, _("Great, we saved your changes!"))
             return redirect(self.get_order_url())
@@ -220,6 +361,7 @@ class OrderRoomChange(EventViewMixin, OrderDetailMixin, TemplateView):
         return RoomJoinForm(
             event=self.request.event,
             prefix="join",
+            initial={"invite": remembered_invite(self.request)},
             data=self.request.POST
             if self.request.method == "POST"
             and self.request.POST.get("room_mode") == "join"
@@ -237,8 +379,12 @@ class OrderRoomChange(EventViewMixin, OrderDetailMixin, TemplateView):
             c = self.order.orderroom
             ctx["room"] = c.room
             ctx["is_admin"] = c.is_admin
+            if c.is_admin:
+                ctx["invite_token"] = make_invite_token(c.room)
         except OrderRoom.DoesNotExist:
-            ctx["selected"] = self.request.POST.get("room_mode", "none")
+            ctx["selected"] = self.request.POST.get(
+                "room_mode", "join" if self.join_form.invite_room else "none"
+            )
 
         return ctx
 
@@ -256,7 +402,22 @@ class ControlRoomForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.event = kwargs.pop("event")
         super().__init__(*args, **kwargs)
-        self.fields["room"].queryset = self.event.room.all()
+        self.fields["room"].queryset = self.event.rooms.all()
+        # Only the selected room is rendered, all others are searched for
+        self.fields["room"].widget = Select2(
+            attrs={
+                "data-model-select2": "generic",
+                "data-select2-url": reverse(
+                    "plugins:pretix_roomsharing:event.room.select2",
+                    kwargs={
+                        "event": self.event.slug,
+                        "organizer": self.event.organizer.slug,
+                    },
+                ),
+                "data-placeholder": _("Search for a room"),
+            }
+        )
+        self.fields["room"].widget.choices = self.fields["room"].choices
 
 
 class ControlRoomChange(OrderView):
@@ -280,9 +441,12 @@ class ControlRoomChange(OrderView):
         ctx["form"] = self.form
         return ctx
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        previous_room = self.form.initial.get("room")
         if self.form.is_valid():
             self.form.save()
+            refresh_occupancy([previous_room, self.form.instance.room_id])
             messages.success(request, _("Great, we saved your changes!"))
             return redirect(self.get_order_url())
         messages.error(
@@ -292,29 +456,180 @@ class ControlRoomChange(OrderView):
         return self.get(request, *args, **kwargs)
 
 
+class RoomFilterForm(forms.Form):
+    orders = {
+        "name": ("name", False),
+        "-name": ("name", True),
+        "members": ("members", False),
+        "-members": ("members", True),
+    }
+
+    query = forms.CharField(
+        label=_("Room name"),
+        required=False,
+        widget=forms.TextInput(attrs={"placeholder": _("Room name")}),
+    )
+    status = forms.ChoiceField(
+        label=_("Status"),
+        required=False,
+        choices=(
+            ("", _("All rooms")),
+            ("empty", _("Empty rooms")),
+            ("single", _("Rooms with a single occupant")),
+            ("shared", _("Rooms with multiple occupants")),
+            ("full", _("Full rooms")),
+        ),
+    )
+    subevent = SafeModelChoiceField(
+        label=pgettext_lazy("subevent", "Date"),
+        queryset=SubEvent.objects.none(),
+        required=False,
+        empty_label=pgettext_lazy("subevent", "All dates"),
+    )
+    ordering = forms.ChoiceField(
+        required=False,
+        choices=[(k, k) for k in orders],
+        widget=forms.HiddenInput,
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.event = kwargs.pop("event")
+        super().__init__(*args, **kwargs)
+        if self.event.has_subevents:
+            self.fields["subevent"].queryset = self.event.subevents.all()
+        else:
+            del self.fields["subevent"]
+
+    def filter_qs(self, qs):
+        fdata = self.cleaned_data
+        if fdata.get("subevent"):
+            qs = qs.filter(subevent=fdata["subevent"])
+        if fdata.get("query"):
+            qs = qs.filter(name_key__startswith=normalize_room_name(fdata["query"]))
+        if fdata.get("status") == "empty":
+            qs = qs.filter(members=0)
+        elif fdata.get("status") == "single":
+            qs = qs.filter(members=1)
+        elif fdata.get("status") == "shared":
+            qs = qs.filter(members__gt=1)
+        elif fdata.get("status") == "full":
+            qs = qs.with_capacity(room_capacities(self.event)).filter(
+                effective_capacity__isnull=False,
+                members__gte=F("effective_capacity"),
+            )
+        return qs
+
+    def get_order_by(self):
+        return self.orders[self.cleaned_data.get("ordering") or "name"]
+
+
 class RoomList(EventPermissionRequiredMixin, ListView):
     permission = "can_change_orders"
     template_name = "pretix_roomsharing/control_list.html"
     context_object_name = "rooms"
-    paginate_by = 25
+    page_size = 25
+
+    @cached_property
+    def filter_form(self):
+        return RoomFilterForm(data=self.request.GET, event=self.request.event)
 
     def get_queryset(self):
-        return self.request.event.rooms.all()
+        qs = self.request.event.rooms.with_stats().select_related("subevent")
+        field, descending = "name", False
+        if self.filter_form.is_valid():
+            qs = self.filter_form.filter_qs(qs)
+            field, descending = self.filter_form.get_order_by()
+        page = KeysetPage(
+            qs,
+            field,
+            self.page_size,
+            descending=descending,
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+        )
+        for room in page:
+            if room.subevent:
+                # Spares loading the event and its settings again for every row
+                room.subevent.event = self.request.event
+        return page
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["filter_form"] = self.filter_form
+        ctx["page"] = self.object_list
+        return ctx
+
+
+class RoomSelect2(EventPermissionRequiredMixin, View):
+    """
+    Searches rooms by the start of their name for the room selection widgets.
+    """
+
+    permission = "can_change_orders"
+    page_size = 20
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page = max(int(request.GET.get("page", "1")), 1)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * self.page_size
+        # One more room than shown tells whether there is another page
+        end = offset + self.page_size + 1
+        qs = (
+            request.event.rooms.search(request.GET.get("query", ""))
+            .with_members()
+            .select_related("subevent")
+            .order_by("name_key", "pk")
+        )
+        rooms = list(qs[offset:end])
+
+        results = []
+        for room in rooms[: self.page_size]:
+            if room.capacity:
+                text = "{} ({}/{})".format(room.name, room.members, room.capacity)
+            else:
+                text = "{} ({})".format(room.name, room.members)
+            result = {
+                "id": room.pk,
+                "text": text,
+                "name": room.name,
+                "members": room.members,
+                "capacity": room.capacity,
+            }
+            if room.subevent:
+                room.subevent.event = request.event
+                result["event"] = str(room.subevent)
+            results.append(result)
+        return JsonResponse(
+            {
+                "results": results,
+                "pagination": {"more": len(rooms) > self.page_size},
+            }
+        )
 
 
 class RoomForm(forms.ModelForm):
     class Meta:
         model = Room
-        fields = ["name", "password"]
+        fields = ["name", "password", "capacity", "subevent"]
+        field_classes = {
+            "subevent": SafeModelChoiceField,
+        }
 
     def __init__(self, *args, **kwargs):
         self.event = kwargs.pop("event")
         super().__init__(*args, **kwargs)
+        if self.event.has_subevents:
+            self.fields["subevent"].queryset = self.event.subevents.all()
+        else:
+            del self.fields["subevent"]
 
     def clean_name(self):
         name = self.cleaned_data.get("name")
         if (
-            Room.objects.filter(event=self.event, name=name)
+            Room.objects.filter(event=self.event)
+            .by_name(name)
             .exclude(pk=self.instance.pk)
             .exists()
         ):
@@ -368,20 +683,9 @@ class RoomDelete(EventPermissionRequiredMixin, CompatDeleteView):
         ctx["orders"] = self.object.orderrooms.select_related("order")
         return ctx
 
-    @transaction.atomic
     def delete(self, request, *args, **kwargs):
-        o = self.object = self.get_object()
-        o.log_action(
-            "pretix_roomsharing.room.deleted", data={"name": o.name}, user=request.user
-        )
-        for oc in self.object.orderrooms.select_related("order"):
-            oc.order.log_action(
-                "pretix_roomsharing.order.deleted",
-                data={"room": o.pk},
-                user=request.user,
-            )
-            oc.delete()
-        o.delete()
+        self.object = self.get_object()
+        delete_rooms(request.event, [self.object.pk], user=request.user)
         messages.success(self.request, _("The room has been deleted."))
         return redirect(
             reverse(
@@ -394,198 +698,337 @@ class RoomDelete(EventPermissionRequiredMixin, CompatDeleteView):
         )
 
 
-class StatsMixin:
-    def get_ticket_stats(self, event):
-        qs = OrderPosition.objects.filter(order__event=event,).annotate(
-            has_room=Exists(OrderRoom.objects.filter(order_id=OuterRef("order_id")))
-        )
-        return [
-            {
-                "id": "tickets_total",
-                "label": _("All tickets, total"),
-                "qs": qs.filter(
-                    order__status=Order.STATUS_PENDING, order__require_approval=True
-                ),
-                "qs_cliq": True,
-            },
-            {
-                "id": "tickets_registered",
-                "label": _("Tickets Pending"),
-                "qs": qs.filter(
-                    order__status=Order.STATUS_PENDING, order__require_approval=True
-                ),
-                "qs_cliq": True,
-            },
-            {
-                "id": "tickets_approved",
-                "label": _("Tickets in approved orders (regardless of payment status)"),
-                "qs": qs.filter(order__require_approval=False),
-                "qs_cliq": True,
-            },
-            {
-                "id": "tickets_paid",
-                "label": _("Tickets in paid orders"),
-                "qs": qs.filter(
-                    order__require_approval=False, order__status=Order.STATUS_PAID
-                ),
-            },
-            {
-                "id": "tickets_pending",
-                "label": _("Tickets in pending orders"),
-                "qs": qs.filter(
-                    order__require_approval=False, order__status=Order.STATUS_PENDING
-                ),
-            },
-            {
-                "id": "tickets_canceled",
-                "label": _(
-                    "Tickets in canceled orders (except the ones not chosen in raffle)"
-                ),
-                "qs": qs.filter(
-                    order__require_approval=False, order__status=Order.STATUS_CANCELED
-                ),
-            },
-            {
-                "id": "tickets_canceled_refunded",
-                "label": _(
-                    "Tickets in canceled and at least partially refunded orders"
-                ),
-                "qs": qs.annotate(
-                    has_refund=Exists(
-                        OrderRefund.objects.filter(
-                            order_id=OuterRef("order_id"),
-                            state__in=[OrderRefund.REFUND_STATE_DONE],
+class RoomBulkForm(forms.Form):
+    actions = {
+        "delete": _("Delete rooms"),
+        "merge": _("Merge rooms into another room"),
+        "move": _("Move members to another room"),
+        "reset_password": _("Reset passwords"),
+    }
+
+    rooms = SafeModelMultipleChoiceField(
+        queryset=Room.objects.none(),
+        widget=forms.MultipleHiddenInput,
+    )
+    action = forms.ChoiceField(
+        choices=list(actions.items()),
+        widget=forms.HiddenInput,
+    )
+    target = forms.CharField(
+        label=_("Target room"),
+        help_text=_("Name of the room the members are moved to."),
+        required=False,
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.event = kwargs.pop("event")
+        super().__init__(*args, **kwargs)
+        self.fields["rooms"].queryset = self.event.rooms.all()
+
+    def clean(self):
+        data = super().clean()
+        if data.get("action") in ("merge", "move"):
+            target = (
+                self.event.rooms.by_name(data["target"]).first()
+                if data.get("target")
+                else None
+            )
+            if target is None:
+                raise forms.ValidationError(
+                    {"target": _("Please enter the name of an existing room.")}
+                )
+            if target in data.get("rooms", []):
+                raise forms.ValidationError(
+                    {
+                        "target": _(
+                            "The target room may not be one of the selected rooms."
                         )
-                    )
-                ).filter(
-                    price__gt=0, order__status=Order.STATUS_CANCELED, has_refund=True
-                ),
+                    }
+                )
+            data["target"] = target
+        return data
+
+
+class RoomBulkAction(EventPermissionRequiredMixin, FormView):
+    """
+    Applies an action to the rooms selected on the room list. The first request
+    comes from the room list and shows a confirmation page, the action is only
+    performed once that page is submitted with ``confirm``.
+    """
+
+    permission = "can_change_orders"
+    template_name = "pretix_roomsharing/control_bulk.html"
+    form_class = RoomBulkForm
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["event"] = self.request.event
+        return kwargs
+
+    def get(self, request, *args, **kwargs):
+        return redirect(self.get_success_url())
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        valid = form.is_valid()
+        if "rooms" in form.errors or "action" in form.errors:
+            messages.error(request, _("Please select at least one room."))
+            return redirect(self.get_success_url())
+        self.rooms = form.cleaned_data["rooms"]
+        self.action = form.cleaned_data["action"]
+
+        if "confirm" not in request.POST:
+            # Coming from the room list, ask for confirmation and a target room
+            form = RoomBulkForm(
+                event=request.event,
+                initial={"rooms": [r.pk for r in self.rooms], "action": self.action},
+            )
+            return self.render_to_response(self.get_context_data(form=form))
+        elif valid:
+            return self.form_valid(form)
+        else:
+            return self.form_invalid(form)
+
+    def form_valid(self, form):
+        room_ids = [r.pk for r in self.rooms]
+        user = self.request.user
+        if self.action == "delete":
+            count = delete_rooms(self.request.event, room_ids, user=user)
+            msg = _("{count} rooms have been deleted.")
+        elif self.action in ("merge", "move"):
+            try:
+                count = move_members(
+                    self.request.event,
+                    room_ids,
+                    form.cleaned_data["target"],
+                    user=user,
+                    delete_sources=self.action == "merge",
+                )
+            except WrongDate:
+                form.add_error(
+                    "target",
+                    _("The members of the selected rooms are for a different date."),
+                )
+                return self.form_invalid(form)
+            except RoomFull:
+                form.add_error(
+                    "target",
+                    _("The members of the selected rooms do not fit into this room."),
+                )
+                return self.form_invalid(form)
+            msg = _("{count} orders have been moved.")
+        else:
+            count = reset_passwords(self.request.event, room_ids, user=user)
+            msg = _("{count} passwords have been reset.")
+        messages.success(self.request, msg.format(count=count))
+        return redirect(self.get_success_url())
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx["action_label"] = RoomBulkForm.actions[self.action]
+        ctx["needs_target"] = self.action in ("merge", "move")
+        ctx["rooms"] = self.rooms
+        return ctx
+
+    def get_success_url(self):
+        return reverse(
+            "plugins:pretix_roomsharing:event.room.list",
+            kwargs={
+                "organizer": self.request.organizer.slug,
+                "event": self.request.event.slug,
             },
-            {
-                "id": "tickets_denied",
-                "label": _("Tickets denied (not chosen in raffle)"),
-                "qs": qs.filter(
-                    order__require_approval=True, order__status=Order.STATUS_CANCELED
-                ),
-                "qs_cliq": True,
+        )
+
+
+class RoomAssignForm(forms.Form):
+    room_size = forms.IntegerField(
+        label=_("Beds per room"),
+        help_text=_(
+            "Used for rooms that have no capacity of their own and whose room "
+            "product has no configured number of beds."
+        ),
+        min_value=1,
+        max_value=100,
+        initial=2,
+    )
+    dry_run = forms.BooleanField(
+        label=_("Only show what would happen, do not assign any rooms yet"),
+        required=False,
+        initial=True,
+    )
+
+
+class RoomAssign(EventPermissionRequiredMixin, AsyncAction, FormView):
+    permission = "can_change_orders"
+    template_name = "pretix_roomsharing/control_assign.html"
+    form_class = RoomAssignForm
+    task = assign_rooms
+
+    def get(self, request, *args, **kwargs):
+        if "async_id" in request.GET and settings.HAS_CELERY:
+            return self.get_result(request)
+        return FormView.get(self, request, *args, **kwargs)
+
+    def form_valid(self, form):
+        return self.do(
+            self.request.event.pk,
+            room_size=form.cleaned_data["room_size"],
+            dry_run=form.cleaned_data["dry_run"],
+            user=self.request.user.pk,
+        )
+
+    def get_success_message(self, value):
+        if value["dry_run"]:
+            msg = _(
+                "{orders} orders with {attendees} attendees would be assigned to "
+                "{existing_rooms} existing and {new_rooms} new rooms."
+            )
+        else:
+            msg = _(
+                "{orders} orders with {attendees} attendees have been assigned to "
+                "{existing_rooms} existing and {new_rooms} new rooms."
+            )
+        return msg.format(**value)
+
+    def get_success_url(self, value):
+        if value["dry_run"]:
+            return self.get_error_url()
+        return reverse(
+            "plugins:pretix_roomsharing:event.room.list",
+            kwargs={
+                "organizer": self.request.organizer.slug,
+                "event": self.request.event.slug,
             },
-        ]
+        )
 
+    def get_error_url(self):
+        return reverse(
+            "plugins:pretix_roomsharing:event.room.assign",
+            kwargs={
+                "organizer": self.request.organizer.slug,
+                "event": self.request.event.slug,
+            },
+        )
+
+
+class RoomImportForm(forms.Form):
+    file = forms.FileField(
+        label=_("CSV file"),
+        help_text=_(
+            "One line per order with the order code, the room name and optionally "
+            "whether the order should administrate the room (yes/no)."
+        ),
+    )
+
+
+class RoomImport(EventPermissionRequiredMixin, FormView):
+    permission = "can_change_orders"
+    template_name = "pretix_roomsharing/control_import.html"
+    form_class = RoomImportForm
 
-class StatsView(StatsMixin, EventPermissionRequiredMixin, TemplateView):
+    def form_valid(self, form):
+        errors, result = import_rooms(
+            self.request.event,
+            parse_rows(form.cleaned_data["file"]),
+            user=self.request.user,
+        )
+        if errors:
+            messages.error(
+                self.request,
+                _("The file contains errors, no rooms have been changed."),
+            )
+            return self.render_to_response(
+                self.get_context_data(form=form, errors=errors)
+            )
+        messages.success(
+            self.request,
+            _(
+                "{orders} orders have been assigned to their rooms, {rooms} rooms "
+                "have been created."
+            ).format(**result),
+        )
+        return redirect(
+            reverse(
+                "plugins:pretix_roomsharing:event.room.list",
+                kwargs={
+                    "organizer": self.request.organizer.slug,
+                    "event": self.request.event.slug,
+                },
+            )
+        )
+
+
+class StatsView(EventPermissionRequiredMixin, TemplateView):
     template_name = "pretix_roomsharing/control_stats.html"
     permission = "can_view_orders"
 
     def get_context_data(self, **kwargs):
-        def qs_by_item(qs):
-            d = defaultdict(lambda: defaultdict(lambda: 0))
-            for r in qs:
-                d[r["item"]][r["subevent"]] = r["c"]
-            return d
-
-        def qs_by_room(qs):
-            d = defaultdict(lambda: defaultdict(lambda: 0))
-            for r in qs:
-                d[r["has_room"]][r["subevent"]] = r["c"]
-            return d
-
-        def qs_by_unique_room(qs):
-            d = defaultdict(lambda: defaultdict(lambda: 0))
-            for r in qs:
-                d[r["has_room"]][r["subevent"]] = r["cc"]
-            return d
-
-        def qs_by_subevent(qs):
-            d = defaultdict(lambda: defaultdict(lambda: 0))
-            for r in qs:
-                d[r["subevent"]][r["item"]] = r["c"]
-            return d
-
         ctx = super().get_context_data()
         ctx["subevents"] = self.request.event.subevents.all()
         ctx["items"] = self.request.event.items.all()
-        ctx["ticket_stats"] = []
-        for d in self.get_ticket_stats(self.request.event):
-            qs = list(
-                d["qs"].order_by().values("subevent", "item").annotate(c=Count("*"))
-            )
-            if d.get("qs_cliq"):
-                qsc = list(
-                    d["qs"]
-                    .order_by()
-                    .values("subevent", "has_room")
-                    .annotate(
-                        c=Count("*"), cc=Count("order__orderroom__room", distinct=True)
-                    )
-                )
-                c1 = qs_by_room(qsc)
-                c2 = qs_by_unique_room(qsc)
-            else:
-                c1 = c2 = None
-
-            ctx["ticket_stats"].append(
-                (d["label"], qs_by_item(qs), qs_by_subevent(qs), c1, c2)
-            )
+        ctx["ticket_stats"] = TicketStats(self.request.event).ticket_stats()
         return ctx
 
 
-class MetricsView(StatsMixin, View):
-    @scopes_disabled()
-    def get(self, request, organizer, event):
-        event = get_object_or_404(Event, slug=event, organizer__slug=organizer)
-        if not settings.METRICS_ENABLED:
-            return unauthed_response()
+def metrics_authorized(request):
+    if not settings.METRICS_ENABLED:
+        return False
 
-        # check if the user is properly authorized:
-        if "Authorization" not in request.headers:
-            return unauthed_response()
+    # check if the user is properly authorized:
+    if "Authorization" not in request.headers:
+        return False
 
-        method, credentials = request.headers["Authorization"].split(" ", 1)
-        if method.lower() != "basic":
-            return unauthed_response()
+    method, credentials = request.headers["Authorization"].split(" ", 1)
+    if method.lower() != "basic":
+        return False
 
-        user, passphrase = base64.b64decode(credentials.strip()).decode().split(":", 1)
+    user, passphrase = base64.b64decode(credentials.strip()).decode().split(":", 1)
 
-        if not hmac.compare_digest(user, settings.METRICS_USER):
-            return unauthed_response()
-        if not hmac.compare_digest(passphrase, settings.METRICS_PASSPHRASE):
+    if not hmac.compare_digest(user, settings.METRICS_USER):
+        return False
+    if not hmac.compare_digest(passphrase, settings.METRICS_PASSPHRASE):
+        return False
+    return True
+
+
+class MetricsView(View):
+    @scopes_disabled()
+    def get(self, request, organizer, event):
+        # Authorize first, so unauthorized requests cannot tell which events exist
+        if not metrics_authorized(request):
             return unauthed_response()
+        event = get_object_or_404(Event, slug=event, organizer__slug=organizer)
 
         # ok, the request passed the authentication-barrier, let's hand out the metrics:
-        m = defaultdict(dict)
-        for d in self.get_ticket_stats(event):
-            if d.get("qs_cliq"):
-                qs = (
-                    d["qs"]
-                    .order_by()
-                    .values("subevent", "item", "has_room")
-                    .annotate(
-                        c=Count("*"), cc=Count("order__orderroom__room", distinct=True)
-                    )
-                )
-                for r in qs:
-                    m[d["id"]][
-                        '{item="%s",subevent="%s",hasroom="%s"}'
-                        % (r["item"], r["subevent"], r["has_room"])
-                    ] = r["c"]
-                    if r["cc"]:
-                        m[d["id"] + "_unique_rooms"][
-                            '{item="%s",subevent="%s"}' % (r["item"], r["subevent"])
-                        ] = r["cc"]
-            else:
-                qs = (
-                    d["qs"].order_by().values("subevent", "item").annotate(c=Count("*"))
-                )
-                for r in qs:
-                    m[d["id"]][
-                        '{item="%s",subevent="%s"}' % (r["item"], r["subevent"])
-                    ] = r["c"]
+        content = get_metrics(event)
+        if instrumentation.enabled():
+            content += render_metrics(instrumentation.metrics())
+        return HttpResponse(content)
 
-        output = []
-        for metric, sub in m.items():
-            for label, value in sub.items():
-                output.append("{}{} {}".format(metric, label, str(value)))
 
-        content = "\n".join(output) + "\n"
+class MultiEventMetricsView(View):
+    """
+    Metrics of all events of an organizer, or of all events of the instance if
+    no organizer is given, for a single scrape job.
+    """
 
-        return HttpResponse(content)
+    @scopes_disabled()
+    def get(self, request, organizer=None):
+        # Authorize first, so unauthorized requests cannot tell which organizers
+        # exist
+        if not metrics_authorized(request):
+            return unauthed_response()
+        events = Event.objects.filter(plugins__regex="(^|,)pretix_roomsharing(,|$)")
+        if organizer is not None:
+            organizer = get_object_or_404(Organizer, slug=organizer)
+            events = events.filter(organizer=organizer)
+
+        def stream():
+            # The response is consumed after the view has returned
+            with scopes_disabled():
+                yield from iter_openmetrics(events)
+
+        return StreamingHttpResponse(
+            stream(),
+            content_type="application/openmetrics-text; version=1.0.0; charset=utf-8",
+        )
@@ -0,0 +1,64 @@
+"""
+Compares two result files written by the benchmark suite.
+
+Usage: python tests/benchmarks/compare.py before.json after.json [threshold]
+
+Prints the median wall time and the number of queries of every benchmark in both
+runs. Exits with status 1 if any benchmark needs more queries than before, or if
+its median time grew by more than ``threshold`` (default: 0.25, i.e. 25%).
+"""
+
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(before, after, threshold=0.25):
+    regressions = []
+    rows = []
+    for name in sorted(set(before["results"]) | set(after["results"])):
+        old = before["results"].get(name)
+        new = after["results"].get(name)
+        if not old or not new:
+            rows.append((name, old, new, ""))
+            continue
+        change = new["median"] / old["median"] - 1 if old["median"] else 0
+        flag = ""
+        if new["queries"] > old["queries"] or change > threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        rows.append((name, old, new, "%+.0f%% %s" % (change * 100, flag)))
+    return rows, regressions
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__.strip())
+        return 2
+    before, after = load(argv[1]), load(argv[2])
+    threshold = float(argv[3]) if len(argv) > 3 else 0.25
+    if (before["scale"], before["database"]) != (after["scale"], after["database"]):
+        print("Warning: the runs used different scales or databases.")
+
+    rows, regressions = compare(before, after, threshold)
+
+    def fmt(result):
+        if not result:
+            return "%20s" % "-"
+        return "%10.1fms %5d q" % (result["median"] * 1000, result["queries"])
+
+    print(
+        "%-40s %20s %20s"
+        % ("", (before["commit"] or "before")[:10], (after["commit"] or "after")[:10])
+    )
+    for name, old, new, change in rows:
+        print("%-40s %s %s %s" % (name, fmt(old), fmt(new), change))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,92 @@
+import json
+import os
+import platform
+import pytest
+import statistics
+import subprocess
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# By default, the benchmarks run on small events, which only makes sure they keep
+# working. Set ROOMSHARING_BENCHMARK_SCALE to multiply the number of rooms and
+# orders, and ROOMSHARING_BENCHMARK_OUTPUT to a file name to write the results as
+# JSON, e.g. to compare them between commits with compare.py.
+SCALE = int(os.environ.get("ROOMSHARING_BENCHMARK_SCALE", "1"))
+OUTPUT = os.environ.get("ROOMSHARING_BENCHMARK_OUTPUT")
+ROUNDS = int(os.environ.get("ROOMSHARING_BENCHMARK_ROUNDS", "5"))
+
+
+@pytest.fixture
+def large_event(build_event):
+    return build_event(
+        rooms=50 * SCALE,
+        orders_per_room=2,
+        unroomed=20 * SCALE,
+        subevents=2,
+        items=2,
+    )
+
+
+def _commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    results = {}
+    yield results
+    if OUTPUT and results:
+        with open(OUTPUT, "w") as f:
+            json.dump(
+                {
+                    "commit": _commit(),
+                    "scale": SCALE,
+                    "rounds": ROUNDS,
+                    "database": connection.vendor,
+                    "python": platform.python_version(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+@pytest.fixture
+def benchmark(request, benchmark_results):
+    """
+    Returns a function that calls ``fn(*setup())`` for a number of rounds and
+    records its wall time and number of queries under the name of the test,
+    suffixed with ``name``, if given. Only the call of ``fn`` is measured.
+    """
+
+    def run(fn, name=None, setup=tuple, rounds=ROUNDS):
+        timings = []
+        queries = []
+        for i in range(rounds):
+            args = setup()
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                result = fn(*args)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(ctx))
+        key = request.node.name + ("[%s]" % name if name else "")
+        benchmark_results[key] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "max": max(timings),
+            "queries": max(queries),
+        }
+        return result
+
+    return run
@@ -0,0 +1,124 @@
+import base64
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.urls import reverse
+from django.utils.timezone import now
+from pretix.base.models import CartPosition, Order
+
+from pretix_roomsharing.checkoutflow import RoomStep
+from pretix_roomsharing.signals import order_info
+
+
+def control_url(event, name, **kwargs):
+    return reverse(
+        "plugins:pretix_roomsharing:" + name,
+        kwargs={"organizer": event.organizer.slug, "event": event.slug, **kwargs},
+    )
+
+
+def room_step(event):
+    step = RoomStep(event)
+    # Measure the step only, not the rest of the checkout flow
+    step.get_next_url = lambda request: "/"
+    return step
+
+
+@pytest.fixture
+def cart(large_event):
+    room = large_event.rooms.select_related("subevent").first()
+    return CartPosition.objects.create(
+        event=large_event,
+        cart_id="benchmark",
+        item=large_event.items.first(),
+        subevent=room.subevent,
+        price=Decimal("23.00"),
+        expires=now() + timedelta(minutes=10),
+    )
+
+
+@pytest.mark.django_db
+def test_stats_view(control_client, large_event, benchmark):
+    url = control_url(large_event, "event.stats")
+    response = benchmark(lambda: control_client.get(url))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_metrics_view(settings, client, large_event, benchmark):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_USER = "metrics"
+    settings.METRICS_PASSPHRASE = "secret"
+    auth = "Basic " + base64.b64encode(b"metrics:secret").decode()
+    url = control_url(large_event, "metrics")
+    response = benchmark(lambda: client.get(url, HTTP_AUTHORIZATION=auth))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_room_step_post(large_event, cart, checkout_request, benchmark):
+    room = large_event.rooms.filter(subevent=cart.subevent).first()
+
+    def join():
+        return room_step(large_event).post(
+            checkout_request(
+                large_event,
+                {
+                    "room_mode": "join",
+                    "join-name": room.name,
+                    "join-password": "secret",
+                },
+            )
+        )
+
+    assert benchmark(join, name="join").status_code == 302
+
+    names = iter(range(1000))
+
+    def create():
+        return room_step(large_event).post(
+            checkout_request(
+                large_event,
+                {
+                    "room_mode": "create",
+                    "create-name": "New room %d" % next(names),
+                    "create-password": "secret",
+                },
+            )
+        )
+
+    assert benchmark(create, name="create").status_code == 302
+
+
+@pytest.mark.django_db
+def test_room_step_is_completed(large_event, cart, checkout_request, benchmark):
+    room = large_event.rooms.filter(subevent=cart.subevent).first()
+    request = checkout_request(
+        large_event, session={"room_mode": "join", "room_join": room.pk}
+    )
+    assert benchmark(lambda: room_step(large_event).is_completed(request))
+
+
+@pytest.mark.django_db
+def test_order_info(large_event, benchmark):
+    order = Order.objects.filter(event=large_event, orderroom__is_admin=True).first()
+    html = benchmark(lambda: order_info(large_event, order=order))
+    assert order.code in html
+
+
+@pytest.mark.django_db
+def test_room_list(control_client, large_event, benchmark):
+    url = control_url(large_event, "event.room.list")
+    response = benchmark(lambda: control_client.get(url))
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db
+def test_room_delete(control_client, large_event, benchmark):
+    rooms = iter(large_event.rooms.values_list("pk", flat=True))
+
+    def delete(pk):
+        return control_client.post(control_url(large_event, "event.room.delete", pk=pk))
+
+    response = benchmark(delete, setup=lambda: (next(rooms),))
+    assert response.status_code == 302
@@ -1 +1,245 @@
-# put your pytest fixtures here
+import functools
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import caches
+from django.test import RequestFactory
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, Order, OrderPosition, Organizer, User
+
+from pretix_roomsharing.models import OrderRoom, Room, normalize_room_name
+from pretix_roomsharing.occupancy import refresh_occupancy
+
+
+@pytest.fixture(autouse=True)
+def no_scopes():
+    with scopes_disabled():
+        yield
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    # Needs to be requested before any event fixture, as events bind their cache
+    # backend on first use.
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    yield
+    caches["default"].clear()
+
+
+@pytest.fixture
+def organizer():
+    return Organizer.objects.create(name="Dummy", slug="dummy")
+
+
+@pytest.fixture
+def event(organizer):
+    return Event.objects.create(
+        organizer=organizer,
+        name="Dummy",
+        slug="dummy",
+        date_from=now(),
+        plugins="pretix_roomsharing",
+    )
+
+
+@pytest.fixture
+def item(event):
+    return event.items.create(
+        name="Hotel ticket", default_price=Decimal("23.00"), admission=True
+    )
+
+
+@pytest.fixture
+def make_order(event, item):
+    counter = iter(range(1, 100000))
+
+    def make(
+        status=Order.STATUS_PAID,
+        room=None,
+        is_admin=False,
+        positions=1,
+        subevent=None,
+        **kw,
+    ):
+        o = Order.objects.create(
+            event=event,
+            code="ORDER%d" % next(counter),
+            status=status,
+            email="dummy@example.org",
+            datetime=now(),
+            expires=now() + timedelta(days=10),
+            total=Decimal("23.00") * positions,
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+            **kw,
+        )
+        for i in range(positions):
+            o.positions.create(
+                item=item, subevent=subevent, price=Decimal("23.00"), positionid=i + 1
+            )
+        if room:
+            OrderRoom.objects.create(order=o, room=room, is_admin=is_admin)
+        return o
+
+    return make
+
+
+@pytest.fixture
+def room(event):
+    return Room.objects.create(event=event, name="Room 1", password="secret")
+
+
+@pytest.fixture
+def control_client(client, organizer, event):
+    user = User.objects.create_user("dummy@dummy.dummy", "dummy")
+    team = organizer.teams.create(all_events=True, all_event_permissions=True)
+    team.members.add(user)
+    client.login(email="dummy@dummy.dummy", password="dummy")
+    return client
+
+
+@pytest.fixture
+def checkout_request():
+    """
+    Returns a function that creates a POST request for a checkout step of the
+    given event, with the given cart (``benchmark`` by default) and cart session
+    data.
+    """
+
+    def make(event, data=None, session=None, cart_id="benchmark"):
+        request = RequestFactory().post("/", data or {})
+        SessionMiddleware(lambda r: None).process_request(request)
+        MessageMiddleware(lambda r: None).process_request(request)
+        request.event = event
+        request.organizer = event.organizer
+        request.resolver_match = None
+        request.session["current_cart_event_%d" % event.pk] = cart_id
+        request.session["carts"] = {cart_id: dict(session or {})}
+        return request
+
+    return make
+
+
+def _build_event(
+    organizer,
+    slug="bench",
+    rooms=50,
+    orders_per_room=2,
+    unroomed=20,
+    subevents=2,
+    items=2,
+    positions=1,
+    capacity=4,
+):
+    """
+    Creates an event with ``rooms`` rooms of ``orders_per_room`` paid orders each
+    and ``unroomed`` paid orders without a room. Every order has ``positions``
+    admission positions of one of ``items`` room products, which have
+    ``capacity`` beds per room. Rooms and orders are spread evenly over
+    ``subevents`` dates, if given.
+    """
+    event = Event.objects.create(
+        organizer=organizer,
+        name="Benchmark",
+        slug=slug,
+        date_from=now(),
+        plugins="pretix_roomsharing",
+        has_subevents=bool(subevents),
+    )
+    products = [
+        event.items.create(
+            name="Room product %d" % i, default_price=Decimal("23.00"), admission=True
+        )
+        for i in range(items)
+    ]
+    event.settings.roomsharing__products = [str(p.pk) for p in products]
+    for p in products:
+        event.settings.set("roomsharing__capacity_%d" % p.pk, capacity)
+    dates = [
+        event.subevents.create(name="Day %d" % i, date_from=now())
+        for i in range(subevents)
+    ] or [None]
+
+    room_objs = []
+    for i in range(rooms):
+        name = "Room %05d" % i
+        room_objs.append(
+            Room(
+                event=event,
+                name=name,
+                name_key=normalize_room_name(name),
+                password="secret",
+                subevent=dates[i % len(dates)],
+            )
+        )
+    Room.objects.bulk_create(room_objs, batch_size=1000)
+
+    sales_channel = organizer.sales_channels.get(identifier="web")
+    orders = [
+        Order(
+            organizer=organizer,
+            event=event,
+            code="B%dX%07d" % (event.pk, i),
+            secret="bench%dx%d" % (event.pk, i),
+            status=Order.STATUS_PAID,
+            email="bench@example.org",
+            datetime=now(),
+            expires=now() + timedelta(days=10),
+            total=Decimal("23.00") * positions,
+            sales_channel=sales_channel,
+        )
+        for i in range(rooms * orders_per_room + unroomed)
+    ]
+    Order.objects.bulk_create(orders, batch_size=1000)
+
+    position_objs = []
+    for i, order in enumerate(orders):
+        date = (
+            room_objs[i // orders_per_room].subevent
+            if i < rooms * orders_per_room
+            else dates[i % len(dates)]
+        )
+        for j in range(positions):
+            position_objs.append(
+                OrderPosition(
+                    organizer=organizer,
+                    order=order,
+                    item=products[i % len(products)],
+                    subevent=date,
+                    price=Decimal("23.00"),
+                    tax_rate=Decimal("0.00"),
+                    tax_value=Decimal("0.00"),
+                    attendee_name_parts={},
+                    positionid=j + 1,
+                    secret="bench%d-%d-%d" % (event.pk, i, j),
+                    pseudonymization_id="%d-%d-%d" % (event.pk, i, j),
+                )
+            )
+    OrderPosition.all.bulk_create(position_objs, batch_size=1000)
+
+    OrderRoom.objects.bulk_create(
+        [
+            OrderRoom(
+                order=order,
+                room=room_objs[i // orders_per_room],
+                is_admin=i % orders_per_room == 0,
+            )
+            for i, order in enumerate(orders[: rooms * orders_per_room])
+        ],
+        batch_size=1000,
+    )
+    refresh_occupancy([r.pk for r in room_objs])
+    return event
+
+
+@pytest.fixture
+def build_event(organizer):
+    """
+    Returns a function to create events with many rooms and orders, see
+    ``_build_event``. Every event needs its own ``slug``.
+    """
+    return functools.partial(_build_event, organizer)
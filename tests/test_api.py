@@ -0,0 +1,147 @@
+import pytest
+from datetime import timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+
+from pretix_roomsharing.availability import find_room
+from pretix_roomsharing.models import OrderRoom, Room
+from pretix_roomsharing.occupancy import refresh_occupancy
+from pretix_roomsharing.pagination import encode_cursor
+
+URL = "/api/v1/organizers/dummy/events/dummy/rooms/"
+
+
+@pytest.fixture
+def token_client(organizer, event):
+    team = organizer.teams.create(all_events=True, all_event_permissions=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION="Token " + team.tokens.create(name="t").token)
+    return client
+
+
+@pytest.mark.django_db
+def test_list_rooms_with_members(token_client, event, room, make_order):
+    make_order(room=room, is_admin=True, positions=2)
+    make_order(room=room)
+    refresh_occupancy([room.pk])
+    Room.objects.create(event=event, name="Room 2")
+
+    resp = token_client.get(URL)
+    assert resp.status_code == 200
+    assert resp.data["next"] is None
+    first = resp.data["results"][0]
+    assert first["name"] == "Room 1"
+    assert first["members"] == 3
+    assert first["orders"] == [
+        {"order": "ORDER1", "is_admin": True},
+        {"order": "ORDER2", "is_admin": False},
+    ]
+    assert resp.data["results"][1]["members"] == 0
+
+    resp = token_client.get(URL + "?fields=id,name")
+    assert resp.data["results"] == [
+        {"id": room.pk, "name": "Room 1"},
+        {"id": room.pk + 1, "name": "Room 2"},
+    ]
+    assert token_client.get(URL + "?fields=password").status_code == 400
+
+
+@pytest.mark.django_db
+def test_cursor_pagination_constant_queries(token_client, event, make_order):
+    for i in range(30):
+        make_order(room=Room.objects.create(event=event, name="Room %02d" % i))
+
+    with CaptureQueriesContext(connection) as small:
+        token_client.get(URL + "?page_size=2")
+    names = []
+    url = URL + "?page_size=10"
+    while url:
+        with CaptureQueriesContext(connection) as large:
+            resp = token_client.get(url)
+        names += [r["name"] for r in resp.data["results"]]
+        url = resp.data["next"]
+    assert names == ["Room %02d" % i for i in range(30)]
+    assert len(large) <= len(small)
+
+    assert token_client.get(URL + "?cursor=garbage").status_code == 404
+    cursor = encode_cursor("Room 01", 1)
+    assert token_client.get(URL + "?cursor=" + cursor).status_code == 404
+
+
+@pytest.mark.django_db
+def test_modified_since_includes_membership_changes(
+    token_client, event, room, make_order
+):
+    other = Room.objects.create(event=event, name="Room 2")
+    Room.objects.update(modified=now() - timedelta(hours=1))
+    since = (now() - timedelta(minutes=1)).isoformat()
+
+    resp = token_client.get(URL, {"modified_since": since})
+    assert resp.data["results"] == []
+
+    resp = token_client.post(
+        URL + "bulk_assign/",
+        [{"order": make_order().code, "room": other.pk}],
+        format="json",
+    )
+    assert resp.status_code == 200
+    resp = token_client.get(URL, {"modified_since": since})
+    assert [r["id"] for r in resp.data["results"]] == [other.pk]
+
+
+@pytest.mark.django_db
+def test_bulk_create(
+    locmem_cache, token_client, event, room, django_capture_on_commit_callbacks
+):
+    # Checked in the checkout before it existed
+    assert find_room(event, "Room 2") is None
+    with django_capture_on_commit_callbacks(execute=True):
+        resp = token_client.post(
+            URL + "bulk_create/",
+            [{"name": "Room 2", "capacity": 2}, {"name": "Room  3"}],
+            format="json",
+        )
+    assert resp.status_code == 201
+    assert [r["name"] for r in resp.data] == ["Room 2", "Room 3"]
+    assert event.rooms.get(name="Room 2").capacity == 2
+    assert find_room(event, "Room 2").name == "Room 2"
+
+    resp = token_client.post(
+        URL + "bulk_create/",
+        [{"name": "Room 4"}, {"name": "room 1"}, {"name": "ROOM 4"}],
+        format="json",
+    )
+    assert resp.status_code == 400
+    assert resp.data[0] == {}
+    assert "name" in resp.data[1] and "name" in resp.data[2]
+    assert event.rooms.count() == 3
+
+
+@pytest.mark.django_db
+def test_bulk_assign(token_client, event, room, make_order):
+    a = make_order()
+    b = make_order()
+    resp = token_client.post(
+        URL + "bulk_assign/",
+        [
+            {"order": a.code, "room": room.pk, "is_admin": True},
+            {"order": b.code, "room_name": "New room"},
+        ],
+        format="json",
+    )
+    assert resp.status_code == 200
+    assert resp.data == {"rooms": 1, "orders": 2}
+    assert OrderRoom.objects.get(order=a).is_admin
+    assert OrderRoom.objects.get(order=b).room.name == "New room"
+
+    resp = token_client.post(
+        URL + "bulk_assign/",
+        [{"order": a.code, "room_name": "Other"}, {"order": b.code, "room": 0}],
+        format="json",
+    )
+    assert resp.status_code == 400
+    assert resp.data[0] == {}
+    assert resp.data[1]["non_field_errors"] == ["Unknown room: 0"]
+    assert OrderRoom.objects.get(order=a).room == room
@@ -0,0 +1,87 @@
+import pytest
+from pretix.base.models import LogEntry, Order
+
+from pretix_roomsharing.models import OrderRoom, Room, RoomOccupancy
+from pretix_roomsharing.tasks import assign_rooms, pack
+
+
+def test_pack_best_fit():
+    placements, new_rooms = pack([(1, 10), (2, 11), (1, 12)], [(1, 100)], 2)
+    assert new_rooms == 2
+    assert placements == [(11, -1), (12, 100), (10, -2)]
+
+
+def test_pack_oversized_order():
+    placements, new_rooms = pack([(3, 10), (1, 11)], [], 2)
+    assert placements == [(10, -1), (11, -2)]
+    assert new_rooms == 2
+
+
+@pytest.mark.django_db
+def test_assign_rooms(event, item, room, make_order):
+    event.settings.roomsharing__products = [str(item.pk)]
+    make_order(room=room, is_admin=True)
+    single = make_order()
+    pair = make_order(positions=2)
+    make_order(status=Order.STATUS_CANCELED)
+    other = event.items.create(name="Day ticket", default_price=0, admission=True)
+    make_order().positions.update(item=other)
+
+    report = assign_rooms.apply(
+        args=(event.pk,), kwargs={"room_size": 2, "dry_run": True}
+    ).get()
+    assert report == {
+        "dry_run": True,
+        "orders": 2,
+        "attendees": 3,
+        "existing_rooms": 1,
+        "new_rooms": 1,
+    }
+    assert OrderRoom.objects.count() == 1
+
+    report = assign_rooms.apply(args=(event.pk,), kwargs={"room_size": 2}).get()
+    assert report["new_rooms"] == 1
+    assert OrderRoom.objects.get(order=single).room == room
+    new_room = OrderRoom.objects.get(order=pair).room
+    assert new_room.name_key == "room 2"
+    assert RoomOccupancy.objects.get(room=new_room).size == 2
+    assert (
+        LogEntry.objects.filter(action_type="pretix_roomsharing.order.assigned").count()
+        == 2
+    )
+
+    report = assign_rooms.apply(args=(event.pk,), kwargs={"room_size": 2}).get()
+    assert report["orders"] == 0
+
+
+@pytest.mark.django_db
+def test_assign_rooms_fills_empty_rooms(event, item, make_order):
+    event.settings.roomsharing__products = [str(item.pk)]
+    event.has_subevents = True
+    event.save()
+    day1 = event.subevents.create(name="Day 1", date_from=event.date_from)
+    day2 = event.subevents.create(name="Day 2", date_from=event.date_from)
+    prepared = Room.objects.create(event=event, name="Prepared", subevent=day1)
+    Room.objects.create(event=event, name="Other day", subevent=day2, capacity=1)
+    orders = [make_order(subevent=day1) for i in range(3)]
+
+    report = assign_rooms.apply(args=(event.pk,), kwargs={"room_size": 2}).get()
+    assert (report["existing_rooms"], report["new_rooms"]) == (1, 1)
+    rooms = [OrderRoom.objects.get(order=o).room for o in orders]
+    assert rooms.count(prepared) == 2
+    assert all(r.subevent == day1 for r in rooms)
+
+
+@pytest.mark.django_db
+def test_assign_view(control_client, event, item, make_order):
+    event.settings.roomsharing__products = [str(item.pk)]
+    make_order()
+    url = "/control/event/dummy/dummy/rooms/assign/"
+    assert control_client.get(url).status_code == 200
+
+    r = control_client.post(url, {"room_size": 2, "dry_run": "on"}, follow=True)
+    assert "would be assigned" in r.content.decode()
+    assert not OrderRoom.objects.exists()
+
+    control_client.post(url, {"room_size": 2})
+    assert OrderRoom.objects.count() == 1
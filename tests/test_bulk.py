@@ -0,0 +1,102 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pretix.base.models import LogEntry, OrderPosition
+
+from pretix_roomsharing.bulk import delete_rooms, move_members, reset_passwords
+from pretix_roomsharing.models import OrderRoom, Room, RoomOccupancy
+from pretix_roomsharing.occupancy import RoomFull, WrongDate, refresh_occupancy
+
+
+def make_rooms(event, make_order, count):
+    rooms = []
+    for i in range(count):
+        r = Room.objects.create(event=event, name="Bulk %d" % i, password="secret")
+        make_order(room=r, is_admin=True)
+        make_order(room=r)
+        rooms.append(r)
+    return rooms
+
+
+@pytest.mark.django_db
+def test_delete_rooms_constant_queries(event, make_order):
+    rooms = make_rooms(event, make_order, 12)
+    with CaptureQueriesContext(connection) as few:
+        delete_rooms(event, [r.pk for r in rooms[:2]])
+    with CaptureQueriesContext(connection) as many:
+        delete_rooms(event, [r.pk for r in rooms[2:]])
+    assert len(many) <= len(few)
+    assert not Room.objects.exists()
+    assert not OrderRoom.objects.exists()
+    assert (
+        LogEntry.objects.filter(action_type="pretix_roomsharing.order.deleted").count()
+        == 24
+    )
+
+
+@pytest.mark.django_db
+def test_move_and_merge(event, room, make_order):
+    make_order(room=room, is_admin=True)
+    a, b = make_rooms(event, make_order, 2)
+
+    assert move_members(event, [a.pk], room) == 2
+    assert room.orderrooms.count() == 3
+    assert room.orderrooms.filter(is_admin=True).count() == 1
+    assert RoomOccupancy.objects.get(room=room).size == 3
+    assert not RoomOccupancy.objects.filter(room=a).exists()
+
+    move_members(event, [b.pk], room, delete_sources=True)
+    assert set(Room.objects.all()) == {room, a}
+    assert RoomOccupancy.objects.get(room=room).size == 5
+
+
+@pytest.mark.django_db
+def test_move_refused(event, item, room, make_order):
+    make_order(room=room, is_admin=True)
+    a, b = make_rooms(event, make_order, 2)
+    refresh_occupancy([room.pk, a.pk, b.pk])
+
+    room.capacity = 2
+    room.save()
+    with pytest.raises(RoomFull):
+        move_members(event, [a.pk], room)
+    assert a.orderrooms.count() == 2
+
+    event.has_subevents = True
+    event.save()
+    day1 = event.subevents.create(name="Day 1", date_from=event.date_from)
+    day2 = event.subevents.create(name="Day 2", date_from=event.date_from)
+    OrderPosition.objects.exclude(order__orderroom__room=b).update(subevent=day1)
+    OrderPosition.objects.filter(order__orderroom__room=b).update(subevent=day2)
+    refresh_occupancy([room.pk, a.pk, b.pk])
+    room.capacity = None
+    room.save()
+    with pytest.raises(WrongDate):
+        move_members(event, [b.pk], room)
+    assert move_members(event, [a.pk], room) == 2
+
+
+@pytest.mark.django_db
+def test_reset_passwords(event, room):
+    reset_passwords(event, [room.pk])
+    room.refresh_from_db()
+    assert room.password != "secret"
+
+
+@pytest.mark.django_db
+def test_bulk_view(control_client, event, room, make_order):
+    a, b = make_rooms(event, make_order, 2)
+    url = "/control/event/dummy/dummy/rooms/bulk/"
+
+    response = control_client.post(url, {"rooms": [a.pk, b.pk], "action": "merge"})
+    assert response.status_code == 200
+    assert "Bulk 1" in response.content.decode()
+    assert Room.objects.count() == 3
+
+    data = {"rooms": [a.pk, b.pk], "action": "merge", "confirm": "1"}
+    response = control_client.post(url, dict(data, target="Bulk 0"))
+    assert "may not be one of the selected rooms" in response.content.decode()
+
+    control_client.post(url, dict(data, target="room 1"))
+    assert list(Room.objects.all()) == [room]
+    assert room.orderrooms.count() == 4
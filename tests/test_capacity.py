@@ -0,0 +1,118 @@
+import json
+import pytest
+from django.core import mail as djmail
+from django.db import IntegrityError
+from pretix.base.models import LogEntry
+from pretix.base.signals import order_placed
+
+from pretix_roomsharing import signals
+from pretix_roomsharing.models import OrderRoom, Room, RoomOccupancy
+from pretix_roomsharing.occupancy import (
+    PLACEMENT_LOCK_TIMEOUT,
+    RoomBusy,
+    RoomFull,
+    create_room,
+    has_space,
+    join_room,
+)
+from pretix_roomsharing.signals import order_info
+
+
+@pytest.mark.django_db
+def test_join_room_capacity(event, item, room, make_order):
+    room.capacity = 3
+    room.save()
+    join_room(room, make_order(positions=2), is_admin=True)
+    join_room(room, make_order())
+    assert RoomOccupancy.objects.get(room=room).size == 3
+    assert not has_space(room, 1, {item.pk})
+
+    with pytest.raises(RoomFull):
+        join_room(room, make_order())
+    assert room.orderrooms.count() == 2
+
+
+@pytest.mark.django_db
+def test_join_room_product_capacity(event, item, room, make_order):
+    event.settings.roomsharing__products = [str(item.pk)]
+    event.settings.set("roomsharing__capacity_%d" % item.pk, 2)
+
+    # An empty room always takes the first order
+    join_room(room, make_order(positions=3), is_admin=True)
+    assert not has_space(room, 1, {item.pk})
+    with pytest.raises(RoomFull):
+        join_room(room, make_order())
+
+    room.capacity = 4
+    room.save()
+    join_room(room, make_order())
+
+
+@pytest.mark.django_db
+def test_placed_order_full_room(
+    event, item, room, make_order, django_capture_on_commit_callbacks
+):
+    room.capacity = 1
+    room.save()
+    join_room(room, make_order(), is_admin=True)
+
+    order = make_order()
+    order.meta_info = json.dumps({"room_mode": "join", "room_join": room.pk})
+    order.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        order_placed.send(event, order=order)
+
+    assert not OrderRoom.objects.filter(order=order).exists()
+    assert LogEntry.objects.filter(
+        action_type="pretix_roomsharing.order.full", object_id=order.pk
+    ).exists()
+
+    # The customer is told, and the order page shows it until the room changes
+    assert len(djmail.outbox) == 1
+    assert "Room 1" in djmail.outbox[0].body
+    event.settings.roomsharing__products = [str(item.pk)]
+    assert "could not add your order to the room" in order_info(event, order=order)
+    order.log_action("pretix_roomsharing.order.left", data={"room": room.pk})
+    order.touch()
+    assert "could not add your order" not in order_info(event, order=order)
+
+
+@pytest.mark.django_db
+def test_placed_order_busy_room(
+    event, room, make_order, monkeypatch, django_capture_on_commit_callbacks
+):
+    timeouts = []
+
+    def busy(room, order, is_admin=False, lock_timeout=None):
+        timeouts.append(lock_timeout)
+        raise RoomBusy()
+
+    monkeypatch.setattr(signals, "join_room", busy)
+    order = make_order()
+    order.meta_info = json.dumps({"room_mode": "join", "room_join": room.pk})
+    order.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        order_placed.send(event, order=order)
+
+    # Placed orders wait longer for the lock, and a busy room is not full
+    assert timeouts == [PLACEMENT_LOCK_TIMEOUT]
+    assert LogEntry.objects.filter(
+        action_type="pretix_roomsharing.order.busy", object_id=order.pk
+    ).exists()
+    assert len(djmail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_create_room_atomic(event, room, make_order):
+    order = make_order(room=room, is_admin=True)
+    new = Room(event=event, name="Room 2", password="secret")
+    with pytest.raises(IntegrityError):
+        create_room(new, order)
+    assert new.pk is None
+    assert not event.rooms.filter(name="Room 2").exists()
+
+    order = make_order()
+    create_room(new, order)
+    assert order.orderroom.room == new
+    assert order.orderroom.is_admin
+    assert RoomOccupancy.objects.get(room=new).size == 1
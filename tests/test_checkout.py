@@ -0,0 +1,308 @@
+import json
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from pretix.base.models import CartPosition, Order
+from pretix.base.signals import order_canceled, order_placed
+
+from pretix_roomsharing import availability
+from pretix_roomsharing.availability import find_room
+from pretix_roomsharing.checkoutflow import RoomCreateForm, RoomJoinForm, RoomStep
+from pretix_roomsharing.models import Room
+from pretix_roomsharing.occupancy import join_room, refresh_occupancy
+from pretix_roomsharing.reservations import room_name_reserved
+from pretix_roomsharing.signals import order_info, order_meta_signal
+
+
+@pytest.mark.django_db
+def test_room_name_key(event):
+    room = Room.objects.create(event=event, name="  The   Big Room ")
+    assert room.name_key == "the big room"
+    assert list(event.rooms.by_name("THE BIG room")) == [room]
+
+
+@pytest.mark.django_db
+def test_join_form_ignores_case(event, room):
+    form = RoomJoinForm(event=event, data={"name": " room  1", "password": "secret"})
+    assert form.is_valid()
+    assert form.cleaned_data["room"] == room
+
+    form = RoomJoinForm(event=event, data={"name": "room 1", "password": "wrong"})
+    assert not form.is_valid()
+    assert "password" in form.errors
+
+
+@pytest.mark.django_db
+def test_create_form_rejects_normalized_duplicate(event, room):
+    form = RoomCreateForm(event=event, data={"name": "ROOM 1", "password": "abc"})
+    assert not form.is_valid()
+    assert "name" in form.errors
+
+
+@pytest.mark.django_db
+def test_order_info_panel_cached(
+    locmem_cache,
+    event,
+    room,
+    make_order,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        order = make_order(room=room, is_admin=True)
+        fellow = make_order(room=room)
+        refresh_occupancy([room.pk])
+
+    html = order_info(event, order=order)
+    assert fellow.code in html
+    with django_assert_num_queries(0):
+        assert order_info(event, order=order) == html
+
+    with django_capture_on_commit_callbacks(execute=True):
+        fellow.status = Order.STATUS_CANCELED
+        fellow.save()
+        order_canceled.send(event, order=fellow)
+    assert fellow.code not in order_info(event, order=order)
+
+
+@pytest.mark.django_db
+def test_placed_order_pins_subevent(
+    event, room, make_order, django_capture_on_commit_callbacks
+):
+    event.has_subevents = True
+    event.save()
+    se = event.subevents.create(name="Day 1", date_from=event.date_from)
+
+    order = make_order(subevent=se)
+    order.meta_info = json.dumps({"room_mode": "join", "room_join": room.pk})
+    order.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        order_placed.send(event, order=order)
+
+    room.refresh_from_db()
+    assert room.subevent == se
+    assert list(event.rooms.filter(subevent=se)) == [room]
+
+
+@pytest.mark.django_db
+def test_room_step_state_per_request(event, item, room, checkout_request):
+    event.has_subevents = True
+    event.save()
+    se = event.subevents.create(name="Day 1", date_from=event.date_from)
+    other = event.subevents.create(name="Day 2", date_from=event.date_from)
+    room.subevent = se
+    room.save()
+    position = CartPosition.objects.create(
+        event=event,
+        cart_id="benchmark",
+        item=item,
+        subevent=se,
+        price=Decimal("23.00"),
+        expires=now() + timedelta(minutes=10),
+    )
+    session = {"room_mode": "join", "room_join": room.pk}
+
+    request = checkout_request(event, session=session)
+    assert RoomStep(event).is_completed(request)
+    with CaptureQueriesContext(connection) as ctx:
+        assert RoomStep(event).is_completed(request)
+        assert RoomStep(event).is_completed(request, warn=True)
+    assert not ctx.captured_queries
+
+    # A following request of the same cart does not need to look up the room
+    session = request.session["carts"]["benchmark"]
+    request = checkout_request(event, session=session)
+    with CaptureQueriesContext(connection) as ctx:
+        assert RoomStep(event).is_completed(request)
+    assert not any(Room._meta.db_table in q["sql"] for q in ctx.captured_queries)
+
+    position.subevent = other
+    position.save()
+    request = checkout_request(event, session=session)
+    assert not RoomStep(event).is_completed(request, warn=True)
+
+
+@pytest.mark.django_db
+def test_room_step_multiple_dates(
+    event, item, room, make_order, checkout_request, django_capture_on_commit_callbacks
+):
+    event.has_subevents = True
+    event.save()
+    dates = [
+        event.subevents.create(name="Day %d" % i, date_from=event.date_from)
+        for i in range(3)
+    ]
+    creator = make_order(subevent=dates[0])
+    creator.positions.create(
+        item=item, subevent=dates[1], price=Decimal("23.00"), positionid=2
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        join_room(room, creator, is_admin=True)
+
+    def cart(*subevents):
+        CartPosition.objects.filter(event=event).delete()
+        for se in subevents:
+            CartPosition.objects.create(
+                event=event,
+                cart_id="benchmark",
+                item=item,
+                subevent=se,
+                price=Decimal("23.00"),
+                expires=now() + timedelta(minutes=10),
+            )
+        request = checkout_request(
+            event, session={"room_mode": "join", "room_join": room.pk}
+        )
+        return RoomStep(event).is_completed(request, warn=True)
+
+    assert cart(dates[0], dates[1])
+    assert cart(dates[1])
+    assert not cart(dates[0], dates[2])
+
+
+def create_room(checkout_request, event, name, cart_id):
+    request = checkout_request(
+        event,
+        {"room_mode": "create", "create-name": name, "create-password": "secret"},
+        cart_id=cart_id,
+    )
+    step = RoomStep(event)
+    step.get_next_url = lambda request: "/"
+    return request, step.post(request)
+
+
+@pytest.mark.django_db
+def test_room_created_on_placement(
+    locmem_cache,
+    event,
+    make_order,
+    checkout_request,
+    django_capture_on_commit_callbacks,
+):
+    with CaptureQueriesContext(connection) as ctx:
+        request, response = create_room(checkout_request, event, "Party room", "a")
+    assert response.status_code == 302
+    assert all(q["sql"].startswith("SELECT") for q in ctx.captured_queries)
+    assert not event.rooms.exists()
+
+    # The name is reserved for the cart until the order is placed
+    form = RoomCreateForm(
+        event=event, cart_id="b", data={"name": "party ROOM", "password": "abc"}
+    )
+    assert not form.is_valid()
+    request, response = create_room(checkout_request, event, "Party room", "a")
+    assert response.status_code == 302
+
+    order = make_order()
+    order.meta_info = json.dumps(order_meta_signal(event, request=request))
+    order.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        order_placed.send(event, order=order)
+
+    # The room is created while placing the order, which then drops the password
+    room = event.rooms.get()
+    assert (room.name, room.password) == ("Party room", "secret")
+    assert order.orderroom.room == room
+    assert order.orderroom.is_admin
+    assert not room_name_reserved(event, "Party room")
+    order.refresh_from_db()
+    assert "secret" not in order.meta_info
+
+
+@pytest.mark.django_db
+def test_room_name_taken_on_placement(
+    event, item, room, make_order, django_capture_on_commit_callbacks
+):
+    order = make_order()
+    order.meta_info = json.dumps(
+        {"room_mode": "create", "room_create": {"name": "room 1", "cart": "a"}}
+    )
+    order.save()
+    with django_capture_on_commit_callbacks(execute=True):
+        order_placed.send(event, order=order)
+
+    assert order.orderroom.room.name == "room 1 (%s)" % order.code
+    assert order.orderroom.is_admin
+    assert (
+        order.all_logentries()
+        .filter(action_type="pretix_roomsharing.order.renamed")
+        .exists()
+    )
+
+    # Without a password, a random one is set. Both are shown on the order page.
+    event.settings.roomsharing__products = [str(item.pk)]
+    html = order_info(event, order=order)
+    assert "has been named differently" in html
+    assert "created with a random password" in html
+    order.log_action("pretix_roomsharing.order.changed", data={"room": room.pk})
+    order.touch()
+    html = order_info(event, order=order)
+    assert "has been named differently" in html
+    assert "created with a random password" not in html
+
+
+@pytest.mark.django_db
+def test_room_check(
+    locmem_cache,
+    client,
+    event,
+    room,
+    monkeypatch,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    event.live = True
+    event.save()
+    url = "/dummy/dummy/room/check"
+    assert client.post(url, {"mode": "create", "name": "x"}).status_code == 403
+
+    session = client.session
+    session["current_cart_event_%d" % event.pk] = "cart"
+    session["carts"] = {"cart": {}}
+    session.save()
+
+    def check(**data):
+        return client.post(url, data).json()
+
+    assert check(mode="join", name="ROOM 1", password="secret") == {
+        "ok": True,
+        "field": None,
+        "message": "",
+    }
+    assert check(mode="join", name="room 1", password="wrong")["field"] == "password"
+    assert check(mode="join", name="Room 2")["field"] == "name"
+    assert check(mode="create", name="room  1")["field"] == "name"
+    assert check(mode="create", name="Room 2")["ok"]
+    assert client.post(url, {"mode": "other", "name": "x"}).status_code == 400
+
+    # Missing rooms are remembered until a room with the name is saved
+    assert find_room(event, "Room 3") is None
+    with django_assert_num_queries(0):
+        assert find_room(event, "room 3") is None
+    with django_capture_on_commit_callbacks(execute=True):
+        room3 = Room.objects.create(event=event, name="Room 3")
+    assert find_room(event, "Room 3") == room3
+
+    cache.clear()
+    monkeypatch.setattr(availability, "RATE_LIMIT", 1)
+    assert client.post(url, {"mode": "create", "name": "x"}).status_code == 200
+    assert client.post(url, {"mode": "create", "name": "x"}).status_code == 429
+
+    # Passwords of a room are limited across all clients
+    cache.clear()
+    monkeypatch.setattr(availability, "RATE_LIMIT", 10)
+    monkeypatch.setattr(availability, "ROOM_RATE_LIMIT", 1)
+    data = {"mode": "join", "name": "Room 1", "password": "a"}
+    assert client.post(url, data).status_code == 200
+    assert client.post(url, {**data, "name": "ROOM 1"}).status_code == 429
+    assert client.post(url, {**data, "name": "Room 3"}).status_code == 200
+
+
+@pytest.mark.django_db
+def test_room_name_key_unique(event, room):
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Room.objects.create(event=event, name=" ROOM 1", password="x")
@@ -0,0 +1,32 @@
+import pytest
+from datetime import timedelta
+from django.utils.timezone import now
+from pretix.base.models import LogEntry
+
+from pretix_roomsharing.cleanup import delete_empty_rooms
+from pretix_roomsharing.models import Room
+
+
+@pytest.mark.django_db
+def test_delete_empty_rooms(event, room, make_order):
+    event.settings.roomsharing__delete_empty_rooms = True
+    make_order(room=room, is_admin=True)
+    for i in range(5):
+        Room.objects.create(event=event, name="Abandoned %d" % i)
+    Room.objects.update(created=now() - timedelta(days=2))
+    fresh = Room.objects.create(event=event, name="Checkout in progress")
+
+    assert delete_empty_rooms(chunk_size=2) == {event.pk: 5}
+    assert set(Room.objects.all()) == {room, fresh}
+    assert LogEntry.objects.get(
+        action_type="pretix_roomsharing.rooms.cleaned"
+    ).parsed_data == {"count": 5}
+
+    assert delete_empty_rooms() == {}
+
+
+@pytest.mark.django_db
+def test_delete_empty_rooms_disabled(event, room):
+    Room.objects.update(created=now() - timedelta(days=2))
+    assert delete_empty_rooms() == {}
+    assert list(Room.objects.all()) == [room]
@@ -0,0 +1,136 @@
+import pytest
+from pretix.base.models import Order
+
+from pretix_roomsharing.models import Room
+from pretix_roomsharing.occupancy import refresh_occupancy
+from pretix_roomsharing.pagination import KeysetPage, encode_cursor
+
+
+@pytest.mark.django_db
+def test_room_stats(event, room, make_order):
+    make_order(room=room, is_admin=True, positions=2)
+    make_order(room=room, status=Order.STATUS_PENDING)
+    refresh_occupancy([room.pk])
+
+    r = event.rooms.with_stats().get()
+    assert (r.members, r.paid, r.pending, r.admin_code) == (3, 2, 1, "ORDER1")
+
+
+@pytest.mark.django_db
+def test_keyset_pagination(event):
+    for i in range(7):
+        Room.objects.create(event=event, name="Room %d" % i)
+    qs = event.rooms.all()
+
+    page = KeysetPage(qs, "name", 3)
+    assert [r.name for r in page] == ["Room 0", "Room 1", "Room 2"]
+    assert not page.previous_cursor
+
+    page = KeysetPage(qs, "name", 3, after=page.next_cursor)
+    assert [r.name for r in page] == ["Room 3", "Room 4", "Room 5"]
+
+    last = KeysetPage(qs, "name", 3, after=page.next_cursor)
+    assert [r.name for r in last] == ["Room 6"]
+    assert not last.next_cursor
+
+    page = KeysetPage(qs, "name", 3, before=last.previous_cursor)
+    assert [r.name for r in page] == ["Room 3", "Room 4", "Room 5"]
+
+    page = KeysetPage(qs, "name", 3, descending=True)
+    assert [r.name for r in page] == ["Room 6", "Room 5", "Room 4"]
+
+
+@pytest.mark.django_db
+def test_room_list(control_client, event, item, room, make_order):
+    Room.objects.create(event=event, name="Empty room")
+    make_order(room=room, is_admin=True)
+    refresh_occupancy([room.pk])
+
+    url = "/control/event/dummy/dummy/rooms/"
+    response = control_client.get(url)
+    assert response.status_code == 200
+    assert "Empty room" in response.content.decode()
+    assert "ORDER1" in response.content.decode()
+
+    response = control_client.get(url + "?status=empty")
+    assert "Empty room" in response.content.decode()
+    assert "Room 1" not in response.content.decode()
+
+    response = control_client.get(url + "?status=full")
+    assert not list(response.context["page"])
+
+    # A cursor of the wrong type for the ordering is ignored
+    cursor = encode_cursor("Room 1", room.pk)
+    response = control_client.get(url + "?ordering=members&after=" + cursor)
+    assert response.status_code == 200
+    assert len(response.context["page"]) == 2
+    assert response.context["page"].invalid_cursor
+
+    # Full by the capacity of the room product
+    event.settings.roomsharing__products = [str(item.pk)]
+    event.settings.set("roomsharing__capacity_%d" % item.pk, 1)
+    response = control_client.get(url + "?status=full")
+    assert [r.name for r in response.context["page"]] == ["Room 1"]
+
+    event.settings.delete("roomsharing__capacity_%d" % item.pk)
+    room.capacity = 1
+    room.save()
+    response = control_client.get(url + "?status=full")
+    assert [r.name for r in response.context["page"]] == ["Room 1"]
+
+
+@pytest.mark.django_db
+def test_room_select2(control_client, event, room, make_order):
+    for i in range(25):
+        Room.objects.create(event=event, name="Suite %02d" % i, capacity=2)
+    Room.objects.create(event=event, name="Roof terrace")
+    make_order(room=room)
+    refresh_occupancy([room.pk])
+
+    url = "/control/event/dummy/dummy/rooms/select2/"
+    data = control_client.get(url, {"query": "  room "}).json()
+    assert data == {
+        "results": [
+            {
+                "id": room.pk,
+                "text": "Room 1 (1)",
+                "name": "Room 1",
+                "members": 1,
+                "capacity": None,
+            }
+        ],
+        "pagination": {"more": False},
+    }
+
+    data = control_client.get(url, {"query": "suite"}).json()
+    assert len(data["results"]) == 20
+    assert data["results"][0]["text"] == "Suite 00 (0/2)"
+    assert data["pagination"]["more"]
+    data = control_client.get(url, {"query": "suite", "page": "2"}).json()
+    assert [r["name"] for r in data["results"]] == [
+        "Suite %02d" % i for i in range(20, 25)
+    ]
+    assert not data["pagination"]["more"]
+
+    assert [
+        r["name"] for r in control_client.get(url, {"query": "ro"}).json()["results"]
+    ] == ["Roof terrace", "Room 1"]
+
+
+@pytest.mark.django_db
+def test_control_room_change_renders_selected_room_only(
+    control_client, event, room, make_order
+):
+    order = make_order(room=room)
+    other = Room.objects.create(event=event, name="Other room")
+
+    url = "/control/event/dummy/dummy/orders/%s/room" % order.code
+    content = control_client.get(url).content.decode()
+    assert "Room 1" in content
+    assert "Other room" not in content
+    assert "/rooms/select2/" in content
+
+    response = control_client.post(url, {"room": other.pk, "is_admin": "on"})
+    assert response.status_code == 302
+    order.orderroom.refresh_from_db()
+    assert order.orderroom.room == other
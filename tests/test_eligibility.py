@@ -0,0 +1,38 @@
+import pytest
+from pretix.base.models import Event
+
+from pretix_roomsharing.eligibility import needs_room, room_capacities, room_product_ids
+
+
+@pytest.mark.django_db
+def test_needs_room(event, item, make_order, django_assert_num_queries):
+    order = make_order()
+    assert not needs_room(event, order.positions.all())
+
+    event.settings.roomsharing__products = [str(item.pk)]
+    assert room_product_ids(event) == frozenset([item.pk])
+
+    with django_assert_num_queries(1):
+        assert needs_room(event, order.positions.all())
+
+    positions = list(order.positions.all())
+    with django_assert_num_queries(0):
+        assert needs_room(event, positions)
+
+
+@pytest.mark.django_db
+def test_room_products_follow_settings(locmem_cache, event, item):
+    assert room_product_ids(event) == frozenset()
+    event.settings.set("roomsharing__products", [str(item.pk)])
+    event.settings.set("roomsharing__capacity_%d" % item.pk, 2)
+    assert room_product_ids(event) == frozenset([item.pk])
+    assert room_capacities(event) == {item.pk: 2}
+
+    # A fresh copy of the event only sees the cache
+    event = Event.objects.get(pk=event.pk)
+    assert room_capacities(event) == {item.pk: 2}
+    event.settings.set("roomsharing__capacity_%d" % item.pk, 3)
+    assert room_capacities(Event.objects.get(pk=event.pk)) == {item.pk: 3}
+
+    item.delete()
+    assert room_product_ids(Event.objects.get(pk=event.pk)) == frozenset()
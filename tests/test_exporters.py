@@ -0,0 +1,51 @@
+import csv
+import io
+import pytest
+from pretix.base.models import Order
+
+from pretix_roomsharing.exporters import RoomingListExporter
+from pretix_roomsharing.models import Room
+
+
+@pytest.mark.django_db
+def test_rooming_list(event, room, make_order, django_assert_max_num_queries):
+    a = make_order(room=room, is_admin=True, positions=2)
+    b = make_order(room=room, status=Order.STATUS_PENDING)
+    Room.objects.create(event=event, name="Another room", capacity=2)
+    for i in range(5):
+        make_order(room=Room.objects.create(event=event, name="Room %d" % (i + 2)))
+
+    exporter = RoomingListExporter(event, event.organizer)
+    exporter.chunk_size = 2
+    with django_assert_max_num_queries(12):
+        filename, ctype, data = exporter.render({"_format": "default"})
+    rows = list(csv.reader(io.StringIO(data.decode())))
+    assert rows[0][:3] == ["Room name", "Capacity", "Order code"]
+    assert rows[1] == ["Another room", "2", "", "", "", "", "", ""]
+    assert [r[2] for r in rows if r[0] == "Room 1"] == [a.code, a.code]
+    assert len(rows) == 1 + 1 + 2 + 5
+
+    filename, ctype, data = exporter.render(
+        {"_format": "default", "include_pending": True}
+    )
+    rows = list(csv.reader(io.StringIO(data.decode())))
+    assert [r[2] for r in rows if r[0] == "Room 1"] == [a.code, a.code, b.code]
+
+    filename, ctype, data = exporter.render({"_format": "xlsx"})
+    assert filename == "dummy_rooms.xlsx"
+
+
+@pytest.mark.django_db
+def test_rooming_list_progress(event, room, make_order):
+    a = make_order(room=room, positions=2)
+    addon = event.items.create(name="Breakfast", default_price=5, admission=False)
+    a.positions.create(item=addon, price=5, positionid=3)
+    Room.objects.create(event=event, name="Another room")
+    make_order()
+
+    exporter = RoomingListExporter(event, event.organizer)
+    output = list(exporter.iterate_list({}))
+    totals = [r for r in output if isinstance(r, RoomingListExporter.ProgressSetTotal)]
+    rows = [r for r in output[1:] if isinstance(r, list)]
+    assert [r[0] for r in rows] == ["Another room", "Room 1", "Room 1"]
+    assert totals[0].total == len(rows)
@@ -0,0 +1,95 @@
+import pytest
+from datetime import timedelta
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from pretix.base.models import CachedFile, Order, User
+from pretix.base.services.modelimport import import_orders
+
+from pretix_roomsharing.models import OrderRoom, Room, RoomOccupancy
+
+
+@pytest.mark.django_db
+def test_import_rooms(control_client, event, room, make_order):
+    a = make_order(room=room, is_admin=True)
+    b = make_order()
+    c = make_order(positions=2)
+    url = "/control/event/dummy/dummy/rooms/import/"
+
+    content = "Order code;Room name;Admin\n%s;Unknown;\n%s;Room 1;maybe\n" % (
+        "XXX",
+        b.code,
+    )
+    response = control_client.post(
+        url, {"file": SimpleUploadedFile("rooms.csv", content.encode())}
+    )
+    assert "Line 2:" in response.content.decode()
+    assert "Line 3:" in response.content.decode()
+    assert OrderRoom.objects.count() == 1
+
+    content = "%s,room 1,\n%s, Sea  view ,yes\n%s,Sea view,no\n" % (
+        b.code,
+        c.code,
+        a.code,
+    )
+    control_client.post(
+        url, {"file": SimpleUploadedFile("rooms.csv", content.encode())}
+    )
+    sea_view = Room.objects.get(name="Sea view")
+    assert OrderRoom.objects.get(order=b).room == room
+    assert OrderRoom.objects.get(order=c).is_admin
+    assert list(
+        sea_view.orderrooms.order_by("order__code").values_list("order", flat=True)
+    ) == [a.pk, c.pk]
+    assert RoomOccupancy.objects.get(room=sea_view).size == 3
+    assert RoomOccupancy.objects.get(room=room).size == 1
+
+
+@pytest.mark.django_db
+def test_order_import_room_column(event, item, room):
+    cf = CachedFile.objects.create(
+        expires=now() + timedelta(days=1), date=now(), filename="orders.csv"
+    )
+    lines = ["E-mail,Room"] + [
+        "guest%d@example.org,%s" % (i, "Room 1" if i < 2 else "Suite %d" % (i % 3))
+        for i in range(9)
+    ]
+    cf.file.save("orders.csv", ContentFile("\n".join(lines).encode()))
+    user = User.objects.create_user("dummy@dummy.dummy", "dummy")
+
+    with CaptureQueriesContext(connection) as ctx:
+        import_orders.apply(
+            args=(
+                event.pk,
+                cf.id,
+                {
+                    "orders": "many",
+                    "testmode": False,
+                    "status": "paid",
+                    "email": "csv:E-mail",
+                    "item": "static:%d" % item.pk,
+                    "sales_channel": "static:web",
+                    "locale": "static:en",
+                    "roomsharing_room": "csv:Room",
+                },
+                "en",
+                user.pk,
+            )
+        ).get()
+    # Rooms are resolved per import, not per order
+    assert len([q for q in ctx.captured_queries if "roomsharing" in q["sql"]]) < 10
+
+    assert Order.objects.count() == 9
+    assert room.orderrooms.count() == 2
+    assert not room.orderrooms.filter(is_admin=True).exists()
+    suites = Room.objects.exclude(pk=room.pk)
+    assert sorted(suites.values_list("name", flat=True)) == [
+        "Suite 0",
+        "Suite 1",
+        "Suite 2",
+    ]
+    for suite in suites:
+        assert suite.orderrooms.filter(is_admin=True).count() == 1
+    assert RoomOccupancy.objects.get(room=room).size == 2
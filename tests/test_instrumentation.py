@@ -0,0 +1,71 @@
+import base64
+import configparser
+import pytest
+from pretix.presale.signals import order_info
+
+from pretix_roomsharing import instrumentation
+
+AUTH = "Basic " + base64.b64encode(b"metrics:secret").decode()
+
+
+@pytest.fixture
+def metrics_settings(settings):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_USER = "metrics"
+    settings.METRICS_PASSPHRASE = "secret"
+    instrumentation.reset()
+    yield settings
+    instrumentation.reset()
+
+
+@pytest.fixture
+def instrumentation_on(metrics_settings):
+    config = configparser.ConfigParser()
+    config.read_dict({"pretix_roomsharing": {"instrumentation": "on"}})
+    metrics_settings.CONFIG_FILE = config
+
+
+def metrics_url(event):
+    return "/metrics/rooms/%s/%s/" % (event.organizer.slug, event.slug)
+
+
+def test_histogram_buckets():
+    histogram = instrumentation.Histogram((1, 5))
+    for value in (0, 1, 3, 7):
+        histogram.observe(value)
+    m = histogram.metrics("q", 'view="V"')
+    assert m["q_bucket"] == {
+        '{view="V",le="1"}': 2,
+        '{view="V",le="5"}': 3,
+        '{view="V",le="+Inf"}': 4,
+    }
+    assert m["q_sum"] == {'{view="V"}': 11}
+    assert m["q_count"] == {'{view="V"}': 4}
+
+
+@pytest.mark.django_db
+def test_receivers_and_views_measured(
+    instrumentation_on, event, room, make_order, control_client, client
+):
+    order = make_order(room=room, is_admin=True)
+    order_info.send(event, order=order)
+    control_client.get(
+        "/control/event/%s/%s/rooms/" % (event.organizer.slug, event.slug)
+    )
+
+    m = instrumentation.metrics()
+    assert m["roomsharing_receiver_seconds_count"]['{receiver="order_info"}'] == 1
+    assert m["roomsharing_receiver_queries_sum"]['{receiver="order_info"}'] > 0
+    assert m["roomsharing_view_seconds_count"]['{view="RoomList"}'] == 1
+
+    content = client.get(metrics_url(event), HTTP_AUTHORIZATION=AUTH).content.decode()
+    assert 'roomsharing_receiver_seconds_count{receiver="order_info"} 1' in content
+    assert 'roomsharing_view_queries_bucket{view="RoomList",le="+Inf"} 1' in content
+
+
+@pytest.mark.django_db
+def test_disabled_by_default(metrics_settings, event, room, make_order, client):
+    order_info.send(event, order=make_order(room=room))
+    content = client.get(metrics_url(event), HTTP_AUTHORIZATION=AUTH).content.decode()
+    assert instrumentation.metrics() == {}
+    assert "roomsharing_receiver" not in content
@@ -0,0 +1,86 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pretix.base.models import Event
+
+from pretix_roomsharing.checkoutflow import RoomJoinForm, RoomStep
+from pretix_roomsharing.invites import (
+    make_invite_token,
+    read_invite_token,
+    remembered_invite,
+    room_for_invite,
+)
+from pretix_roomsharing.signals import order_info
+
+
+@pytest.mark.django_db
+def test_invite_token(event, room):
+    token = make_invite_token(room)
+    with CaptureQueriesContext(connection) as ctx:
+        room_id, version = read_invite_token(event, token)
+        assert read_invite_token(event, token[:-1]) is None
+        assert read_invite_token(event, "garbage") is None
+    assert not ctx.captured_queries
+    assert room_id == room.pk
+    assert room_for_invite(event, token) == room
+
+    other = Event.objects.create(
+        organizer=event.organizer,
+        name="Other",
+        slug="other",
+        date_from=event.date_from,
+    )
+    assert read_invite_token(other, token) is None
+
+    room.password = "changed"
+    room.save()
+    assert room_for_invite(event, token) is None
+    assert room_for_invite(event, make_invite_token(room)) == room
+
+
+@pytest.mark.django_db
+def test_join_form_invite(event, room):
+    form = RoomJoinForm(
+        event=event, data={"join-invite": make_invite_token(room)}, prefix="join"
+    )
+    with CaptureQueriesContext(connection) as ctx:
+        assert form.is_valid()
+    assert len(ctx.captured_queries) == 1
+    assert form.cleaned_data["room"] == room
+
+    token = make_invite_token(room)
+    room.password = "changed"
+    room.save()
+    form = RoomJoinForm(event=event, data={"join-invite": token}, prefix="join")
+    assert not form.is_valid()
+    assert "name" in form.errors
+
+
+@pytest.mark.django_db
+def test_checkout_invite(event, item, room, client, checkout_request):
+    event.live = True
+    event.save()
+    token = make_invite_token(room)
+    response = client.get(
+        "/%s/%s/room/invite/%s/" % (event.organizer.slug, event.slug, token)
+    )
+    assert response.status_code == 302
+    assert client.session["pretix_roomsharing_invite_%d" % event.pk] == token
+
+    request = checkout_request(event, {"room_mode": "join", "join-invite": token})
+    request.session["pretix_roomsharing_invite_%d" % event.pk] = token
+    assert remembered_invite(request) == token
+    step = RoomStep(event)
+    step.get_next_url = lambda request: "/"
+    response = step.post(request)
+    assert response.status_code == 302
+    assert request.session["carts"]["benchmark"]["room_join"] == room.pk
+
+
+@pytest.mark.django_db
+def test_order_info_invite_link(event, room, make_order):
+    admin = make_order(room=room, is_admin=True)
+    member = make_order(room=room)
+    link = "/room/invite/%s/" % make_invite_token(room)
+    assert link in order_info(event, order=admin)
+    assert link not in order_info(event, order=member)
@@ -0,0 +1,38 @@
+import pytest
+from django.db import IntegrityError, transaction
+from pretix.base.models import Order
+from pretix.base.signals import order_canceled
+
+from pretix_roomsharing.models import RoomOccupancy
+from pretix_roomsharing.occupancy import refresh_occupancy
+
+
+@pytest.mark.django_db
+def test_refresh_occupancy(event, room, make_order):
+    make_order(room=room, is_admin=True, positions=2)
+    make_order(room=room, status=Order.STATUS_PENDING)
+    make_order(room=room, status=Order.STATUS_EXPIRED)
+
+    refresh_occupancy([room.pk])
+    assert RoomOccupancy.objects.get(room=room, subevent=None).size == 3
+
+    # Rows without a subevent are unique as well
+    with pytest.raises(IntegrityError), transaction.atomic():
+        RoomOccupancy.objects.create(room=room, subevent=None, size=3)
+
+
+@pytest.mark.django_db
+def test_occupancy_follows_order_status(event, room, make_order):
+    make_order(room=room, is_admin=True)
+    o = make_order(room=room)
+    refresh_occupancy([room.pk])
+    assert RoomOccupancy.objects.get(room=room).size == 2
+
+    o.status = Order.STATUS_CANCELED
+    o.save()
+    order_canceled.send(event, order=o)
+    assert RoomOccupancy.objects.get(room=room).size == 1
+
+    room.orderrooms.all().delete()
+    refresh_occupancy([room.pk])
+    assert not RoomOccupancy.objects.filter(room=room).exists()
@@ -0,0 +1,292 @@
+import base64
+import json
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from hierarkey.proxy import dirty_cache_keys
+from pretix.base.models import CartPosition, Order, OrderPosition
+from pretix.base.signals import order_canceled
+from rest_framework.test import APIClient
+
+from pretix_roomsharing.checkoutflow import RoomStep
+from pretix_roomsharing.exporters import RoomingListExporter
+from pretix_roomsharing.fragments import bump_order_version
+from pretix_roomsharing.models import OrderRoom, Room
+from pretix_roomsharing.signals import order_info, placed_order
+
+# Every code path below is run against a small and a large event and has to
+# need the same number of queries for both. The large event has ten times the
+# rooms, three times the members per room and twice the positions per order.
+
+
+@pytest.fixture
+def events(locmem_cache, build_event):
+    small = build_event(slug="small", rooms=3, orders_per_room=2, unroomed=2)
+    large = build_event(
+        slug="large",
+        rooms=30,
+        orders_per_room=6,
+        unroomed=20,
+        positions=2,
+        capacity=20,
+    )
+    # Settings written in a transaction are read from the database until it is
+    # committed, which never happens within a test. Read them from the cache,
+    # like in production.
+    dirty_cache_keys.set(set())
+    return small, large
+
+
+def assert_constant_queries(events, prepare):
+    """
+    Calls ``prepare(event)`` for every event and measures the queries of the
+    function it returns, after running it once to warm up caches. Returns the
+    number of queries.
+    """
+    for event in events:
+        prepare(event)()
+    counts = []
+    for event in events:
+        fn = prepare(event)
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        counts.append(len(ctx))
+    assert counts[0] == counts[1], "\n".join(
+        q["sql"][:150] for q in ctx.captured_queries
+    )
+    return counts[0]
+
+
+def full_room(event):
+    """
+    Returns the first room of the event that still has members.
+    """
+    return (
+        event.rooms.filter(orderrooms__isnull=False)
+        .select_related("subevent")
+        .order_by("name")
+        .first()
+    )
+
+
+def admin_order(event):
+    return Order.objects.get(orderroom__room=full_room(event), orderroom__is_admin=True)
+
+
+def control_url(event, path):
+    return "/control/event/%s/%s/%s" % (event.organizer.slug, event.slug, path)
+
+
+def api_url(event, path):
+    return "/api/v1/organizers/%s/events/%s/%s" % (
+        event.organizer.slug,
+        event.slug,
+        path,
+    )
+
+
+@pytest.fixture
+def carts(events):
+    for event in events:
+        CartPosition.objects.create(
+            event=event,
+            cart_id="benchmark",
+            item=event.items.first(),
+            subevent=full_room(event).subevent,
+            price=Decimal("23.00"),
+            expires=now() + timedelta(minutes=10),
+        )
+
+
+def room_step(event):
+    step = RoomStep(event)
+    step.get_next_url = lambda request: "/"
+    return step
+
+
+@pytest.mark.django_db
+def test_order_info(events):
+    def prepare(event):
+        order = admin_order(event)
+        # Measure rendering the panel, not reading it from the cache
+        bump_order_version(order.pk)
+        return lambda: order_info(event, order=order)
+
+    assert assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_room_step_is_completed(events, carts, checkout_request):
+    def prepare(event):
+        request = checkout_request(
+            event, session={"room_mode": "join", "room_join": full_room(event).pk}
+        )
+        return lambda: room_step(event).is_completed(request)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_room_step_post(events, carts, checkout_request):
+    def prepare(event):
+        request = checkout_request(
+            event,
+            {
+                "room_mode": "join",
+                "join-name": full_room(event).name,
+                "join-password": "secret",
+            },
+        )
+        return lambda: room_step(event).post(request)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_placed_order(events, django_capture_on_commit_callbacks):
+    def prepare(event):
+        order = Order.objects.filter(event=event, orderroom__isnull=True).first()
+        order.meta_info = json.dumps(
+            {"room_mode": "join", "room_join": full_room(event).pk}
+        )
+        order.save()
+
+        def place():
+            with django_capture_on_commit_callbacks(execute=True):
+                placed_order(event, order=order)
+
+        return place
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_order_canceled(events):
+    def prepare(event):
+        order = Order.objects.filter(event=event, orderroom__isnull=False).last()
+        order.status = Order.STATUS_CANCELED
+        order.save()
+        return lambda: order_canceled.send(event, order=order)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "path",
+    [
+        "rooms/",
+        "rooms/?status=full",
+        "rooms/stats/",
+        "rooms/select2/?query=room",
+        "roomsharing/",
+    ],
+)
+def test_control_views(events, control_client, path):
+    def prepare(event):
+        return lambda: control_client.get(control_url(event, path))
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_room_detail(events, control_client):
+    def prepare(event):
+        url = control_url(event, "rooms/%d/" % full_room(event).pk)
+        return lambda: control_client.get(url)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_room_delete(events, control_client):
+    def prepare(event):
+        url = control_url(event, "rooms/%d/delete" % full_room(event).pk)
+        return lambda: control_client.post(url)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_control_order_room_change(events, control_client):
+    def prepare(event):
+        url = control_url(event, "orders/%s/room" % admin_order(event).code)
+        return lambda: control_client.get(url)
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_metrics_view(events, client, settings):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_USER = "metrics"
+    settings.METRICS_PASSPHRASE = "secret"
+    auth = "Basic " + base64.b64encode(b"metrics:secret").decode()
+
+    def prepare(event):
+        url = "/metrics/rooms/%s/%s/" % (event.organizer.slug, event.slug)
+        # Measure computing the metrics, not reading the snapshot
+        event.cache.delete("roomsharing_metrics")
+        return lambda: client.get(url, HTTP_AUTHORIZATION=auth)
+
+    assert assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_api_list(events, organizer):
+    team = organizer.teams.create(all_events=True, all_event_permissions=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION="Token " + team.tokens.create(name="t").token)
+
+    def prepare(event):
+        return lambda: client.get(api_url(event, "rooms/"))
+
+    assert_constant_queries(events, prepare)
+
+
+@pytest.mark.django_db
+def test_rooming_list_export(events):
+    def prepare(event):
+        exporter = RoomingListExporter(event, event.organizer)
+        return lambda: list(exporter.iterate_list({"include_pending": True}))
+
+    assert_constant_queries(events, prepare)
+
+
+def query_plan(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def assert_uses_index(qs, table):
+    plan = query_plan(qs)
+    assert any(
+        step.startswith("SEARCH %s USING" % table) and "INDEX" in step for step in plan
+    ), plan
+    assert not any(step.startswith("SCAN %s" % table) for step in plan), plan
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(
+    connection.vendor != "sqlite", reason="Checks SQLite query plans only"
+)
+def test_lookups_use_indexes(event, room, make_order):
+    order = make_order(room=room)
+    rooms = Room._meta.db_table
+    orderrooms = OrderRoom._meta.db_table
+
+    assert_uses_index(event.rooms.filter(name="Room 1"), rooms)
+    assert_uses_index(event.rooms.by_name("room 1"), rooms)
+    assert_uses_index(event.rooms.filter(subevent=None), rooms)
+    assert_uses_index(event.rooms.search("room").order_by("name_key"), rooms)
+    assert_uses_index(OrderRoom.objects.filter(room=room), orderrooms)
+    assert_uses_index(OrderRoom.objects.filter(order=order), orderrooms)
+    assert_uses_index(
+        OrderPosition.objects.filter(order__orderroom__room=room),
+        orderrooms,
+    )
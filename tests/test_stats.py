@@ -0,0 +1,143 @@
+import base64
+import pytest
+from decimal import Decimal
+from pretix.base.models import Event, Order, OrderRefund
+
+from pretix_roomsharing.models import OrderRoom, Room
+from pretix_roomsharing.signals import orderroom_metrics
+from pretix_roomsharing.stats import TICKET_STATS, TicketStats, get_metrics
+
+
+@pytest.mark.django_db
+def test_ticket_stats_single_query(
+    event, item, room, make_order, django_assert_num_queries
+):
+    room2 = Room.objects.create(event=event, name="Room 2")
+    make_order(room=room, is_admin=True, positions=2)
+    make_order(room=room)
+    make_order(room=room2, status=Order.STATUS_PENDING)
+    make_order()
+    make_order(status=Order.STATUS_CANCELED)
+
+    with django_assert_num_queries(1):
+        stats = TicketStats(event)
+
+    assert stats.by_item("tickets_paid")[item.pk][None] == 4
+    assert stats.by_subevent("tickets_pending")[None][item.pk] == 1
+    assert stats.by_room("tickets_approved")[True][None] == 4
+    assert stats.by_room("tickets_approved")[False][None] == 2
+    assert stats.by_unique_room("tickets_approved")[True][None] == 2
+
+    m = stats.metrics()
+    assert (
+        m["tickets_approved"]['{item="%s",subevent="None",hasroom="True"}' % item.pk]
+        == 4
+    )
+    assert (
+        m["tickets_approved_unique_rooms"]['{item="%s",subevent="None"}' % item.pk] == 2
+    )
+    assert m["tickets_canceled"]['{item="%s",subevent="None"}' % item.pk] == 1
+    assert "tickets_denied" not in m
+
+
+@pytest.mark.django_db
+def test_metrics_snapshot(
+    locmem_cache, event, item, room, make_order, django_assert_num_queries
+):
+    make_order(room=room)
+    content = get_metrics(event)
+    assert '{item="%s",subevent="None",hasroom="True"} 1' % item.pk in content
+
+    with django_assert_num_queries(0):
+        assert get_metrics(event) == content
+
+    # Invalidated by the new order, but still within the maximum age
+    make_order(room=room)
+    assert get_metrics(event) == content
+
+    event.settings.roomsharing__metrics_max_age = 0
+    content = get_metrics(event)
+    assert '{item="%s",subevent="None",hasroom="True"} 2' % item.pk in content
+
+
+@pytest.mark.django_db
+def test_metrics_invalidation(
+    locmem_cache, event, item, room, make_order, django_assert_num_queries
+):
+    event.settings.roomsharing__metrics_max_age = 0
+    order = make_order(status=Order.STATUS_CANCELED)
+    sample = 'tickets_canceled_refunded{item="%s",subevent="None"} 1' % item.pk
+    assert sample not in get_metrics(event)
+
+    order.refunds.create(
+        state=OrderRefund.REFUND_STATE_DONE,
+        source=OrderRefund.REFUND_SOURCE_ADMIN,
+        amount=Decimal("23.00"),
+        provider="manual",
+    )
+    assert sample in get_metrics(event)
+
+    # Room membership changes do not need to load the room's event
+    orderroom = OrderRoom.objects.create(order=make_order(), room=room)
+    orderroom = OrderRoom.objects.get(pk=orderroom.pk)
+    with django_assert_num_queries(1):
+        orderroom_metrics(OrderRoom, instance=orderroom)
+
+
+@pytest.mark.django_db
+def test_multi_event_metrics(
+    settings,
+    client,
+    event,
+    item,
+    room,
+    make_order,
+    build_event,
+    django_assert_num_queries,
+):
+    settings.METRICS_ENABLED = True
+    settings.METRICS_USER = "metrics"
+    settings.METRICS_PASSPHRASE = "secret"
+    auth = "Basic " + base64.b64encode(b"metrics:secret").decode()
+    make_order(room=room)
+    build_event(slug="other", rooms=2, orders_per_room=2, unroomed=1)
+    disabled = build_event(slug="disabled", rooms=1, unroomed=1)
+    disabled.plugins = ""
+    disabled.save()
+
+    response = client.get("/metrics/rooms/dummy/", HTTP_AUTHORIZATION=auth)
+    assert response["Content-Type"].startswith("application/openmetrics-text")
+    # One query for the events and one per metric, no matter how many events
+    metrics = len(TICKET_STATS) + len([d for d in TICKET_STATS if d.get("cliq")])
+    with django_assert_num_queries(1 + metrics):
+        content = b"".join(response.streaming_content).decode()
+
+    assert (
+        'tickets_approved{organizer="dummy",event="dummy",item="%s",subevent="None",'
+        'hasroom="True"} 1' % item.pk
+    ) in content
+    assert 'tickets_approved_unique_rooms{organizer="dummy",event="other",' in content
+    assert 'event="disabled"' not in content
+    assert content.count("# TYPE tickets_approved gauge\n") == 1
+    assert content.endswith("# EOF\n")
+
+    # Same samples as the metrics of a single event
+    other = 'organizer="dummy",event="other",'
+    samples = sorted(
+        line.replace(other, "") for line in content.splitlines() if other in line
+    )
+    expected = TicketStats(Event.objects.get(slug="other")).metrics()
+    assert samples == sorted(
+        "%s%s %s" % (metric, labels, value)
+        for metric, values in expected.items()
+        for labels, value in values.items()
+    )
+
+    response = client.get("/metrics/rooms/", HTTP_AUTHORIZATION=auth)
+    assert 'event="other"' in b"".join(response.streaming_content).decode()
+
+    assert client.get("/metrics/rooms/dummy/").status_code == 401
+    assert client.get("/metrics/rooms/unknown/").status_code == 401
+    assert client.get("/metrics/rooms/dummy/unknown/").status_code == 401
+    response = client.get("/metrics/rooms/unknown/", HTTP_AUTHORIZATION=auth)
+    assert response.status_code == 404